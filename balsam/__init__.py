@@ -38,6 +38,16 @@ def setup():
         django.setup()
 
 
+def module_command(module):
+    '''argv that runs a Balsam module with this interpreter. Modules imported
+    from a zipapp (balsam prestage) have no file on disk and run with -m'''
+    from importlib.util import find_spec
+    origin = find_spec(module).origin
+    if os.path.isfile(origin):
+        return [sys.executable, origin]
+    return [sys.executable, '-m', module]
+
+
 _logger = logging.getLogger()
 _logger.setLevel(logging.DEBUG)
 _logger = logging.getLogger(__name__)
@@ -85,4 +95,4 @@ def log_uncaught_exceptions(exctype, value, tb):
 
 
 sys.excepthook = log_uncaught_exceptions
-__all__ = ['config_logging', 'settings', 'setup']
+__all__ = ['config_logging', 'module_command', 'settings', 'setup']
@@ -4,7 +4,6 @@ import os
 import json
 import logging
 import re
-import numpy as np
 import socket
 import time
 import threading
@@ -17,8 +16,8 @@ from pprint import pformat
 from balsam import setup
 setup()
 
-from django.core.exceptions import ValidationError, ObjectDoesNotExist
-from django.db.utils import OperationalError
+from django.core.exceptions import ValidationError, ObjectDoesNotExist, MultipleObjectsReturned
+from django.db.utils import OperationalError, ProgrammingError
 from django.conf import settings
 from django.db import models, transaction
 from django.db.models import Value as V
@@ -131,7 +130,8 @@ def utilization_report(time_data=None):
         endCounts[t] *= -1
     merged = sorted(list(startCounts.items()) + list(endCounts.items()),
                     key = lambda x: x[0])
-    counts = np.fromiter((x[1] for x in merged), dtype=np.int)
+    import numpy as np
+    counts = np.fromiter((x[1] for x in merged), dtype=int)
 
     times = [x[0] for x in merged]
     running = np.cumsum(counts)
@@ -145,7 +145,8 @@ def throughput_report(time_data=None):
     done_times = time_data.get('RUN_DONE', [])
     doneCounts = sorted(list(Counter(done_times).items()),key=lambda x:x[0])
     times = [x[0] for x in doneCounts]
-    counts = np.cumsum(np.fromiter((x[1] for x in doneCounts), dtype=np.int))
+    import numpy as np
+    counts = np.cumsum(np.fromiter((x[1] for x in doneCounts), dtype=int))
     return (times, counts)
 
 
@@ -157,6 +158,7 @@ def error_report(time_data=None):
     if not err_times:
         return
     time0 = min(err_times)
+    import numpy as np
     err_seconds = np.array([(t-time0).total_seconds() for t in err_times])
     hmin, hmax = 0, max(err_seconds)
     bins = np.arange(hmin, hmax+60, 60)
@@ -243,46 +245,87 @@ class QueuedLaunch(models.Model):
     def __str__(self):
         return repr(self)
 
+    SCHEDULER_FIELDS = {
+        'project': 'project',
+        'queue': 'queue',
+        'nodes': 'nodes',
+        'wall_minutes': 'wall_time_min',
+        'state': 'state',
+        'command': 'command',
+    }
+
+    @classmethod
+    def _scheduler_values(cls, job):
+        return {field: cls._meta.get_field(field).to_python(job[key])
+                for field, key in cls.SCHEDULER_FIELDS.items()}
+
+    @staticmethod
+    def match_scheduler_rows(saved_jobs, stats):
+        '''Pair QueuedLaunch rows with scheduler status entries. An entry
+        stands for job['array_count'] (default 1) launches; elements of a job
+        array are interchangeable, so an element that Slurm has given its own
+        id takes over any row still filed under the array id. Returns
+        ([(row, job_id, job)], [(job_id, job)] without a row, leftover rows)'''
+        by_id = defaultdict(list)
+        for saved_job in saved_jobs:
+            by_id[saved_job.scheduler_id].append(saved_job)
+        matched, unmatched = [], []
+        for job_id, job in stats.items():
+            rows = by_id[job_id]
+            for i in range(job.get('array_count', 1)):
+                if rows:
+                    matched.append((rows.pop(), job_id, job))
+                else:
+                    unmatched.append((job_id, job))
+        new_jobs = []
+        for job_id, job in unmatched:
+            rows = by_id[job.get('array_id')]
+            if rows:
+                matched.append((rows.pop(), job_id, job))
+            else:
+                new_jobs.append((job_id, job))
+        leftover = [row for rows in by_id.values() for row in rows]
+        return matched, new_jobs, leftover
+
     @classmethod
     @transaction.atomic
-    def refresh_from_scheduler(cls):
+    def refresh_from_scheduler(cls, max_age=None):
+        '''Reconcile QueuedLaunch rows with the scheduler status (reused if
+        polled within max_age seconds): only new and changed rows are written'''
         from balsam.service.schedulers import scheduler
-        saved_jobs = list(cls.objects.all())
-        saved_job_ids = [j.scheduler_id for j in saved_jobs]
-        stats = scheduler.status_dict()
-        for job_id, job in stats.items():
-            if job_id not in saved_job_ids:
-                j = cls(scheduler_id=job_id,
-                        project=job['project'],
-                        queue=job['queue'],
-                        nodes=job['nodes'],
-                        wall_minutes=job['wall_time_min'],
-                        state=job['state'],
-                        command=job['command'],
-                        from_balsam=False)
-                j.save()
+        stats = scheduler.status_dict(max_age=max_age)
+        matched, unmatched, leftover = cls.match_scheduler_rows(cls.objects.all(), stats)
+        new_jobs, changed_jobs = [], []
+        for job_id, job in unmatched:
+            values = cls._scheduler_values(job)
+            new_jobs.append(cls(scheduler_id=job_id, from_balsam=False, **values))
+        for saved_job, job_id, job in matched:
+            values = cls._scheduler_values(job)
+            values['scheduler_id'] = job_id
+            changed = {k: v for k, v in values.items() if getattr(saved_job, k) != v}
+            if not changed:
+                continue
+            if 'state' in changed:
+                logger.info(f'Updating batch job {job_id}: state {changed["state"]}')
+            for field, value in changed.items():
+                setattr(saved_job, field, value)
+            changed_jobs.append(saved_job)
+        if new_jobs:
+            cls.objects.bulk_create(new_jobs)
+            for j in new_jobs:
                 logger.info(f'Detected new job: {j}')
-            else:
-                saved_job = saved_jobs[saved_job_ids.index(job_id)]
-                if job['state'] != saved_job.state:
-                    logger.info(f'Updating batch job {job_id}: state {job["state"]}')
-                saved_job.state = job['state']
-                saved_job.project = job['project']
-                saved_job.queue = job['queue']
-                saved_job.nodes = job['nodes']
-                saved_job.wall_minutes = job['wall_time_min']
-                saved_job.command = job['command']
-                saved_job.save()
-        delete_ids = [id for id in saved_job_ids if id not in stats.keys()]
-        cls.objects.filter(scheduler_id__in=delete_ids).delete()
-        if delete_ids:
-            logger.info(f'Deleting Jobs {delete_ids} no longer in scheduler')
+        if changed_jobs:
+            cls.objects.bulk_update(changed_jobs, ['scheduler_id'] + list(cls.SCHEDULER_FIELDS))
+        if leftover:
+            cls.objects.filter(pk__in=[j.pk for j in leftover]).delete()
+            logger.info(f'Deleting Jobs {[j.scheduler_id for j in leftover]} no longer in scheduler')
 
 
 class JobSource(models.Manager):
 
     TICK_PERIOD = timedelta(minutes=1)
     EXPIRATION_PERIOD = timedelta(minutes=3)
+    COMPACT_PERIOD = timedelta(minutes=1)
 
     def __init__(self, workflow=None):
         super().__init__()
@@ -291,6 +334,8 @@ class JobSource(models.Manager):
         self._pid = None
         self.qLaunch = None
         self._checked_qLaunch = False
+        self._state_counts_missing = False
+        self._compacted = None
 
     def check_qLaunch(self):
         from balsam.service.schedulers import JobEnv
@@ -298,7 +343,7 @@ class JobSource(models.Manager):
         if sched_id is not None:
             try:
                 self.qLaunch = QueuedLaunch.objects.get(scheduler_id=sched_id)
-            except ObjectDoesNotExist:
+            except (ObjectDoesNotExist, MultipleObjectsReturned):
                 self.qLaunch = None
         if self.qLaunch is not None:
             if not (self.qLaunch.prescheduled_only and self.qLaunch.from_balsam):
@@ -330,6 +375,36 @@ class JobSource(models.Manager):
             queryset = queryset.filter(workflow__contains=self.workflow)
         return queryset
 
+    def state_counts(self):
+        '''Dict of job counts by state (matching the workflow filter) read from
+        the trigger-maintained counter table; None if the table is missing.
+        Folds the table's delta rows together at most every COMPACT_PERIOD.'''
+        if self._state_counts_missing:
+            return None
+        now = timezone.now()
+        compact = self._compacted is None or now - self._compacted >= self.COMPACT_PERIOD
+        sql = f'SELECT state, SUM(count) FROM {STATE_COUNT_TABLE}'
+        params = []
+        if self.workflow:
+            sql += " WHERE workflow LIKE %s"
+            pattern = re.sub(r'([\\%_])', r'\\\1', self.workflow)
+            params.append(f"%{pattern}%")
+        sql += ' GROUP BY state'
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    if compact:
+                        cursor.execute('SELECT balsam_compact_state_counts()')
+                    cursor.execute(sql, params)
+                    rows = cursor.fetchall()
+        except ProgrammingError:
+            logger.info(f'{STATE_COUNT_TABLE} is not installed: counting jobs with queries')
+            self._state_counts_missing = True
+            return None
+        if compact:
+            self._compacted = now
+        return {state: int(count) for state, count in rows if count}
+
     def by_states(self, states):
         if isinstance(states, str):
             states = [states]
@@ -772,6 +847,36 @@ class BalsamJob(models.Model):
             update_jobs = safe_select(update_jobs)
             update_jobs.update(**update_kwargs)
 
+    @classmethod
+    def batch_update_state_messages(cls, pk_messages, new_state, chunk_size=1000):
+        '''Like batch_update_state, but with a distinct history message per job.
+
+        ``pk_messages`` is a list of (pk, message) pairs.  Each chunk is written
+        with a single ``UPDATE ... FROM (VALUES ...)`` statement.  USER_KILLED
+        jobs are left untouched.  Returns the number of rows updated.'''
+        if new_state not in STATES:
+            raise InvalidStateError(f"{new_state} is not a job state in balsam.models")
+        table = cls._meta.db_table
+        num_updated = 0
+        for i in range(0, len(pk_messages), chunk_size):
+            chunk = pk_messages[i:i+chunk_size]
+            values = ', '.join(['(%s::uuid, %s)'] * len(chunk))
+            params = [new_state]
+            for pk, message in chunk:
+                params.extend([str(pk), history_line(new_state, message)])
+            sql = (
+                f'UPDATE {table} AS job SET state = %s, '
+                f'state_history = job.state_history || v.msg '
+                f'FROM (VALUES {values}) AS v(job_id, msg) '
+                f"WHERE job.job_id = v.job_id AND job.state <> 'USER_KILLED'"
+            )
+            with transaction.atomic():
+                safe_select(cls.objects.filter(job_id__in=[pk for pk, _ in chunk]))
+                with connection.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    num_updated += cursor.rowcount
+        return num_updated
+
     def update_state(self, new_state, message='', release=False):
         if new_state not in STATES:
             raise InvalidStateError(f"{new_state} is not a job state in balsam.models")
@@ -888,3 +993,138 @@ class ApplicationDefinition(models.Model):
     @property
     def cute_id(self):
         return f"[{self.name} | { str(self.pk)[:8] }]"
+
+
+KILL_CHANNEL = 'balsam_killed'
+
+KILL_TRIGGER_SQL = f'''
+CREATE OR REPLACE FUNCTION balsam_notify_killed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{KILL_CHANNEL}', NEW.job_id::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS balsam_killed ON {{table}};
+CREATE TRIGGER balsam_killed AFTER UPDATE OF state ON {{table}}
+    FOR EACH ROW
+    WHEN (NEW.state = 'USER_KILLED' AND OLD.state IS DISTINCT FROM 'USER_KILLED')
+    EXECUTE PROCEDURE balsam_notify_killed();
+'''
+
+
+STATE_COUNT_TABLE = 'balsam_state_counts'
+
+# The counter table is an append-only log of (workflow, state, delta) rows
+# written by statement-level triggers from the transition tables: writers
+# only ever INSERT, so concurrent transactions never wait on (or deadlock
+# over) a shared counter row.  Readers SUM the deltas, and
+# balsam_compact_state_counts() periodically folds them into one row per
+# (workflow, state).
+STATE_COUNT_SQL = f'''
+DROP TRIGGER IF EXISTS balsam_state_counts ON {{table}};
+DROP TABLE IF EXISTS {STATE_COUNT_TABLE};
+CREATE TABLE {STATE_COUNT_TABLE} (
+    workflow text NOT NULL,
+    state text NOT NULL,
+    count bigint NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION balsam_count_states() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO {STATE_COUNT_TABLE} (workflow, state, count)
+            SELECT workflow, state, count(*) FROM new_rows GROUP BY workflow, state;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO {STATE_COUNT_TABLE} (workflow, state, count)
+            SELECT workflow, state, -count(*) FROM old_rows GROUP BY workflow, state;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO {STATE_COUNT_TABLE} (workflow, state, count)
+            SELECT workflow, state, sum(delta) FROM (
+                SELECT workflow, state, 1 AS delta FROM new_rows
+                UNION ALL
+                SELECT workflow, state, -1 AS delta FROM old_rows
+            ) AS deltas
+            GROUP BY workflow, state HAVING sum(delta) <> 0;
+    ELSE
+        DELETE FROM {STATE_COUNT_TABLE};
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION balsam_compact_state_counts() RETURNS void AS $$
+BEGIN
+    IF pg_try_advisory_xact_lock(hashtext('{STATE_COUNT_TABLE}')) THEN
+        WITH folded AS (
+            DELETE FROM {STATE_COUNT_TABLE} RETURNING workflow, state, count
+        )
+        INSERT INTO {STATE_COUNT_TABLE} (workflow, state, count)
+            SELECT workflow, state, sum(count) FROM folded
+            GROUP BY workflow, state HAVING sum(count) <> 0;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS balsam_state_counts_insert ON {{table}};
+CREATE TRIGGER balsam_state_counts_insert AFTER INSERT ON {{table}}
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE balsam_count_states();
+DROP TRIGGER IF EXISTS balsam_state_counts_update ON {{table}};
+CREATE TRIGGER balsam_state_counts_update AFTER UPDATE ON {{table}}
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE balsam_count_states();
+DROP TRIGGER IF EXISTS balsam_state_counts_delete ON {{table}};
+CREATE TRIGGER balsam_state_counts_delete AFTER DELETE ON {{table}}
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE balsam_count_states();
+DROP TRIGGER IF EXISTS balsam_state_counts_truncate ON {{table}};
+CREATE TRIGGER balsam_state_counts_truncate AFTER TRUNCATE ON {{table}}
+    FOR EACH STATEMENT EXECUTE PROCEDURE balsam_count_states();
+
+LOCK TABLE {{table}} IN SHARE ROW EXCLUSIVE MODE;
+INSERT INTO {STATE_COUNT_TABLE} (workflow, state, count)
+    SELECT workflow, state, count(*) FROM {{table}} GROUP BY workflow, state;
+'''
+
+
+def install_triggers():
+    '''Create the DB triggers used by the launcher (safe to re-run)
+
+    Re-running rebuilds the per-workflow, per-state job counts from scratch.'''
+    table = BalsamJob._meta.db_table
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(KILL_TRIGGER_SQL.format(table=table))
+            cursor.execute(STATE_COUNT_SQL.format(table=table))
+
+
+class KillFeed:
+    '''Change feed of jobs marked USER_KILLED
+
+    Holds a dedicated connection that LISTENs on ``KILL_CHANNEL``; the
+    ``balsam_killed`` trigger notifies it with the job_id of every job that
+    enters USER_KILLED.  ``poll()`` only reads pending notifications from the
+    socket and never issues a query.'''
+
+    def __init__(self):
+        import psycopg2
+        db = settings.DATABASES['default']
+        self.conn = psycopg2.connect(
+            dbname=db['NAME'], user=db['USER'], password=db['PASSWORD'],
+            host=db['HOST'], port=db['PORT'],
+            **db.get('OPTIONS', {})
+        )
+        self.conn.autocommit = True
+        with self.conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {KILL_CHANNEL}')
+
+    def poll(self):
+        '''Set of job_id strings killed since the last poll'''
+        self.conn.poll()
+        killed = {note.payload for note in self.conn.notifies}
+        self.conn.notifies.clear()
+        return killed
+
+    def close(self):
+        self.conn.close()
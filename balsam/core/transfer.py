@@ -3,6 +3,8 @@ import subprocess
 import logging
 import glob
 import os
+import shutil
+import tempfile
 import traceback
 try:
     import urlparse
@@ -135,7 +137,21 @@ class LocalHandler:
               shell=True)
       stdout,stderr = p.communicate()
       if p.returncode != 0:
-         raise Exception("Error in stage_out: %d output:\n" % (p.returncode,stdout))
+         raise Exception("Error in stage_out: %d output:\n%s" % (p.returncode,stdout))
+
+   def stage_out_files(self, paths, destination_url):
+      if destination_url.strip().startswith('local:'):
+          dest = ''.join(destination_url.split(':')[1:])
+      else:
+          dest = destination_url
+      dest = validate_path(dest)
+      assert os.path.isdir(dest), f'{dest} is not a valid destination directory'
+
+      command = ['cp', '-r', *paths, dest]
+      logger.debug(f'transfer.stage_out_files: {len(paths)} paths to {dest}')
+      p = subprocess.run(command,stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+      if p.returncode != 0:
+         raise Exception("Error in stage_out: %d output:\n%s" % (p.returncode,p.stdout))
 
 # - SCP implementation
 SCP_PROTOCOL='scp'
@@ -159,6 +175,13 @@ class SCPHandler:
       if ret:
          raise Exception("Error in stage_out: %d" % ret)
 
+   def stage_out_files( self, paths, destination_url ):
+      command = ['scp', '-p', '-r', *paths, destination_url]
+      logger.debug('transfer.stage_out_files: command=' + ' '.join(command))
+      ret = subprocess.call(command)
+      if ret:
+         raise Exception("Error in stage_out: %d" % ret)
+
 
 # - Generic interface
 
@@ -186,3 +209,80 @@ def stage_out(source_directory, destination_url):
     handler = get_handler(destination_url)
     handler.pre_stage_hook()
     handler.stage_out(source_directory, destination_url)
+
+
+def link_or_copy(src, dst):
+    '''Place src at dst without duplicating data where the filesystem allows:
+    hardlink first, then an in-kernel copy_file_range (reflinked on CoW
+    filesystems), then a regular copy.  dst must not exist: an existing dst
+    may itself be a hardlink to job output, so it is never opened for writing'''
+    try:
+        os.link(src, dst)
+        return
+    except FileExistsError:
+        raise
+    except OSError:
+        pass
+    # O_EXCL: fails instead of writing through an existing link
+    with open(src, 'rb') as fsrc, open(dst, 'xb') as fdst:
+        if hasattr(os, 'copy_file_range'):
+            try:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            except OSError:
+                fdst.seek(0)
+                fdst.truncate()
+            else:
+                if remaining == 0:
+                    fdst.close()
+                    shutil.copystat(src, dst)
+                    return
+            fsrc.seek(0)
+        shutil.copyfileobj(fsrc, fdst)
+    shutil.copystat(src, dst)
+
+
+def path_size(path):
+    '''Total bytes under a file or directory'''
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def stage_out_manifest(paths, destination_url, staging_top=None):
+    '''Transfer an explicit list of paths to destination_url
+
+    Handlers that accept a file list receive the paths directly.  Otherwise,
+    the paths are linked into a temporary staging directory under
+    ``staging_top`` (on the same filesystem, so that hardlinks apply) and the
+    directory is transferred.  Returns the number of bytes moved.'''
+    paths = list(dict.fromkeys(os.path.normpath(p) for p in paths))
+    names = [os.path.basename(p) for p in paths]
+    collisions = sorted({n for n in names if names.count(n) > 1})
+    if collisions:
+        raise ValueError(f'Stage-out paths share basenames {collisions}: '
+                         f'they would overwrite each other at {destination_url}')
+    handler = get_handler(destination_url)
+    handler.pre_stage_hook()
+    num_bytes = sum(path_size(p) for p in paths)
+
+    if hasattr(handler, 'stage_out_files'):
+        handler.stage_out_files(paths, destination_url)
+        return num_bytes
+
+    with tempfile.TemporaryDirectory(dir=staging_top, prefix='.stageout_') as stagingdir:
+        for src in paths:
+            dst = os.path.join(stagingdir, os.path.basename(src))
+            if os.path.isdir(src):
+                shutil.copytree(src, dst, copy_function=link_or_copy)
+            else:
+                link_or_copy(src, dst)
+        handler.stage_out(stagingdir, destination_url)
+    return num_bytes
@@ -12,22 +12,30 @@ interrupts, so that they can finish the current transition and exit gracefully,
 under control of the main Launcher process.
 '''
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout, redirect_stderr
+from fnmatch import fnmatch
 import glob
+from importlib import import_module
+from itertools import count
+from math import ceil
 import multiprocessing
 import os
 from io import StringIO
 from traceback import print_exc
 import random
+import re
 import signal
-import shutil
 import subprocess
+import sys
+import threading
 import time
-import tempfile
 
 from django import db
 from django.db.models.functions import Cast, Substr
 from django.db.models import CharField
 
+from balsam import module_command
 from balsam.core import transfer
 from balsam.core.models import BalsamJob, PROCESSABLE_STATES
 from balsam.launcher.util import get_tail
@@ -36,12 +44,35 @@ import logging
 logger = logging.getLogger(__name__)
 
 JOBCACHE_LIMIT = 1000
+JOBCACHE_MIN_REFILL = 16
+REFRESH_PERIOD = 5
 PREPROCESS_TIMEOUT_SECONDS = 300
 POSTPROCESS_TIMEOUT_SECONDS = 300
+STAGE_IN_THREADS = 16
+LISTING_CACHE_LIMIT = 20000
 EXIT_FLAG = False
 
+HOOK_PATTERN = re.compile(r'^[A-Za-z_][\w.]*:[A-Za-z_]\w*$')
+
+# Cache priority classes, ordered by how soon the transition unblocks compute:
+# (name, states, share of each refill)
+PRIORITY_CLASSES = [
+    ('runnable-soon', ['READY', 'STAGED_IN'], 0.5),
+    ('postprocess', ['RUN_DONE', 'RUN_ERROR', 'RUN_TIMEOUT', 'POSTPROCESSED'], 0.3),
+    ('dependencies', ['CREATED', 'AWAITING_PARENTS'], 0.2),
+]
+STATE_PRIORITY = {state: i for i, (_, states, _) in enumerate(PRIORITY_CLASSES)
+                  for state in states}
+assert set(STATE_PRIORITY) == set(PROCESSABLE_STATES)
+
+_io_pool = None
+_listing_cache = {}
+_hook_cache = {}
+_hooks_isolated = False  # set in transition processes: see select_runner
+
 
 class BalsamTransitionError(Exception): pass
+class HookTimeout(Exception): pass
 
 
 def handler(signum, stack):
@@ -72,15 +103,13 @@ class TransitionProcessPool:
         logger.info("All Transition processes joined: done.")
 
 
-@db.transaction.atomic
 def fail_update(failed_jobs):
-    for job in failed_jobs:
-        try:
-            failmsg = job.__fail_msg
-        except AttributeError:
-            failmsg = ''
-        job.refresh_from_db()
-        job.update_state('FAILED', failmsg)
+    start = time.time()
+    pk_messages = [(job.pk, getattr(job, '__fail_msg', '')) for job in failed_jobs]
+    num_failed = BalsamJob.batch_update_state_messages(pk_messages, 'FAILED')
+    elapsed = time.time() - start
+    logger.info(f"Marked {num_failed} of {len(failed_jobs)} jobs FAILED "
+                f"in {elapsed:.3f} seconds")
 
 
 def update_states_from_cache(job_cache):
@@ -101,7 +130,84 @@ def update_states_from_cache(job_cache):
         BalsamJob.batch_update_state(joblist, newstate)
 
 
-def select_range(num_threads, thread_idx):
+class JobCache:
+    '''Locked BalsamJobs held by one transition process
+
+    Iteration visits jobs in priority order: jobs about to become runnable,
+    then postprocessing, then dependency checks (FIFO within a class).  The
+    size of each refill adapts to how fast the cache drained since the last
+    one, so a process only holds locks on as many jobs as it can work through.'''
+    def __init__(self, limit=JOBCACHE_LIMIT, min_refill=JOBCACHE_MIN_REFILL):
+        self.limit = limit
+        self.min_refill = min_refill
+        self.drain_rate = 0.0
+        self._num_refills = 0
+        self._jobs = {}
+        self._seq = {}
+        self._counter = count()
+        self._num_released = 0
+        self._last_refill = time.time()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __iter__(self):
+        jobs = sorted(self._jobs.values(), key=self._priority)
+        return iter(jobs)
+
+    def _priority(self, job):
+        return STATE_PRIORITY.get(job.state, len(PRIORITY_CLASSES)), self._seq[job.pk]
+
+    def add(self, jobs):
+        for job in jobs:
+            if job.pk not in self._jobs:
+                self._seq[job.pk] = next(self._counter)
+            self._jobs[job.pk] = job
+
+    def remove(self, pks):
+        for pk in pks:
+            if self._jobs.pop(pk, None) is not None:
+                del self._seq[pk]
+                self._num_released += 1
+
+    def refill_size(self):
+        '''Number of jobs to acquire now.  The first refill fills the cache;
+        afterwards, about two refresh periods' worth at the observed drain rate
+        (seeded from how fast the first batch drained)'''
+        now = time.time()
+        elapsed = max(now - self._last_refill, 1e-3)
+        rate = self._num_released / elapsed
+        self._num_released = 0
+        self._last_refill = now
+
+        free = self.limit - len(self)
+        self._num_refills += 1
+        if self._num_refills == 1:
+            return free
+        if self._num_refills == 2:
+            self.drain_rate = rate
+        else:
+            self.drain_rate = 0.5*self.drain_rate + 0.5*rate
+        target = ceil(2 * self.drain_rate * REFRESH_PERIOD)
+        return min(free, max(target, self.min_refill))
+
+    def class_counts(self):
+        counts = defaultdict(int)
+        for job in self._jobs.values():
+            idx = STATE_PRIORITY.get(job.state)
+            name = PRIORITY_CLASSES[idx][0] if idx is not None else job.state
+            counts[name] += 1
+        return dict(counts)
+
+
+def class_quotas(num_jobs):
+    '''Split num_jobs among PRIORITY_CLASSES by share; rounding goes to the first class'''
+    quotas = [int(num_jobs * share) for (_, _, share) in PRIORITY_CLASSES]
+    quotas[0] += num_jobs - sum(quotas)
+    return quotas
+
+
+def select_range(num_threads, thread_idx, limit=JOBCACHE_LIMIT):
     HEX_DIGITS = '0123456789abcdef'
     chunk, rem = divmod(len(HEX_DIGITS), num_threads)
     start, end = thread_idx*chunk, (thread_idx+1)*chunk
@@ -111,21 +217,44 @@ def select_range(num_threads, thread_idx):
 
     manager = BalsamJob.source
     processable = manager.by_states(PROCESSABLE_STATES).filter(lock='')
-    processable = processable.order_by('-state') # put AWAITING_PARENTS last to avoid starvation
-    logger.debug(f"There are {processable.count()} processable jobs")
     if num_threads == 1:
         qs = processable
     else:
         qs = processable.annotate(first_pk_char=Substr(Cast('pk', CharField(max_length=36)) , 1, 1))
         qs = qs.filter(first_pk_char__in=my_digits)
-    qs = qs.values_list('pk', flat=True)[:JOBCACHE_LIMIT]
-    logger.debug(f"TransitionThread{thread_idx} select:\n{qs.query}")
-    return list(qs)
 
-
-def refresh_cache(job_cache, num_threads, thread_idx):
+    # Fill each priority class up to its quota; unused quota carries over to
+    # the next class, so dependency checks still get slots when nothing else is waiting
+    selected = []
+    carry = 0
+    saturated = []
+    for (name, states, _), quota in zip(PRIORITY_CLASSES, class_quotas(limit)):
+        num = quota + carry
+        if num <= 0:
+            continue
+        pks = list(qs.filter(state__in=states).values_list('pk', flat=True)[:num])
+        carry = num - len(pks)
+        if carry == 0:
+            saturated.append((name, states))
+        selected.extend(pks)
+        logger.debug(f"TransitionThread{thread_idx} selected {len(pks)} of {num} {name} jobs")
+
+    # Quota left over by the last classes goes back to earlier classes that
+    # filled theirs and may still have jobs waiting
+    for name, states in saturated:
+        if carry <= 0:
+            break
+        pks = list(qs.filter(state__in=states).exclude(pk__in=selected)
+                   .values_list('pk', flat=True)[:carry])
+        carry -= len(pks)
+        selected.extend(pks)
+        logger.debug(f"TransitionThread{thread_idx} selected {len(pks)} more {name} jobs")
+    return selected
+
+
+def refresh_cache(job_cache, num_threads, thread_idx, limit=JOBCACHE_LIMIT):
     manager = BalsamJob.source
-    to_acquire = select_range(num_threads, thread_idx)
+    to_acquire = select_range(num_threads, thread_idx, limit)
     logger.debug(f"TransitionThread{thread_idx} will try to acquire: {[str(id)[:8] for id in to_acquire]}")
     acquired = manager.acquire(to_acquire)
 
@@ -136,7 +265,7 @@ def refresh_cache(job_cache, num_threads, thread_idx):
     if acquired:
         logger.debug(f'Acquired {len(acquired)} new jobs')
         acquired = BalsamJob.objects.filter(pk__in=acquired)
-        job_cache.extend(acquired)
+        job_cache.add(acquired)
     for job in job_cache:
         job.__old_state = job.state
 
@@ -150,13 +279,15 @@ def release_jobs(job_cache):
     ]
     if release_jobs:
         manager.release(release_jobs)
-    return [j for j in job_cache if j.pk not in release_jobs]
+    job_cache.remove(release_jobs)
+    return job_cache
 
 
 def main(thread_idx, num_threads, wf_name):
-    global EXIT_FLAG
+    global EXIT_FLAG, _hooks_isolated
     signal.signal(signal.SIGINT, handler)
     signal.signal(signal.SIGTERM, handler)
+    _hooks_isolated = True
 
     manager = BalsamJob.source
     manager.workflow = wf_name
@@ -178,16 +309,18 @@ def main(thread_idx, num_threads, wf_name):
 def _main(thread_idx, num_threads):
     global EXIT_FLAG
     manager = BalsamJob.source
-    job_cache = []
+    job_cache = JobCache()
     last_refresh = 0
-    refresh_period = 5
 
     while not EXIT_FLAG:
         # Update in-memory cache of locked BalsamJobs
         elapsed = time.time() - last_refresh
-        if elapsed > refresh_period:
-            if len(job_cache) < JOBCACHE_LIMIT:
-                refresh_cache(job_cache, num_threads, thread_idx)
+        if elapsed > REFRESH_PERIOD:
+            refill = job_cache.refill_size()
+            if refill > 0:
+                refresh_cache(job_cache, num_threads, thread_idx, refill)
+            logger.debug(f"TransitionThread{thread_idx} cache: {job_cache.class_counts()} "
+                         f"(drain rate {job_cache.drain_rate:.2f} jobs/sec)")
             last_refresh = time.time()
         else:
             time.sleep(1)
@@ -295,6 +428,93 @@ def fast_forward(job_cache):
     update_states_from_cache(job_cache)
 
 
+def get_io_pool():
+    '''Thread pool for filesystem-bound work; created lazily in each process'''
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=STAGE_IN_THREADS)
+    return _io_pool
+
+
+def list_dir(path):
+    '''Names in a parent working directory, cached by directory mtime
+
+    Every child in a wide fan-in re-uses the parent's listing for the cost of
+    one stat; a parent that is reset and rerun changes the directory mtime
+    when it creates or removes files, which forces a fresh scan'''
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except (FileNotFoundError, NotADirectoryError):
+        _listing_cache.pop(path, None)
+        return []
+    cached = _listing_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        with os.scandir(path) as entries:
+            names = [entry.name for entry in entries]
+    except (FileNotFoundError, NotADirectoryError):
+        names = []
+    if len(_listing_cache) >= LISTING_CACHE_LIMIT:
+        _listing_cache.clear()
+    _listing_cache[path] = (mtime, names)
+    return names
+
+
+def _match_pattern(parent_dir, names, pattern):
+    if os.sep in pattern:
+        return glob.glob(os.path.join(parent_dir, pattern))
+    if not pattern.startswith('.'):
+        names = (name for name in names if not name.startswith('.'))
+    return [os.path.join(parent_dir, name) for name in names
+            if fnmatch(name, pattern)]
+
+
+def match_parent_files(parents, input_patterns):
+    '''Return [(parent_pk, path)] for files matching input_patterns in each
+    parent's working directory; directory scans run concurrently'''
+    if not input_patterns:
+        return []
+    parent_dirs = [parent.working_directory for parent in parents]
+    listings = get_io_pool().map(list_dir, parent_dirs)
+
+    matches = []
+    for parent, parent_dir, names in zip(parents, parent_dirs, listings):
+        seen = set()
+        for pattern in input_patterns:
+            for path in _match_pattern(parent_dir, names, pattern):
+                if path not in seen:
+                    seen.add(path)
+                    matches.append((parent.pk, path))
+    return matches
+
+
+def plan_symlinks(matches, work_dir):
+    '''Assign each match a unique link name in work_dir, resolving collisions
+    in memory with a parent-id suffix.  Returns [(src, dst)]'''
+    taken = set(os.listdir(work_dir))
+    links = []
+    for parent_pk, inp_file in matches:
+        name = os.path.basename(inp_file)
+        if name in taken:
+            name += f"_{str(parent_pk)[:8]}"
+        if name in taken:
+            logger.warning(f"Symlink {name} already exists in {work_dir}; skipping creation")
+            continue
+        taken.add(name)
+        links.append((inp_file, os.path.join(work_dir, name)))
+    return links
+
+
+def _symlink(src, dst):
+    # pointing to src, named dst
+    logger.debug(f"{dst}  -->  {src}")
+    try:
+        os.symlink(src=src, dst=dst)
+    except FileExistsError:
+        logger.warning(f"Symlink at {dst} already exists; skipping creation")
+
+
 def stage_in(job):
     logger.debug(f'{job.cute_id} in stage_in')
 
@@ -317,33 +537,25 @@ def stage_in(job):
 
     # create unique symlinks to "input_files" patterns from parents
     # TODO: handle data flow from remote sites transparently
-    matches = []
-    parents = job.get_parents()
+    start = time.time()
+    parents = list(job.get_parents())
     input_patterns = job.input_files.split()
     logger.debug(f"{job.cute_id} searching parent workdirs for {input_patterns}")
-    for parent in parents:
-        parent_dir = parent.working_directory
-        for pattern in input_patterns:
-            path = os.path.join(parent_dir, pattern)
-            matches.extend((parent.pk, match)
-                           for match in glob.glob(path))
+    matches = match_parent_files(parents, input_patterns)
+    links = plan_symlinks(matches, work_dir)
 
-    for parent_pk, inp_file in matches:
-        basename = os.path.basename(inp_file)
-        new_path = os.path.join(work_dir, basename)
-
-        if os.path.exists(new_path):
-            new_path += f"_{str(parent_pk)[:8]}"
-        # pointing to src, named dst
-        logger.info(f"{job.cute_id}   {new_path}  -->  {inp_file}")
+    pool = get_io_pool()
+    futures = [pool.submit(_symlink, src, dst) for src, dst in links]
+    for future in futures:
         try:
-            os.symlink(src=inp_file, dst=new_path)
-        except FileExistsError:
-            logger.warning(f"Symlink at {new_path} already exists; skipping creation")
+            future.result()
         except Exception as e:
             raise BalsamTransitionError(
                 f"Exception received during symlink: {e}") from e
 
+    elapsed = time.time() - start
+    logger.info(f"{job.cute_id} stage_in: linked {len(links)} files from "
+                f"{len(parents)} parents in {elapsed:.3f} seconds")
     job.state = 'STAGED_IN'
     logger.debug(f"{job.cute_id} stage_in done")
 
@@ -365,25 +577,133 @@ def stage_out(job):
     for pattern in stage_out_patterns:
         path = os.path.join(work_dir, pattern)
         matches.extend(glob.glob(path))
+    matches = list(dict.fromkeys(matches))
 
     if matches:
         logger.info(f"{job.cute_id} stage out files: {matches}")
-        with tempfile.TemporaryDirectory() as stagingdir:
-            try:
-                for f in matches:
-                    base = os.path.basename(f)
-                    dst = os.path.join(stagingdir, base)
-                    shutil.copyfile(src=f, dst=dst)
-                    logger.info(f"staging {f} out for transfer")
-                logger.info(f"transferring to {url_out}")
-                transfer.stage_out(f"{stagingdir}/*", f"{url_out}/")
-            except Exception as e:
-                message = f'Exception received during stage_out: {e}'
-                raise BalsamTransitionError(message) from e
+        start = time.time()
+        try:
+            logger.info(f"transferring to {url_out}")
+            num_bytes = transfer.stage_out_manifest(
+                matches, f"{url_out}/", staging_top=work_dir)
+        except Exception as e:
+            message = f'Exception received during stage_out: {e}'
+            raise BalsamTransitionError(message) from e
+        elapsed = time.time() - start
+        logger.info(f"{job.cute_id} stage_out: moved {num_bytes} bytes in "
+                    f"{len(matches)} paths in {elapsed:.3f} seconds")
     job.state = 'JOB_FINISHED'
     logger.debug(f'{job.cute_id} stage_out done')
 
 
+def is_python_hook(spec):
+    '''True if a pre/postprocess spec names a ``module:function`` callable'''
+    return bool(HOOK_PATTERN.match(spec.strip()))
+
+
+def load_hook(spec):
+    spec = spec.strip()
+    if spec not in _hook_cache:
+        module_name, func_name = spec.split(':')
+        try:
+            func = getattr(import_module(module_name), func_name)
+        except (ImportError, AttributeError) as e:
+            raise BalsamTransitionError(f"Cannot load hook {spec}: {e}") from e
+        _hook_cache[spec] = func
+    return _hook_cache[spec]
+
+
+def _alarm_handler(signum, stack):
+    raise HookTimeout
+
+
+def run_hook(spec, job, outfile, envs, timeout, header=''):
+    '''Call a ``module:function`` pre/postprocess hook on ``job`` in-process
+
+    The hook runs in the job working directory, with the job's Balsam
+    environment variables overlaid on ``os.environ`` and stdout/stderr captured
+    to ``outfile``, just as a script would.  Returns 0 on success, 1 if the
+    hook raised (the traceback is written to ``outfile``), or the code passed
+    to ``sys.exit`` (1 unless it is an int).'''
+    func = load_hook(spec)
+    saved_environ = os.environ.copy()
+    saved_cwd = os.getcwd()
+    use_alarm = threading.current_thread() is threading.main_thread()
+    old_handler = None
+
+    dag = sys.modules.get('balsam.launcher.dag')
+    retcode = 0
+    with open(outfile, 'w') as fp:
+        fp.write(header)
+        fp.flush()
+        try:
+            os.environ.update(envs)
+            os.chdir(job.working_directory)
+            if dag is not None:
+                dag._bind(job, timeout=envs.get('BALSAM_JOB_TIMEOUT') == 'TRUE',
+                          error=envs.get('BALSAM_JOB_ERROR') == 'TRUE')
+            if use_alarm:
+                old_handler = signal.signal(signal.SIGALRM, _alarm_handler)
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+            logger.info(f"{job.cute_id} calling hook {spec}")
+            with redirect_stdout(fp), redirect_stderr(fp):
+                func(job)
+        except HookTimeout:
+            fp.write(f"\n# Hook {spec} timed out after {timeout} seconds\n")
+            retcode = 1
+        except SystemExit as e:
+            retcode = e.code if isinstance(e.code, int) else 1
+            fp.write(f"\n# Hook {spec} called sys.exit({e.code!r}): return code {retcode}\n")
+        except Exception:
+            print_exc(file=fp)
+            retcode = 1
+        finally:
+            if old_handler is not None:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, old_handler)
+            os.chdir(saved_cwd)
+            os.environ.clear()
+            os.environ.update(saved_environ)
+    return retcode
+
+
+def hook_command(spec):
+    '''Command line that calls a ``module:function`` hook in its own process'''
+    return ' '.join(module_command('balsam.launcher.dag') + [spec.strip()])
+
+
+def select_runner(app):
+    '''(runner, app) for a pre/postprocess spec.  Hooks change os.environ, the
+    cwd and sys.stdout, and are timed out with SIGALRM, so they only run
+    in-process on the main thread of a transition process, which handles one
+    job at a time.  Anywhere else they run as a script'''
+    if not is_python_hook(app):
+        return run_script, app
+    if _hooks_isolated and threading.current_thread() is threading.main_thread():
+        return run_hook, app
+    return run_script, hook_command(app)
+
+
+def run_script(app, job, outfile, envs, timeout, header=''):
+    '''Run a pre/postprocess script in the job working directory; return its exit code'''
+    with open(outfile, 'w') as fp:
+        fp.write(header)
+        fp.flush()
+        args = app.split()
+        logger.info(f"{job.cute_id} Popen {args}")
+        proc = subprocess.Popen(args, stdout=fp,
+                                stderr=subprocess.STDOUT, env=envs,
+                                cwd=job.working_directory,
+                                )
+        try:
+            retcode = proc.wait(timeout=timeout)
+            proc.communicate()
+        except:
+            proc.kill()
+            raise
+    return retcode
+
+
 def preprocess(job):
     logger.debug(f'{job.cute_id} in preprocess')
 
@@ -393,7 +713,8 @@ def preprocess(job):
         job.state = 'PREPROCESSED'
         return
 
-    if not os.path.exists(preproc_app.split()[0]):
+    is_hook = is_python_hook(preproc_app)
+    if not is_hook and not os.path.exists(preproc_app.split()[0]):
         # TODO: look for preproc in the EXE directories
         message = f"Preprocessor {preproc_app} does not exist on filesystem"
         raise BalsamTransitionError(message)
@@ -403,25 +724,13 @@ def preprocess(job):
 
     # Run preprocesser with special environment in job working directory
     out = os.path.join(job.working_directory, f"preprocess.log")
-    with open(out, 'w') as fp:
-        fp.write(f"# Balsam Preprocessor: {preproc_app}")
-        fp.flush()
-        try:
-            args = preproc_app.split()
-            logger.info(f"{job.cute_id} preprocess Popen {args}")
-            proc = subprocess.Popen(args, stdout=fp,
-                                    stderr=subprocess.STDOUT, env=envs,
-                                    cwd=job.working_directory,
-                                    )
-            retcode = proc.wait(timeout=PREPROCESS_TIMEOUT_SECONDS)
-            proc.communicate()
-        except Exception as e:
-            message = f"Preprocess failed: {e}"
-            try:
-                proc.kill()
-            except:
-                pass
-            raise BalsamTransitionError(message) from e
+    header = f"# Balsam Preprocessor: {preproc_app}\n"
+    run, app = select_runner(preproc_app)
+    try:
+        retcode = run(app, job, out, envs, PREPROCESS_TIMEOUT_SECONDS, header)
+    except Exception as e:
+        message = f"Preprocess failed: {e}"
+        raise BalsamTransitionError(message) from e
 
     if retcode != 0:
         tail = get_tail(out)
@@ -458,7 +767,8 @@ def postprocess(job, *, error_handling=False, timeout_handling=False):
             logger.debug(f'{job.cute_id} no postprocess: skipped')
             return
 
-    if not os.path.exists(postproc_app.split()[0]):
+    is_hook = is_python_hook(postproc_app)
+    if not is_hook and not os.path.exists(postproc_app.split()[0]):
         # TODO: look for postproc in the EXE directories
         message = f"Postprocessor {postproc_app} does not exist on filesystem"
         raise BalsamTransitionError(message)
@@ -468,30 +778,17 @@ def postprocess(job, *, error_handling=False, timeout_handling=False):
 
     # Run postprocesser with special environment in job working directory
     out = os.path.join(job.working_directory, f"postprocess.log")
-    with open(out, 'w') as fp:
-        fp.write(f"# Balsam Postprocessor: {postproc_app}\n")
-        if timeout_handling:
-            fp.write("# Invoked to handle RUN_TIMEOUT\n")
-        if error_handling:
-            fp.write("# Invoked to handle RUN_ERROR\n")
-        fp.flush()
-
-        try:
-            args = postproc_app.split()
-            logger.info(f"{job.cute_id} postprocess Popen {args}")
-            proc = subprocess.Popen(args, stdout=fp,
-                                    stderr=subprocess.STDOUT, env=envs,
-                                    cwd=job.working_directory,
-                                    )
-            retcode = proc.wait(timeout=POSTPROCESS_TIMEOUT_SECONDS)
-            proc.communicate()
-        except Exception as e:
-            message = f"Postprocess failed: {e}"
-            try:
-                proc.kill()
-            except:
-                pass
-            raise BalsamTransitionError(message) from e
+    header = f"# Balsam Postprocessor: {postproc_app}\n"
+    if timeout_handling:
+        header += "# Invoked to handle RUN_TIMEOUT\n"
+    if error_handling:
+        header += "# Invoked to handle RUN_ERROR\n"
+    run, app = select_runner(postproc_app)
+    try:
+        retcode = run(app, job, out, envs, POSTPROCESS_TIMEOUT_SECONDS, header)
+    except Exception as e:
+        message = f"Postprocess failed: {e}"
+        raise BalsamTransitionError(message) from e
 
     if retcode != 0:
         tail = get_tail(out, nlines=30)
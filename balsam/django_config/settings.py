@@ -1,14 +1,34 @@
 import json
 import os
+import pkgutil
 import sys
-import shutil
 import tempfile
+import zipfile
+import zipimport
 from balsam.django_config.serverinfo import ServerInfo
 
 home_dir = os.path.expanduser('~')
 BALSAM_HOME = os.path.join(home_dir, '.balsam')
 
 
+# Default config files are read with pkgutil so that they also resolve when
+# Balsam is imported from a zipapp (balsam prestage)
+def _package_listing(subdir):
+    '''File names in a data directory of this package, on disk or in a zip'''
+    if isinstance(__loader__, zipimport.zipimporter):
+        prefix = f'{__loader__.prefix}{subdir}/'
+        with zipfile.ZipFile(__loader__.archive) as archive:
+            names = [name[len(prefix):] for name in archive.namelist()
+                     if name.startswith(prefix)]
+        return [name for name in names if name and '/' not in name]
+    return os.listdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), subdir))
+
+
+def _copy_default(resource, dest):
+    with open(dest, 'wb') as fp:
+        fp.write(pkgutil.get_data(__name__, resource))
+
+
 def bootstrap():
     if not os.path.exists(BALSAM_HOME):
         os.makedirs(BALSAM_HOME, mode=0o755)
@@ -19,20 +39,18 @@ def bootstrap():
     user_settings_path = os.path.join(BALSAM_HOME, 'settings.json')
     user_policy_path = os.path.join(BALSAM_HOME, 'theta_policy.ini')
     user_templates_path = os.path.join(BALSAM_HOME, 'job-templates')
-    here = os.path.dirname(os.path.abspath(__file__))
 
-    default_settings_path = os.path.join(here, 'default_settings.json')
-    default_settings = json.load(open(default_settings_path))
+    default_settings = json.loads(pkgutil.get_data(__name__, 'default_settings.json'))
 
     if not os.path.exists(user_settings_path):
-        shutil.copy(default_settings_path, user_settings_path)
+        _copy_default('default_settings.json', user_settings_path)
         print("Set up your Balsam config directory at", BALSAM_HOME)
     if not os.path.exists(user_policy_path):
-        default_policy_path = os.path.join(here, 'theta_policy.ini')
-        shutil.copy(default_policy_path, user_policy_path)
+        _copy_default('theta_policy.ini', user_policy_path)
     if not os.path.exists(user_templates_path):
-        default_templates_path = os.path.join(here, 'job-templates')
-        shutil.copytree(default_templates_path, user_templates_path)
+        os.makedirs(user_templates_path)
+        for name in _package_listing('job-templates'):
+            _copy_default(f'job-templates/{name}', os.path.join(user_templates_path, name))
     if not os.path.exists(migrations_path):
         os.makedirs(migrations_path, mode=0o755)
         with open(os.path.join(migrations_path, '__init__.py'), 'w') as fp:
@@ -43,7 +61,7 @@ def bootstrap():
             assert key in user_settings
     except (AssertionError, json.decoder.JSONDecodeError):
         print(f"Detected invalid settings in {user_settings_path}; replacing with defaults!")
-        shutil.copy(default_settings_path, user_settings_path)
+        _copy_default('default_settings.json', user_settings_path)
         user_settings = json.load(open(user_settings_path))
 
     thismodule = sys.modules[__name__]
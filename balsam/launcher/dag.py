@@ -99,6 +99,19 @@ if JOB_ID:
         parents = current_job.get_parents()
         children = current_job.get_children()
 
+
+def _bind(job, *, timeout=False, error=False):
+    '''Point the module-level attributes at ``job``.  Used by the Launcher when
+    a pre/postprocess hook is called in-process rather than as a script'''
+    global JOB_ID, TIMEOUT, ERROR, current_job, parents, children
+    JOB_ID = job.pk
+    TIMEOUT = timeout
+    ERROR = error
+    current_job = job
+    parents = job.get_parents()
+    children = job.get_children()
+
+
 def add_job(
         name, workflow, application,
         description='', args='', mpi_flags='',
@@ -421,3 +434,12 @@ def submit(project='datascience',queue='debug-flat-quad',nodes=1,wall_minutes=30
     mylaunch.prescheduled_only=False
     mylaunch.save()
     service.submit_qlaunch(mylaunch, verbose=True)
+
+
+if __name__ == "__main__":
+    # python -m balsam.launcher.dag module:function
+    # calls a pre/postprocess hook on current_job in a separate process
+    import sys
+    from balsam.core.transitions import load_hook
+    from balsam.launcher import dag
+    load_hook(sys.argv[1])(dag.current_job)
@@ -13,29 +13,34 @@ actions and is guaranteed to execute only once through the EXIT_FLAG global
 flag.
 '''
 from collections import defaultdict
-from importlib.util import find_spec
+from concurrent.futures import ThreadPoolExecutor
 import logging
-from math import floor
+from math import ceil, floor
 from datetime import datetime
 import os
-import sys
+import queue
 import signal
 import subprocess
 import shlex
+import threading
 import time
 
-from django import db
-from balsam import config_logging, settings, setup
+IMPORT_START = time.time()
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Sum
+from balsam import config_logging, module_command, settings, setup
 from balsam.core import transitions
 from balsam.launcher import worker
 from balsam.launcher.util import (
-    remaining_time_minutes, delay_generator, get_tail
+    remaining_time_minutes, delay_generator, get_tail, StartupTimer
     )
 from balsam.service.schedulers import JobEnv
-from balsam.scripts.cli import config_launcher_subparser
+from balsam.scripts.cli import check_launcher_args, config_launcher_subparser
 from balsam.core import models
 
 logger = logging.getLogger('balsam.launcher.launcher')
+startup = StartupTimer()
+startup.mark('python startup', IMPORT_START)
+startup.mark('imports')
 BalsamJob = models.BalsamJob
 EXIT_FLAG = False
 
@@ -46,8 +51,6 @@ def sig_handler(signum, stack):
 
 
 class MPIRun:
-    RUN_DELAY = 0.10  # 1000 jobs / 100 sec
-
     # TODO(KGF): extend to encapsulate scheduler-dependent quirks of starting/signaling/etc.
     # an application (e.g. do not directly kill app in Slurm; use scancel).
     # The goal is to encapsulate every platform-specific detail in a separate cluster
@@ -57,9 +60,10 @@ class MPIRun:
     # mpirun.poll()  # check status
     # mpirun.terminate() # send friendly term signal
     # mpirun.force_kill()  # send force-kill signal
-    def __init__(self, job, workers):
+    def __init__(self, job, workers, cpus=None):
         self.job = job
         self.workers = workers
+        self.cpus = cpus
         for w in self.workers:
             w.idle = False
 
@@ -77,40 +81,267 @@ class MPIRun:
         mpi_str = mpi_cmd(workers, app_cmd=app_cmd, envs={},
                           num_ranks=nranks, ranks_per_node=rpn,
                           cpu_affinity=affinity, threads_per_rank=tpr,
-                          threads_per_core=tpc, mpi_flags=mpi_flags)
+                          threads_per_core=tpc, mpi_flags=mpi_flags,
+                          cpus=cpus)
         basename = job.name
         outname = os.path.join(job.working_directory, f"{basename}.out")
         self.outfile = open(outname, 'w+b')
         envscript = job.envscript
         if envscript:
-            args = ' '.join(['source', envscript, '&&', mpi_str])
-            shell = True
+            self.args = ' '.join(['source', envscript, '&&', mpi_str])
+            self.shell = True
         else:
-            args = shlex.split(mpi_str)
-            shell = False
-        logger.info(f"{job.cute_id} Popen (shell={shell}):\n{args}\n on workers: {workers}")
-        self.process = subprocess.Popen(
-                args=args,
-                cwd=job.working_directory,
-                stdout=self.outfile,
-                stderr=subprocess.STDOUT,
-                shell=shell,
-                env=envs,
-                )
+            self.args = shlex.split(mpi_str)
+            self.shell = False
+        self.envs = envs
+        self.process = None
+        self.start_time = None
+        self.startup_observed = False
+        self.notified = False
         self.current_state = 'RUNNING'
         self.err_msg = None
-        time.sleep(self.RUN_DELAY)
+
+    def start(self):
+        '''Popen the run; returns False (and marks RUN_ERROR) if it cannot be started
+
+        Called from dispatch threads, so a failed run keeps its workers: the
+        caller frees them on the main thread, since the WorkerGroup is not
+        thread-safe.'''
+        job = self.job
+        logger.info(f"{job.cute_id} Popen (shell={self.shell}):\n{self.args}\n on workers: {self.workers}")
+        try:
+            self.process = subprocess.Popen(
+                    args=self.args,
+                    cwd=job.working_directory,
+                    stdout=self.outfile,
+                    stderr=subprocess.STDOUT,
+                    shell=self.shell,
+                    env=self.envs,
+                    )
+        except OSError as e:
+            logger.error(f"{job.cute_id} failed to start: {e}")
+            self.current_state = 'RUN_ERROR'
+            self.err_msg = f"Failed to start MPI run: {e}"
+            self.outfile.close()
+            return False
+        self.start_time = time.time()
+        return True
+
+    def notify_checkpoint(self, signum=None, filename=None):
+        '''Ask the job to checkpoint: touch ``filename`` in its working
+        directory and/or send it ``signum``'''
+        self.notified = True
+        if filename:
+            path = os.path.join(self.job.working_directory, filename)
+            try:
+                with open(path, 'a'):
+                    os.utime(path)
+            except OSError as e:
+                logger.warning(f"{self.job.cute_id} could not touch {path}: {e}")
+        if signum is not None and self.process is not None:
+            try:
+                self.process.send_signal(signum)
+            except ProcessLookupError:
+                pass
 
     def free_workers(self):
+        if self.cpus:
+            self.workers[0].release_cpus(self.cpus)
+            self.cpus = None
+            return
         for w in self.workers:
             w.idle = True
 
+    @property
+    def expected_end(self):
+        '''Time at which the job is expected to finish, from its wall_time_minutes'''
+        start = self.start_time if self.start_time is not None else time.time()
+        return start + 60.0 * self.job.wall_time_minutes
+
+
+def terminate_runs(runs, timeout=10):
+    '''SIGTERM runs, give them ``timeout`` seconds to exit, then SIGKILL.
+    Runs that failed to start have no process (and no workers) and are skipped'''
+    runs = [run for run in runs if run.process is not None]
+    for run in runs:
+        run.process.terminate()  # SIGTERM
+    start = time.time()
+    for run in runs:
+        try:
+            run.process.wait(timeout=timeout)
+        except:
+            break
+        if time.time() - start > timeout:
+            break
+    for run in runs:
+        run.process.kill()
+        run.free_workers()
+
+
+def subnode_cores(job, cores_per_node):
+    '''Cores to reserve for a job that can share its node, or None
+
+    Single-node jobs with node_packing_count > 1 take the larger of their
+    required_num_cores and their 1/node_packing_count share of the node.'''
+    if job.num_nodes != 1 or job.node_packing_count <= 1:
+        return None
+    cores = max(job.required_num_cores, ceil(cores_per_node / job.node_packing_count))
+    return cores if cores < cores_per_node else None
+
+
+def _reserve(num_nodes, num_free, running, now):
+    '''Earliest time num_nodes will be free, given (expected_end, num_nodes)
+    for running jobs; returns (start_time, nodes left over at that time)'''
+    available = num_free
+    for end, nodes in sorted(running, key=lambda r: r[0]):
+        available += nodes
+        if available >= num_nodes:
+            return max(end, now), available - num_nodes
+    return float('inf'), 0
+
+
+def easy_backfill(jobs, num_free, running, now):
+    '''EASY backfill selection over ``jobs`` in priority order
+
+    Jobs are started in order while they fit.  The first job that does not fit
+    gets a reservation at the earliest time enough running jobs are expected
+    to end (``running`` is a list of (expected_end, num_nodes)).  Later jobs
+    are backfilled only if they fit now and either end before the reservation
+    or only use nodes that the reserved job will not need.
+
+    Returns (jobs_to_start, reservation); reservation is None or a
+    (job, start_time) pair.'''
+    running = list(running)
+    selected = []
+    reservation = None
+    shadow_time = extra_nodes = None
+    for job in jobs:
+        nodes = job.num_nodes
+        if nodes > num_free:
+            if reservation is None:
+                shadow_time, extra_nodes = _reserve(nodes, num_free, running, now)
+                reservation = (job, shadow_time)
+            continue
+        end = now + 60.0 * job.wall_time_minutes
+        if reservation is None:
+            running.append((end, nodes))
+        elif end <= shadow_time:
+            pass
+        elif nodes <= extra_nodes:
+            extra_nodes -= nodes
+        else:
+            continue
+        selected.append(job)
+        num_free -= nodes
+    return selected, reservation
+
+
+class DispatchThrottle:
+    '''Adaptive cap on the number of MPI runs started per launcher cycle
+
+    A run that cannot be started, or that errors within ``STARTUP_WINDOW``
+    seconds of starting, counts as a startup failure and halves the cap (at
+    most once per window).  Every run that gets through the window raises the
+    cap by one, up to ``maximum``.'''
+    STARTUP_WINDOW = 5.0
+
+    def __init__(self, maximum, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = maximum
+        self._last_backoff = 0.0
+
+    def success(self):
+        self.limit = min(self.maximum, self.limit + 1)
+
+    def failure(self):
+        now = time.time()
+        if now - self._last_backoff < self.STARTUP_WINDOW:
+            return
+        self._last_backoff = now
+        self.limit = max(self.minimum, self.limit // 2)
+        logger.warning(f'MPI run startup failure: dispatching at most {self.limit} runs per cycle')
+
+    def observe(self, run, retcode):
+        '''Classify a run once it has either errored early or outlived the window'''
+        if run.startup_observed or run.start_time is None:
+            return
+        elapsed = time.time() - run.start_time
+        if retcode is not None and retcode != 0 and elapsed < self.STARTUP_WINDOW:
+            run.startup_observed = True
+            self.failure()
+        elif retcode == 0 or elapsed >= self.STARTUP_WINDOW:
+            run.startup_observed = True
+            self.success()
+
+
+class RunReaper(threading.Thread):
+    '''Background thread that reaps exited MPI runs
+
+    Started runs are registered with ``add``; the thread polls them every
+    ``INTERVAL`` seconds and queues ``(run, retcode)`` for each one that has
+    exited.  The launcher loop only handles the queued completions.'''
+    INTERVAL = 0.5
+
+    def __init__(self):
+        super().__init__(name='RunReaper', daemon=True)
+        self.lock = threading.Lock()
+        self.runs = set()
+        self.finished = queue.Queue()
+        self.stop_event = threading.Event()
+
+    def add(self, runs):
+        with self.lock:
+            self.runs.update(run for run in runs if run.process is not None)
+
+    def discard(self, runs):
+        with self.lock:
+            self.runs.difference_update(runs)
+
+    def sweep(self):
+        '''Poll every registered run once and queue the exited ones'''
+        with self.lock:
+            runs = list(self.runs)
+        for run in runs:
+            retcode = run.process.poll()
+            if retcode is not None:
+                with self.lock:
+                    self.runs.discard(run)
+                self.finished.put((run, retcode))
+
+    def collect(self):
+        '''List of (run, retcode) queued since the last call'''
+        finished = []
+        while True:
+            try:
+                finished.append(self.finished.get_nowait())
+            except queue.Empty:
+                return finished
+
+    def run(self):
+        while not self.stop_event.wait(self.INTERVAL):
+            self.sweep()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+
 
 class MPILauncher:
+    JOB_MODE = 'mpi'
+    MPI_ONLY = False
     MAX_CONCURRENT_RUNS = settings.MAX_CONCURRENT_MPIRUNS
+    DISPATCH_THREADS = 16
+    BACKFILL_DEPTH = 100
+    UTILIZATION_REPORT_PERIOD = 60
+    KILL_CHECK_PERIOD = 60
+    COUNTS_MAX_AGE = 1.0
 
     def __init__(self, wf_name, time_limit_minutes, gpus_per_node, persistent,
-                 limit_nodes=None, offset_nodes=None):
+                 limit_nodes=None, offset_nodes=None, backfill=False,
+                 time_margin_minutes=1.0, drain_minutes=0.0, drain_job_minutes=5.0,
+                 checkpoint_minutes=0.0, checkpoint_signal=None, checkpoint_file=None):
         self.jobsource = BalsamJob.source
         self.jobsource.workflow = wf_name
         if wf_name:
@@ -123,14 +354,43 @@ class MPILauncher:
         self.worker_group = worker.WorkerGroup(limit=limit_nodes, offset=offset_nodes)
         self.total_nodes = sum(w.num_nodes for w in self.worker_group)
         os.environ['BALSAM_LAUNCHER_NODES'] = str(self.total_nodes)
-        os.environ['BALSAM_JOB_MODE'] = "mpi"
+        os.environ['BALSAM_JOB_MODE'] = self.JOB_MODE
 
         self.timer = remaining_time_minutes(time_limit_minutes)
+        self.minutes_left = float('inf')
+        self.time_margin_minutes = time_margin_minutes
+        self.drain_minutes = drain_minutes
+        self.drain_job_minutes = drain_job_minutes
+        self.draining = False
+        self.counts, self.counts_time = {}, 0.0
+        self.checkpoint_minutes = checkpoint_minutes
+        self.checkpoint_file = checkpoint_file
+        if checkpoint_signal is None and checkpoint_file is None:
+            checkpoint_signal = signal.SIGTERM
+        self.checkpoint_signal = checkpoint_signal
+        self.checkpointing = False
+        self.checkpoint_stats = defaultdict(int)
         self.is_persistent = persistent
+        self.backfill = backfill
+        if backfill:
+            logger.info('Using EASY backfill scheduling')
         self.delayer = delay_generator()
         self.last_report = 0
         self.exit_counter = 0
+        self.start_time = self.last_util_sample = self.last_util_report = time.time()
+        self.busy_node_seconds = 0.0
         self.mpi_runs = []
+        self.throttle = DispatchThrottle(self.MAX_CONCURRENT_RUNS)
+        self.dispatch_pool = ThreadPoolExecutor(max_workers=self.DISPATCH_THREADS)
+        self.reaper = RunReaper()
+        self.reaper.start()
+        self.last_kill_check = time.time()
+        try:
+            self.kill_feed = models.KillFeed()
+        except Exception as e:
+            logger.warning(f'Cannot listen for killed jobs ({e}); '
+                           f'checking every {self.KILL_CHECK_PERIOD} seconds instead')
+            self.kill_feed = None
         self.jobsource.check_qLaunch()
         if self.jobsource.qLaunch is not None:
             sched_id = self.jobsource.qLaunch.scheduler_id
@@ -149,6 +409,7 @@ class MPILauncher:
             EXIT_FLAG = True
             return
 
+        self.minutes_left = minutes_left
         if minutes_left > 1e12:
             return
         whole_minutes = floor(minutes_left)
@@ -168,20 +429,22 @@ class MPILauncher:
             EXIT_FLAG = True
             logger.info("Out of time; preparing to exit")
             return
+        if self.checkpointing and not self.is_active:
+            EXIT_FLAG = True
+            logger.info("All runs exited after the checkpoint notice; preparing to exit")
+            return
         if not self.is_persistent:
             if self.is_active:
                 # Reset exit counter whenever jobs are running, runable, or transitionble
                 self.exit_counter = 0
                 logger.debug("Some runs are still active; will not quit")
                 return
-            processable = BalsamJob.objects.filter(state__in=models.PROCESSABLE_STATES)
-            if self.jobsource.workflow:
-                processable = processable.filter(workflow__contains=self.jobsource.workflow)
-            if processable.count() > 0:
+            counts = self.state_counts()
+            if any(counts.get(state) for state in models.PROCESSABLE_STATES):
                 self.exit_counter = 0
                 logger.debug("Some BalsamJobs are still transitionable; will not quit")
                 return
-            if self.get_runnable().count() > 0:
+            if self.has_backlog() and self.has_runnable():
                 self.exit_counter = 0
                 return
             else:
@@ -190,15 +453,44 @@ class MPILauncher:
             if self.exit_counter == 10:
                 EXIT_FLAG = True
 
-    def check_state(self, run):
-        retcode = run.process.poll()
-        if retcode is None:
-            run.current_state = 'RUNNING'
-        elif retcode == 0:
+    def state_counts(self):
+        '''Job counts by state for this workflow filter, refreshed at most every
+        COUNTS_MAX_AGE seconds.  Read from the trigger-maintained counter
+        table; DBs without it fall back to a GROUP BY over the job table.'''
+        now = time.time()
+        if now - self.counts_time < self.COUNTS_MAX_AGE:
+            return self.counts
+        counts = self.jobsource.state_counts()
+        if counts is None:
+            jobs = BalsamJob.objects.all()
+            if self.jobsource.workflow:
+                jobs = jobs.filter(workflow__contains=self.jobsource.workflow)
+            counts = dict(jobs.values_list('state').annotate(Count('pk')))
+        self.counts, self.counts_time = counts, now
+        return counts
+
+    def has_backlog(self):
+        '''Whether any job is in a runnable state (regardless of size or lock)'''
+        counts = self.state_counts()
+        return any(counts.get(state) for state in models.RUNNABLE_STATES)
+
+    def record_exit(self, run, retcode):
+        '''Set the final state of a run reaped with ``retcode`` and free its workers'''
+        self.throttle.observe(run, retcode)
+        if retcode == 0:
             logger.info(f"MPIRun {run.job.cute_id} done")
             run.current_state = 'RUN_DONE'
             run.outfile.close()
             run.free_workers()
+            if run.notified:
+                self.checkpoint_stats['finished'] += 1
+        elif run.notified:
+            logger.info(f"MPIRun {run.job.cute_id} checkpointed (exit code {retcode})")
+            run.outfile.close()
+            run.current_state = 'RUN_TIMEOUT'
+            run.err_msg = f"Checkpointed (exit code {retcode}) after time limit notice"
+            run.free_workers()
+            self.checkpoint_stats['checkpointed'] += 1
         else:
             run.process.communicate()
             run.outfile.close()
@@ -207,53 +499,105 @@ class MPILauncher:
             run.err_msg = tail
             logger.info(f"MPIRun {run.job.cute_id} error code {retcode}:\n{tail}")
             run.free_workers()
-        return run.current_state
 
-    def timeout_kill(self, runs, timeout=10):
-        for run in runs:
-            run.process.terminate()  # SIGTERM
+    def dispatch(self, runs):
+        '''Start runs concurrently on the dispatch thread pool'''
+        if not runs:
+            return
         start = time.time()
-        for run in runs:
+        started = list(self.dispatch_pool.map(MPIRun.start, runs))
+        for run, ok in zip(runs, started):
+            if not ok:
+                run.free_workers()
+                self.throttle.failure()
+        elapsed = time.time() - start
+        logger.info(f'Dispatched {sum(started)} of {len(runs)} MPI runs in {elapsed:.3f} seconds')
+
+    def timeout_kill(self, runs, timeout=10):
+        terminate_runs(runs, timeout)
+
+    def check_checkpoint(self):
+        '''At checkpoint_minutes before the deadline, stop dispatching and
+        notify running jobs so they can checkpoint and exit'''
+        if self.checkpointing or self.minutes_left > self.checkpoint_minutes:
+            return
+        self.checkpointing = True
+        running = [run for run in self.mpi_runs
+                   if run.process is not None and run.current_state == 'RUNNING']
+        logger.info(f'{self.minutes_left:.1f} minutes left: no longer dispatching; '
+                    f'sending checkpoint notice to {len(running)} runs')
+        for run in running:
+            run.notify_checkpoint(self.checkpoint_signal, self.checkpoint_file)
+
+    def poll_killed(self, running):
+        '''Running runs whose jobs were marked USER_KILLED
+
+        Relies on the KillFeed notifications; the full IN query over running
+        pks is only a periodic safety net (e.g. a DB without the trigger).'''
+        killed = set()
+        if self.kill_feed is not None:
             try:
-                run.process.wait(timeout=timeout)
-            except:
-                break
-            if time.time() - start > timeout:
-                break
-        for run in runs:
-            run.process.kill()
-            run.free_workers()
+                killed = self.kill_feed.poll()
+            except Exception as e:
+                logger.warning(f'Lost the killed-job feed ({e}); falling back to periodic checks')
+                self.kill_feed = None
+        to_kill = [run for run in running if str(run.job.pk) in killed]
+        now = time.time()
+        if now - self.last_kill_check >= self.KILL_CHECK_PERIOD:
+            self.last_kill_check = now
+            active_pks = [run.job.pk for run in running]
+            killquery = self.jobsource.filter(job_id__in=active_pks, state='USER_KILLED')
+            kill_pks = set(killquery.values_list('job_id', flat=True))
+            to_kill.extend(run for run in running
+                           if run.job.pk in kill_pks and run not in to_kill)
+        return to_kill
 
     def update(self, timeout=False):
+        if timeout:
+            self.reaper.sweep()
+        for run, retcode in self.reaper.collect():
+            if run.current_state == 'RUNNING':
+                self.record_exit(run, retcode)
+
         by_states = defaultdict(list)
         for run in self.mpi_runs:
-            state = self.check_state(run)
-            by_states[state].append(run)
+            if run.current_state == 'RUNNING':
+                self.throttle.observe(run, None)
+            by_states[run.current_state].append(run)
 
         done_pks = [r.job.pk for r in by_states['RUN_DONE']]
         BalsamJob.batch_update_state(done_pks, 'RUN_DONE')
         self.jobsource.release(done_pks)
 
-        error_pks = [r.job.pk for r in by_states['RUN_ERROR']]
-        with db.transaction.atomic():
-            models.safe_select(BalsamJob.objects.filter(pk__in=error_pks))
-            for run in by_states['RUN_ERROR']:
-                run.job.refresh_from_db()
-                run.job.update_state('RUN_ERROR', run.err_msg)
-        self.jobsource.release(error_pks)
+        errors = [(r.job.pk, r.err_msg) for r in by_states['RUN_ERROR']]
+        if errors:
+            BalsamJob.batch_update_state_messages(errors, 'RUN_ERROR')
+            self.jobsource.release([pk for pk, _ in errors])
+
+        checkpointed = [(r.job.pk, r.err_msg) for r in by_states['RUN_TIMEOUT']]
+        if checkpointed:
+            BalsamJob.batch_update_state_messages(checkpointed, 'RUN_TIMEOUT')
+            self.jobsource.release([pk for pk, _ in checkpointed])
 
         active_pks = [r.job.pk for r in by_states['RUNNING']]
         if timeout:
             self.timeout_kill(by_states['RUNNING'])
             BalsamJob.batch_update_state(active_pks, 'RUN_TIMEOUT')
             self.jobsource.release(active_pks)
+            if self.checkpointing:
+                stats = self.checkpoint_stats
+                logger.info(f"After checkpoint notice: {stats['finished']} runs finished, "
+                            f"{stats['checkpointed']} checkpointed, "
+                            f"{len(active_pks)} killed at the deadline")
         else:
-            killquery = self.jobsource.filter(job_id__in=active_pks, state='USER_KILLED')
-            kill_pks  = killquery.values_list('job_id', flat=True)
-            to_kill = [run for run in by_states['RUNNING'] if run.job.pk in kill_pks]
-            self.timeout_kill(to_kill)
-            self.jobsource.release(kill_pks)
-            for run in to_kill: by_states['RUNNING'].remove(run)
+            to_kill = self.poll_killed(by_states['RUNNING'])
+            if to_kill:
+                self.reaper.discard(to_kill)
+                self.timeout_kill(to_kill)
+                self.jobsource.release([run.job.pk for run in to_kill])
+                for run in to_kill:
+                    run.current_state = 'USER_KILLED'
+                    by_states['RUNNING'].remove(run)
 
         if timeout:
             self.mpi_runs = []
@@ -263,18 +607,55 @@ class MPILauncher:
     def get_runnable(self):
         '''queryset: jobs that can finish on idle workers (disregarding time limits)'''
         manager = self.jobsource
-        num_idle = len(self.worker_group.idle_workers())
-        if num_idle == 0:
+        num_idle = self.worker_group.num_idle
+        if num_idle == 0 and self.worker_group.num_shared_cores == 0:
             logger.debug(f'No idle worker nodes to run jobs')
             return manager.none()
         else:
             logger.debug(f'{num_idle} idle worker nodes')
 
+        # Backfill needs to see jobs too large to run now, to reserve nodes for them
+        max_nodes = self.total_nodes if self.backfill else max(num_idle, 1)
         return manager.get_runnable(
-            max_nodes=num_idle,
+            max_nodes=max_nodes,
+            remaining_minutes=self.runnable_time_limit(),
+            mpi_only=self.MPI_ONLY,
             order_by=('-num_nodes', '-wall_time_minutes')
         )
 
+    def has_runnable(self):
+        return self.get_runnable().exists()
+
+    def runnable_time_limit(self):
+        '''Longest wall_time_minutes of a job that can still finish, or None
+
+        Leaves a safety margin before the end of the allocation.  In the
+        final ``drain_minutes``, only jobs up to ``drain_job_minutes`` start.'''
+        if self.minutes_left > 1e12:
+            return None
+        limit = self.minutes_left - self.time_margin_minutes
+        if self.minutes_left <= self.drain_minutes:
+            if not self.draining:
+                logger.info(f'{self.minutes_left:.1f} minutes left: entering drain phase; '
+                            f'only starting jobs of {self.drain_job_minutes} minutes or less')
+                self.draining = True
+            limit = min(limit, self.drain_job_minutes)
+        return max(limit, 0)
+
+    def record_utilization(self, final=False):
+        '''Accumulate busy node-seconds and periodically log node utilization'''
+        now = time.time()
+        busy = self.total_nodes - self.worker_group.num_idle
+        self.busy_node_seconds += busy * (now - self.last_util_sample)
+        self.last_util_sample = now
+        if not final and now - self.last_util_report < self.UTILIZATION_REPORT_PERIOD:
+            return
+        self.last_util_report = now
+        elapsed = max(now - self.start_time, 1e-6)
+        average = self.busy_node_seconds / (self.total_nodes * elapsed)
+        logger.info(f'Node utilization: {busy}/{self.total_nodes} busy now; '
+                    f'{100*average:.1f}% average over {elapsed/60:.1f} minutes')
+
     def report_constrained(self):
         now = time.time()
         elapsed = now - self.last_report
@@ -282,7 +663,7 @@ class MPILauncher:
             return
         else:
             self.last_report = now
-        num_idle = len(self.worker_group.idle_workers())
+        num_idle = self.worker_group.num_idle
         logger.info(f'{num_idle} idle worker nodes')
         all_runnable = BalsamJob.objects.filter(state__in=models.RUNNABLE_STATES)
         unlocked = all_runnable.filter(lock='')
@@ -297,53 +678,86 @@ class MPILauncher:
             logger.info(f'{too_large} of these could run now; but require more than {num_idle} nodes.')
 
     def launch(self):
-        num_idle = len(self.worker_group.idle_workers())
+        if self.checkpointing:
+            return
+        num_idle = self.worker_group.num_idle
         num_active = len(self.mpi_runs)
-        max_acquire = min(num_idle, self.MAX_CONCURRENT_RUNS - num_active)
+        capacity = num_idle * self.worker_group.cores_per_node + self.worker_group.num_shared_cores
+        max_acquire = min(capacity, self.MAX_CONCURRENT_RUNS - num_active,
+                          self.throttle.limit)
         max_acquire = max(max_acquire, 0)
 
         if num_active >= self.MAX_CONCURRENT_RUNS:
             logger.info(f'Reached MAX_CONCURRENT_MPIRUNS limit')
             return
 
-        runnable = self.get_runnable()
-        num_runnable = runnable.count()
-        if num_runnable > 0:
-            logger.debug(f"{num_runnable} runnable jobs")
+        if not self.has_backlog():
+            self.report_constrained()
+            return
+        depth = max_acquire + (self.BACKFILL_DEPTH if self.backfill else 0)
+        fetched = list(self.get_runnable()[:depth])
+        if fetched:
+            logger.debug(f"Fetched {len(fetched)} runnable jobs")
         else:
             self.report_constrained()
             return
 
         # pre-assign jobs to nodes (descending order of node count)
-        cache = list(runnable[:max_acquire])
+        if self.backfill:
+            running = [(run.expected_end, len(run.workers)) for run in self.mpi_runs]
+            cache, reservation = easy_backfill(fetched, num_idle, running, time.time())
+            cache = cache[:max_acquire]
+            if reservation is not None:
+                job, start = reservation
+                wait = (start - time.time()) / 60.0
+                logger.debug(f'Reserved {job.num_nodes} nodes for {job.cute_id} '
+                             f'in {wait:.1f} minutes; backfilling {len(cache)} jobs')
+        else:
+            cache = fetched
         pre_assignments = []
         idx = 0
         while idx < len(cache):
             job = cache[idx]
+            cores = subnode_cores(job, self.worker_group.cores_per_node)
+            if cores:
+                packed = self.worker_group.request_cores(cores)
+                if packed:
+                    worker, cpus = packed
+                    pre_assignments.append((job, [worker], cpus))
+                idx += 1
+                continue
             workers = self.worker_group.request(job.num_nodes)
             if workers:
-                pre_assignments.append((job, workers))
+                pre_assignments.append((job, workers, None))
                 idx += 1
             else:
-                num_idle = sum(w.num_nodes for w in self.worker_group.idle_workers())
+                num_idle = self.worker_group.num_idle
                 assert job.num_nodes > num_idle
+                cores_per_node = self.worker_group.cores_per_node
                 idx = next((i for i, job in enumerate(cache[idx:], idx) if
-                            job.num_nodes <= num_idle), len(cache))
+                            job.num_nodes <= num_idle or subnode_cores(job, cores_per_node)),
+                           len(cache))
 
         # acquire lock on jobs
-        to_acquire = [job.pk for (job, workers) in pre_assignments]
+        to_acquire = [job.pk for (job, workers, cpus) in pre_assignments]
         acquired_pks = self.jobsource.acquire(to_acquire)
         logger.debug(f'Acquired lock on {len(acquired_pks)} out of {len(pre_assignments)} jobs marked for running')
 
         # dispatch runners; release workers that did not acquire job
-        for (job, workers) in pre_assignments:
+        runs = []
+        for (job, workers, cpus) in pre_assignments:
             if job.pk in acquired_pks:
-                run = MPIRun(job, workers)
-                self.mpi_runs.append(run)
+                runs.append(MPIRun(job, workers, cpus))
+            elif cpus:
+                workers[0].release_cpus(cpus)
             else:
-                for w in workers:
-                    w.idle = True
-        BalsamJob.batch_update_state(acquired_pks, 'RUNNING', self.RUN_MESSAGE)
+                self.worker_group.release(workers)
+        self.dispatch(runs)
+        self.reaper.add(runs)
+        self.mpi_runs.extend(runs)
+        # failed starts are already RUN_ERROR: update() records them
+        started_pks = [run.job.pk for run in runs if run.process is not None]
+        BalsamJob.batch_update_state(started_pks, 'RUNNING', self.RUN_MESSAGE)
 
     def run(self):
         '''Main Launcher service loop'''
@@ -351,14 +765,21 @@ class MPILauncher:
         try:
             while not EXIT_FLAG:
                 self.time_step()
+                self.check_checkpoint()
                 self.launch()
                 self.update()
+                self.record_utilization()
                 self.check_exit()
         except:
             raise
         finally:
             logger.debug('EXIT: breaking launcher service loop')
+            self.record_utilization(final=True)
+            self.dispatch_pool.shutdown()
+            self.reaper.stop()
             self.update(timeout=True)
+            if self.kill_feed is not None:
+                self.kill_feed.close()
             assert not self.is_active
             logger.info('Exit: All MPI runs terminated')
             self.jobsource.release_all_owned()
@@ -369,8 +790,28 @@ class MPILauncher:
         return len(self.mpi_runs) > 0
 
 
+def serial_ensemble_cmd(master_host, master_port, num_workers, minutes_left,
+                        log_fname, wf_name=None, gpus_per_node=None,
+                        persistent=False, max_idle_seconds=0):
+    '''Command line of the serial-mode ensemble (one master and num_workers ranks)'''
+    cmd = ' '.join(SerialLauncher.ZMQ_ENSEMBLE_CMD)
+    cmd += f" --time-limit-min={minutes_left}"
+    cmd += f" --master-address {master_host}:{master_port}"
+    cmd += f" --log-filename {log_fname}"
+    cmd += f" --num-workers {num_workers}"
+    if wf_name:
+        cmd += f" --wf-name={wf_name}"
+    if gpus_per_node:
+        cmd += f" --gpus-per-node={gpus_per_node}"
+    if persistent:
+        cmd += f" --persistent"
+    if max_idle_seconds:
+        cmd += f" --max-idle-seconds={max_idle_seconds}"
+    return cmd
+
+
 class SerialLauncher:
-    ZMQ_ENSEMBLE_EXE = find_spec("balsam.launcher.serial_mode_timed").origin
+    ZMQ_ENSEMBLE_CMD = module_command("balsam.launcher.serial_mode_timed")
 
     def __init__(self, wf_name=None, time_limit_minutes=60, gpus_per_node=None,
                  persistent=False, limit_nodes=None, offset_nodes=None):
@@ -393,17 +834,10 @@ class SerialLauncher:
         os.environ['BALSAM_LAUNCHER_NODES'] = str(self.total_nodes)
         os.environ['BALSAM_JOB_MODE'] = "serial"
 
-        self.app_cmd = f"{sys.executable} {self.ZMQ_ENSEMBLE_EXE}"
-        self.app_cmd += f" --time-limit-min={minutes_left}"
-        self.app_cmd += f" --master-address {master_host}:{master_port}"
-        self.app_cmd += f" --log-filename {log_fname}"
-        self.app_cmd += f" --num-workers {num_workers}"
-        if self.wf_name:
-            self.app_cmd += f" --wf-name={self.wf_name}"
-        if self.gpus_per_node:
-            self.app_cmd += f" --gpus-per-node={self.gpus_per_node}"
-        if self.is_persistent:
-            self.app_cmd += f" --persistent"
+        self.app_cmd = serial_ensemble_cmd(
+            master_host, master_port, num_workers, minutes_left, log_fname,
+            wf_name=self.wf_name, gpus_per_node=self.gpus_per_node,
+            persistent=self.is_persistent)
 
     def run(self):
         global EXIT_FLAG
@@ -458,6 +892,173 @@ class SerialLauncher:
         logger.info("ensemble.out file closed.")
 
 
+class EnsembleRun:
+    '''A serial-mode ensemble occupying a block of workers in hybrid mode
+
+    The first worker hosts the ensemble master; the others run serial jobs.
+    The ensemble exits on its own after ``max_idle_seconds`` without serial
+    work, which returns its workers to the MPI pool.'''
+
+    def __init__(self, workers, port, minutes_left, wf_name, gpus_per_node, max_idle_seconds):
+        self.workers = workers
+        for w in self.workers:
+            w.idle = False
+        self.start_time = time.time()
+        timestamp = datetime.now().strftime('%Y-%m-%d_%H%M%S')
+        log_fname = f'serial-ensemble_{timestamp}_{port}.log'
+        app_cmd = serial_ensemble_cmd(
+            workers[0].hostname, port, len(workers) - 1, minutes_left, log_fname,
+            wf_name=wf_name, gpus_per_node=gpus_per_node,
+            max_idle_seconds=max_idle_seconds)
+        mpi_str = workers[0].mpi_cmd(
+            workers, app_cmd=app_cmd, num_ranks=len(workers), ranks_per_node=1,
+            cpu_affinity='none', envs={})
+        logger.info(f'Starting serial ensemble on {len(workers)} nodes:\n{mpi_str}')
+        outname = os.path.join(settings.LOGGING_DIRECTORY, f'ensemble_{port}.out')
+        self.outfile = open(outname, 'wb')
+        self.process = subprocess.Popen(args=shlex.split(mpi_str), stdout=self.outfile,
+                                        stderr=subprocess.STDOUT, shell=False)
+
+    def poll(self):
+        retcode = self.process.poll()
+        if retcode is not None:
+            elapsed = (time.time() - self.start_time) / 60.0
+            logger.info(f'Serial ensemble on {len(self.workers)} nodes returned {retcode} '
+                        f'after {elapsed:.1f} minutes')
+            self.outfile.close()
+            self.free_workers()
+        return retcode
+
+    def free_workers(self):
+        for w in self.workers:
+            w.idle = True
+
+
+def serial_partition_size(total_nodes, serial_demand, mpi_demand, minimum):
+    '''Nodes the serial partition should hold, in proportion to node demand'''
+    if serial_demand <= 0:
+        return 0
+    serial_demand = max(serial_demand, minimum)
+    if mpi_demand <= 0:
+        return min(total_nodes, serial_demand)
+    share = round(total_nodes * serial_demand / (serial_demand + mpi_demand))
+    return min(total_nodes, serial_demand, max(minimum, share))
+
+
+class HybridLauncher(MPILauncher):
+    '''MPI mode plus serial-mode ensembles sharing one WorkerGroup
+
+    Multi-rank jobs run as MPIRuns.  Single-rank jobs run in serial ensembles
+    started on idle nodes whenever the serial partition is smaller than its
+    share of the combined backlog (measured in nodes).  Idle ensembles exit
+    and hand their nodes back to the MPI pool.'''
+    JOB_MODE = 'hybrid'
+    MPI_ONLY = True
+    MIN_ENSEMBLE_NODES = 2
+    ENSEMBLE_IDLE_SECONDS = 60
+    ENSEMBLE_BASE_PORT = 19876
+    DEMAND_CHECK_PERIOD = 10
+
+    def __init__(self, wf_name, time_limit_minutes, gpus_per_node, persistent,
+                 limit_nodes=None, offset_nodes=None, **kwargs):
+        super().__init__(wf_name, time_limit_minutes, gpus_per_node, persistent,
+                         limit_nodes, offset_nodes, **kwargs)
+        self.wf_name = wf_name
+        self.gpus_per_node = gpus_per_node
+        self.ensembles = []
+        self.num_ensembles_started = 0
+        self.last_demand_check = 0
+        self.serial_node_seconds = 0.0
+        self.mpi_node_seconds = 0.0
+
+    def serial_demand(self):
+        '''(serial, mpi) runnable backlog in nodes, including an ensemble master'''
+        manager = self.jobsource
+        limit = self.runnable_time_limit()
+        serial = manager.get_runnable(max_nodes=1, serial_only=True, remaining_minutes=limit)
+        serial_nodes = serial.aggregate(nodes=Sum(ExpressionWrapper(
+            1.0 / F('node_packing_count'), output_field=FloatField())))['nodes'] or 0
+        mpi = manager.get_runnable(max_nodes=self.total_nodes, mpi_only=True,
+                                   remaining_minutes=limit)
+        mpi_nodes = mpi.aggregate(nodes=Sum('num_nodes'))['nodes'] or 0
+        if serial_nodes:
+            serial_nodes = ceil(serial_nodes) + 1
+        return serial_nodes, mpi_nodes
+
+    def launch_ensemble(self):
+        now = time.time()
+        if now - self.last_demand_check < self.DEMAND_CHECK_PERIOD:
+            return
+        self.last_demand_check = now
+        if not self.has_backlog():
+            return
+
+        serial_demand, mpi_demand = self.serial_demand()
+        target = serial_partition_size(self.total_nodes, serial_demand, mpi_demand,
+                                       self.MIN_ENSEMBLE_NODES)
+        current = sum(len(e.workers) for e in self.ensembles)
+        grow = min(target - current, self.worker_group.num_idle)
+        logger.debug(f'Node demand: {serial_demand} serial, {mpi_demand} MPI; '
+                     f'serial partition {current} of target {target}')
+        if grow < self.MIN_ENSEMBLE_NODES:
+            return
+        workers = self.worker_group.request(grow)
+        if not workers:
+            return
+        if self.minutes_left > 1e12:
+            minutes_left = 72.0 * 60
+        else:
+            minutes_left = max(0.1, self.minutes_left - self.time_margin_minutes)
+        port = self.ENSEMBLE_BASE_PORT + self.num_ensembles_started
+        try:
+            ensemble = EnsembleRun(workers, port, minutes_left, self.wf_name,
+                                   self.gpus_per_node, self.ENSEMBLE_IDLE_SECONDS)
+        except OSError as e:
+            logger.error(f'Failed to start serial ensemble: {e}')
+            self.worker_group.release(workers)
+            return
+        self.num_ensembles_started += 1
+        self.ensembles.append(ensemble)
+
+    def launch(self):
+        if not self.checkpointing:
+            self.launch_ensemble()
+        super().launch()
+
+    def update(self, timeout=False):
+        if timeout:
+            self.timeout_kill(self.ensembles)
+            for ensemble in self.ensembles:
+                ensemble.outfile.close()
+            self.ensembles = []
+        else:
+            self.ensembles = [e for e in self.ensembles if e.poll() is None]
+        super().update(timeout=timeout)
+
+    def has_runnable(self):
+        if super().has_runnable():
+            return True
+        return self.jobsource.get_runnable(max_nodes=1, serial_only=True).exists()
+
+    def record_utilization(self, final=False):
+        now = time.time()
+        elapsed = now - self.last_util_sample
+        self.serial_node_seconds += elapsed * sum(len(e.workers) for e in self.ensembles)
+        self.mpi_node_seconds += elapsed * sum(len(r.workers) for r in self.mpi_runs)
+        report = final or now - self.last_util_report >= self.UTILIZATION_REPORT_PERIOD
+        super().record_utilization(final=final)
+        if report:
+            total = max(self.total_nodes * (now - self.start_time), 1e-6)
+            logger.info(f'Packing: {len(self.ensembles)} serial ensembles '
+                        f'({self.num_ensembles_started} started); '
+                        f'{100*self.serial_node_seconds/total:.1f}% of node-time serial, '
+                        f'{100*self.mpi_node_seconds/total:.1f}% MPI')
+
+    @property
+    def is_active(self):
+        return super().is_active or len(self.ensembles) > 0
+
+
 def main(args):
     signal.signal(signal.SIGINT,  sig_handler)
     signal.signal(signal.SIGTERM, sig_handler)
@@ -472,16 +1073,41 @@ def main(args):
     limit_nodes = args.limit_nodes
     offset_nodes = args.offset_nodes
 
-    Launcher = MPILauncher if job_mode == 'mpi' else SerialLauncher
+    if job_mode in ('mpi', 'hybrid'):
+        Launcher = MPILauncher if job_mode == 'mpi' else HybridLauncher
+        launcher_kwargs = dict(
+            backfill=args.backfill,
+            time_margin_minutes=args.time_margin_minutes,
+            drain_minutes=args.drain_minutes,
+            drain_job_minutes=args.drain_job_minutes,
+            checkpoint_minutes=args.checkpoint_minutes,
+            checkpoint_signal=args.checkpoint_signal,
+            checkpoint_file=args.checkpoint_file,
+        )
+    else:
+        Launcher = SerialLauncher
+        launcher_kwargs = {}
+
+    if JobEnv.current_scheduler_id:
+        # One status query per allocation; transitions and ensembles inherit it
+        JobEnv.export_deadline()
 
     try:
         if nthread > 0:
             transition_pool = transitions.TransitionProcessPool(nthread, wf_filter)
         else:
             transition_pool = None
-        launcher = Launcher(wf_filter, timelimit_min, gpus_per_node, persistent,
-                            limit_nodes, offset_nodes)
-        launcher.run()
+        startup.mark('transition pool')
+        if job_mode == 'mpi' and args.partitions > 1:
+            from balsam.launcher import partitions
+            logger.info(f'Startup timings: {startup.report()}')
+            partitions.run_supervisor(args, wf_filter, timelimit_min, persistent)
+        else:
+            launcher = Launcher(wf_filter, timelimit_min, gpus_per_node, persistent,
+                                limit_nodes, offset_nodes, **launcher_kwargs)
+            startup.mark('launcher setup')
+            logger.info(f'Startup timings: {startup.report()}')
+            launcher.run()
     except:
         raise
     finally:
@@ -494,13 +1120,16 @@ def get_args(inputcmd=None):
     '''Parse command line arguments'''
     parser = config_launcher_subparser()
     if inputcmd:
-        return parser.parse_args(inputcmd)
+        args = parser.parse_args(inputcmd)
     else:
-        return parser.parse_args()
+        args = parser.parse_args()
+    check_launcher_args(parser, args)
+    return args
 
 
 if __name__ == "__main__":
     setup()
+    startup.mark('django setup')
     args = get_args()
     config_logging('launcher')
     logger.info("Loading Balsam Launcher")
@@ -11,6 +11,17 @@ logger = logging.getLogger(__name__)
 class BalsamRunnerException(Exception): pass
 
 
+def rank_cpu_groups(cpus, num_ranks):
+    '''Split a node's reserved CPU ids evenly into one group per rank; with
+    more ranks than CPUs, ranks cycle over the CPUs so no group is empty'''
+    if not cpus:
+        raise BalsamRunnerException("No CPU ids to bind ranks to")
+    if len(cpus) < num_ranks:
+        return [[cpus[i % len(cpus)]] for i in range(num_ranks)]
+    per_rank = len(cpus) // num_ranks
+    return [cpus[i*per_rank:(i+1)*per_rank] for i in range(num_ranks)]
+
+
 class MPICommand(object):
     '''Base Class for creating ``mpirun`` command lines.
 
@@ -37,14 +48,27 @@ class MPICommand(object):
     def threads(self, cpu_affinity, thread_per_rank, thread_per_core):
         return ""
 
+    def cpu_bind(self, cpus, num_ranks, thread_per_rank, thread_per_core):
+        '''Flags pinning a sub-node job to the CPU ids reserved for it'''
+        return ""
+
+    def binding_str(self, cpus, num_ranks, cpu_affinity, thread_per_rank,
+                    thread_per_core):
+        if cpus:
+            return self.cpu_bind(cpus, num_ranks, thread_per_rank, thread_per_core)
+        return self.threads(cpu_affinity, thread_per_rank, thread_per_core)
+
     def __call__(self, workers, *, app_cmd, num_ranks, ranks_per_node,
                  envs, cpu_affinity, threads_per_rank=1, threads_per_core=1,
-                 mpi_flags=''):
-        '''Build the mpirun/aprun/runjob command line string'''
+                 mpi_flags='', cpus=None):
+        '''Build the mpirun/aprun/runjob command line string
+
+        ``cpus`` lists the CPU ids reserved on a shared node for a sub-node
+        job; they replace the usual affinity flags.'''
         workers = self.worker_str(workers)
         envs = self.env_str(envs)
-        thread_str = self.threads(cpu_affinity, threads_per_rank,
-                                  threads_per_core)
+        thread_str = self.binding_str(cpus, num_ranks, cpu_affinity,
+                                      threads_per_rank, threads_per_core)
         result = (f"{self.mpi} {self.nproc} {num_ranks} {self.ppn} "
                   f"{ranks_per_node} {envs} {workers} {thread_str} "
                   f"{mpi_flags} {app_cmd}")
@@ -72,14 +96,17 @@ class OpenMPICommand(MPICommand):
     def threads(self, cpu_affinity, thread_per_rank, thread_per_core):
         return ""
 
+    def cpu_bind(self, cpus, num_ranks, thread_per_rank, thread_per_core):
+        return f"--cpu-set {','.join(str(cpu) for cpu in cpus)} --bind-to core"
+
     def __call__(self, workers, *, app_cmd, num_ranks, ranks_per_node, envs,
                  cpu_affinity, threads_per_rank=1, threads_per_core=1,
-                 mpi_flags=''):
+                 mpi_flags='', cpus=None):
         '''Build the mpirun/aprun/runjob command line string'''
         workers = self.worker_str(workers)
         envs = self.env_str(envs)
-        thread_str = self.threads(cpu_affinity, threads_per_rank,
-                                  threads_per_core)
+        thread_str = self.binding_str(cpus, num_ranks, cpu_affinity,
+                                      threads_per_rank, threads_per_core)
         result = (f"{self.mpi} {self.nproc} {num_ranks} {self.ppn} "
                   f"{ranks_per_node} {envs} {workers} {thread_str} "
                   f"{mpi_flags} {app_cmd}")
@@ -114,12 +141,12 @@ class ThetaGpuMPICommand(OpenMPICommand):
 
     def __call__(self, workers, *, app_cmd, num_ranks, ranks_per_node, envs,
                  cpu_affinity, threads_per_rank=1, threads_per_core=1,
-                 mpi_flags=''):
+                 mpi_flags='', cpus=None):
         '''Build the mpirun/aprun/runjob command line string'''
         workers = self.worker_str(workers)
         envs = self.env_str(envs)
-        thread_str = self.threads(cpu_affinity, threads_per_rank,
-                                  threads_per_core)
+        thread_str = self.binding_str(cpus, num_ranks, cpu_affinity,
+                                      threads_per_rank, threads_per_core)
         result = (f"{self.mpi} {self.nproc} {num_ranks} {self.ppn} "
                   f"{ranks_per_node} {envs} {workers} {thread_str} "
                   f"{mpi_flags} {app_cmd}")
@@ -164,6 +191,12 @@ class ThetaMPICommand(MPICommand):
             result += f"{self.threads_per_core} {thread_per_core} "
         return result
 
+    def cpu_bind(self, cpus, num_ranks, thread_per_rank, thread_per_core):
+        result = f"{self.cpu_binding} {','.join(str(cpu) for cpu in cpus)} "
+        result += f"{self.threads_per_rank} {thread_per_rank} "
+        result += f"{self.threads_per_core} {thread_per_core} "
+        return result
+
     def worker_str(self, workers):
         if not workers:
             return ""
@@ -216,6 +249,12 @@ class SlurmMPICommand(MPICommand):
     def env_str(self, envs):
         return ''
 
+    def cpu_bind(self, cpus, num_ranks, thread_per_rank, thread_per_core):
+        # --overlap: job steps sharing a node each get their own CPU mask
+        masks = ','.join(hex(sum(1 << cpu for cpu in group))
+                         for group in rank_cpu_groups(cpus, num_ranks))
+        return f"--overlap --cpu-bind=mask_cpu:{masks}"
+
     def worker_str(self, workers):
         if not workers:
             return ""
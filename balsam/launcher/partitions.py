@@ -0,0 +1,445 @@
+'''Coordinated multi-launcher mode (``balsam launcher --partitions N``)
+
+One ``Supervisor`` process owns all database access: it runs the transition
+pool, the lock tick thread and ``clear_stale_locks``, and acquires every job
+under a single lock.  ``N`` ``PartitionAgent`` processes each drive MPI runs
+on a slice of the WorkerGroup (as with --offset-nodes/--limit-nodes).  Agents
+never touch the database; they exchange job assignments and status updates
+with the supervisor over a local ZMQ REQ/REP socket, one round trip per cycle.
+'''
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import signal
+import subprocess
+import sys
+import time
+import uuid
+
+import zmq
+
+from balsam import config_logging, module_command, setup
+from balsam.core import models
+from balsam.launcher import worker
+from balsam.launcher.launcher import (
+    MPIRun, RunReaper, subnode_cores, terminate_runs
+)
+from balsam.launcher.util import get_tail, remaining_time_minutes
+
+logger = logging.getLogger('balsam.launcher.partitions')
+BalsamJob = models.BalsamJob
+EXIT_FLAG = False
+
+SPEC_FIELDS = (
+    'name', 'cute_id', 'working_directory', 'app_cmd', 'envscript',
+    'num_nodes', 'num_ranks', 'ranks_per_node', 'cpu_affinity',
+    'threads_per_rank', 'threads_per_core', 'mpi_flags',
+    'wall_time_minutes', 'node_packing_count', 'required_num_cores',
+)
+
+
+def sig_handler(signum, stack):
+    global EXIT_FLAG
+    EXIT_FLAG = True
+
+
+def job_spec(job):
+    '''Everything an agent needs to start a job, as a JSON-able dict'''
+    spec = {field: getattr(job, field) for field in SPEC_FIELDS}
+    spec['pk'] = job.pk.hex
+    spec['envs'] = job.get_envs()
+    return spec
+
+
+class JobSpec:
+    '''Agent-side stand-in for a BalsamJob: the attributes MPIRun reads'''
+    def __init__(self, spec):
+        self.__dict__.update(spec)
+
+    def get_envs(self):
+        return self.envs
+
+
+class Supervisor:
+    '''Owns the DB on behalf of all partition agents'''
+    POLL_TIMEOUT_MS = 1000
+    CHECK_PERIOD = 1.0
+    MAX_JOBS_PER_REQUEST = 256
+
+    def __init__(self, wf_name, time_limit_minutes, num_agents, address,
+                 persistent=False, time_margin_minutes=1.0):
+        self.jobsource = BalsamJob.source
+        self.jobsource.workflow = wf_name
+        self.jobsource.clear_stale_locks()
+        self.jobsource.start_tick()
+        self.jobsource.check_qLaunch()
+        if self.jobsource.qLaunch is not None:
+            sched_id = self.jobsource.qLaunch.scheduler_id
+            self.RUN_MESSAGE = f'Batch Scheduler ID: {sched_id}'
+        else:
+            self.RUN_MESSAGE = 'Not scheduled by service'
+
+        self.timer = remaining_time_minutes(time_limit_minutes)
+        self.minutes_left = float('inf')
+        self.time_margin_minutes = time_margin_minutes
+        self.is_persistent = persistent
+        self.exit_counter = 0
+        self.exiting = False
+
+        self.num_agents = num_agents
+        self.agent_procs = {}
+        self.finished_agents = set()
+        self.assigned = {}  # pk hex -> agent name
+        self.killed = {}    # agent name -> [pk hex]
+        try:
+            self.kill_feed = models.KillFeed()
+        except Exception as e:
+            logger.warning(f'Cannot listen for killed jobs ({e})')
+            self.kill_feed = None
+
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.REP)
+        self.socket.bind(address)
+        logger.info(f'Supervisor for {num_agents} partition agents listening on {address}')
+
+    def check_time(self):
+        try:
+            self.minutes_left = next(self.timer)
+        except StopIteration:
+            self.minutes_left = 0
+        if self.minutes_left <= 0 and not self.exiting:
+            logger.info('Out of time; telling agents to exit')
+            self.exiting = True
+
+    def check_idle(self):
+        '''Non-persistent exit after 10 consecutive checks with nothing to do'''
+        if self.is_persistent or self.exiting or self.assigned:
+            self.exit_counter = 0
+            return
+        counts = self.jobsource.state_counts()
+        if counts is None:
+            busy = BalsamJob.objects.filter(
+                state__in=models.PROCESSABLE_STATES+models.RUNNABLE_STATES,
+                workflow__contains=self.jobsource.workflow or ''
+            ).exists()
+        else:
+            states = models.PROCESSABLE_STATES + models.RUNNABLE_STATES
+            busy = any(counts.get(state) for state in states)
+        if busy:
+            self.exit_counter = 0
+            return
+        self.exit_counter += 1
+        logger.info(f"Nothing to do (exit counter {self.exit_counter}/10)")
+        if self.exit_counter >= 10:
+            self.exiting = True
+
+    def poll_killed(self):
+        if self.kill_feed is None:
+            return
+        try:
+            killed = self.kill_feed.poll()
+        except Exception as e:
+            logger.warning(f'Lost the killed-job feed ({e})')
+            self.kill_feed = None
+            return
+        for pk in killed:
+            pk = uuid.UUID(pk).hex
+            agent = self.assigned.pop(pk, None)
+            if agent is not None:
+                self.killed.setdefault(agent, []).append(pk)
+
+    def record_updates(self, msg):
+        '''Apply an agent's status report with one bulk statement per state'''
+        def pks(hexes):
+            for pk in hexes:
+                self.assigned.pop(pk, None)
+            return [uuid.UUID(pk) for pk in hexes]
+
+        started = [uuid.UUID(pk) for pk in msg.get('started', [])]
+        BalsamJob.batch_update_state(started, 'RUNNING', self.RUN_MESSAGE)
+
+        done = pks(msg.get('done', []))
+        BalsamJob.batch_update_state(done, 'RUN_DONE')
+
+        error_tails = dict(msg.get('error', []))
+        errors = list(zip(pks(list(error_tails)), error_tails.values()))
+        if errors:
+            BalsamJob.batch_update_state_messages(errors, 'RUN_ERROR')
+
+        timeouts = pks(msg.get('timeout', []))
+        BalsamJob.batch_update_state(timeouts, 'RUN_TIMEOUT')
+
+        unplaced = pks(msg.get('unplaced', []))
+        # USER_KILLED jobs the agent has stopped: the state is already final
+        killed = [uuid.UUID(pk) for pk in msg.get('killed', [])]
+        released = done + [pk for pk, _ in errors] + timeouts + unplaced + killed
+        if released:
+            self.jobsource.release(released)
+
+    def assign_jobs(self, agent, idle_nodes, shared_cores):
+        '''Acquire runnable jobs that fit the agent's free nodes'''
+        if self.exiting or (idle_nodes == 0 and shared_cores == 0):
+            return []
+        remaining = None
+        if self.minutes_left < 1e12:
+            remaining = max(0, self.minutes_left - self.time_margin_minutes)
+        runnable = self.jobsource.get_runnable(
+            max_nodes=max(idle_nodes, 1),
+            remaining_minutes=remaining,
+            order_by=('-num_nodes', '-wall_time_minutes')
+        )
+        # Greedily pick candidates whose node counts fit the idle nodes together
+        limit = min(self.MAX_JOBS_PER_REQUEST, idle_nodes + shared_cores)
+        jobs, nodes_left = {}, idle_nodes
+        for job in runnable[:limit]:
+            if job.num_nodes == 1 and job.node_packing_count > 1:
+                jobs[job.pk] = job
+            elif job.num_nodes <= nodes_left:
+                jobs[job.pk] = job
+                nodes_left -= job.num_nodes
+        if not jobs:
+            return []
+        acquired = self.jobsource.acquire(list(jobs.keys()))
+        specs = [job_spec(jobs[pk]) for pk in acquired]
+        for spec in specs:
+            self.assigned[spec['pk']] = agent
+        logger.debug(f'Assigned {len(specs)} jobs to {agent}')
+        return specs
+
+    def check_agents(self):
+        '''Time out the jobs of agent processes that died without reporting'''
+        for agent, proc in self.agent_procs.items():
+            if agent in self.finished_agents or proc.poll() is None:
+                continue
+            logger.error(f'{agent} exited with code {proc.returncode} without a final report')
+            self.finished_agents.add(agent)
+            lost = [pk for pk, owner in self.assigned.items() if owner == agent]
+            self.record_updates({'timeout': lost, 'killed': self.killed.pop(agent, [])})
+
+    def handle_request(self):
+        msg = self.socket.recv_json(zmq.NOBLOCK)
+        agent = msg['agent']
+        self.record_updates(msg)
+        if msg.get('final'):
+            self.record_updates({'killed': self.killed.pop(agent, [])})
+            self.finished_agents.add(agent)
+            logger.info(f'{agent} finished ({len(self.finished_agents)}/{self.num_agents})')
+            self.socket.send_json({})
+            return
+        reply = {
+            'kill': self.killed.pop(agent, []),
+            'exit': self.exiting,
+            'jobs': self.assign_jobs(agent, msg['idle_nodes'], msg['shared_cores']),
+        }
+        self.socket.send_json(reply)
+
+    def run(self):
+        try:
+            last_check = 0.0
+            while len(self.finished_agents) < self.num_agents:
+                if EXIT_FLAG and not self.exiting:
+                    logger.info('Supervisor signalled; telling agents to exit')
+                    self.exiting = True
+                if self.socket.poll(self.POLL_TIMEOUT_MS):
+                    self.handle_request()
+                if time.time() - last_check >= self.CHECK_PERIOD:
+                    last_check = time.time()
+                    self.check_time()
+                    self.poll_killed()
+                    self.check_idle()
+                    self.check_agents()
+        finally:
+            self.socket.close(linger=0)
+            self.context.term()
+            if self.kill_feed is not None:
+                self.kill_feed.close()
+            self.jobsource.release_all_owned()
+            logger.info('Exit: Supervisor released all BalsamJob locks')
+
+
+class PartitionAgent:
+    '''Drives MPI runs on one slice of the WorkerGroup; no DB access'''
+    DISPATCH_THREADS = 16
+    CYCLE_SECONDS = 1.0
+    REPLY_TIMEOUT_MS = 60000
+    REPLY_RETRIES = 5
+
+    def __init__(self, name, address, limit_nodes=None, offset_nodes=None):
+        self.name = name
+        self.worker_group = worker.WorkerGroup(limit=limit_nodes, offset=offset_nodes)
+        self.runs = {}
+        self.report = self.empty_report()
+        self.reaper = RunReaper()
+        self.reaper.start()
+        self.dispatch_pool = ThreadPoolExecutor(max_workers=self.DISPATCH_THREADS)
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.REQ)
+        self.socket.setsockopt(zmq.SNDTIMEO, self.REPLY_TIMEOUT_MS)
+        self.socket.connect(address)
+        self.supervisor_lost = False
+        logger.info(f'{name}: {len(self.worker_group)} workers; supervisor at {address}')
+
+    @staticmethod
+    def empty_report():
+        return {'started': [], 'done': [], 'error': [], 'timeout': [], 'unplaced': [],
+                'killed': []}
+
+    def collect(self):
+        for run, retcode in self.reaper.collect():
+            pk = run.job.pk
+            if self.runs.pop(pk, None) is None:
+                continue
+            run.outfile.close()
+            run.free_workers()
+            if retcode == 0:
+                logger.info(f"MPIRun {run.job.cute_id} done")
+                self.report['done'].append(pk)
+            else:
+                tail = get_tail(run.outfile.name)
+                logger.info(f"MPIRun {run.job.cute_id} error code {retcode}:\n{tail}")
+                self.report['error'].append((pk, tail))
+
+    def kill(self, pks):
+        '''Stop the runs of USER_KILLED jobs; every pk is confirmed in the next
+        report so the supervisor can release it, running here or not'''
+        self.report['killed'].extend(pks)
+        runs = [self.runs.pop(pk) for pk in pks if pk in self.runs]
+        if runs:
+            logger.info(f'Killing {len(runs)} USER_KILLED runs')
+            self.reaper.discard(runs)
+            terminate_runs(runs)
+            for run in runs:
+                run.outfile.close()
+
+    def assign(self, specs):
+        '''Place and start the jobs sent by the supervisor'''
+        group = self.worker_group
+        runs = []
+        for spec in specs:
+            job = JobSpec(spec)
+            cores = subnode_cores(job, group.cores_per_node)
+            if cores:
+                packed = group.request_cores(cores)
+                placement = ([packed[0]], packed[1]) if packed else None
+            else:
+                workers = group.request(job.num_nodes)
+                placement = (workers, None) if workers else None
+            if placement is None:
+                self.report['unplaced'].append(job.pk)
+            else:
+                runs.append(MPIRun(job, *placement))
+        started = list(self.dispatch_pool.map(MPIRun.start, runs))
+        for run, ok in zip(runs, started):
+            if ok:
+                self.runs[run.job.pk] = run
+                self.report['started'].append(run.job.pk)
+            else:
+                run.free_workers()
+                self.report['error'].append((run.job.pk, run.err_msg))
+        self.reaper.add([run for run in runs if run.process is not None])
+
+    def exchange(self, **extra):
+        '''Send the report and return the supervisor's reply, or None if it
+        stays silent through REPLY_RETRIES waits of REPLY_TIMEOUT_MS'''
+        msg = dict(self.report, agent=self.name, **extra)
+        self.report = self.empty_report()
+        try:
+            self.socket.send_json(msg)
+        except zmq.Again:
+            return None
+        for attempt in range(1, self.REPLY_RETRIES+1):
+            if self.socket.poll(self.REPLY_TIMEOUT_MS):
+                return self.socket.recv_json()
+            logger.warning(f'{self.name}: no reply from supervisor ({attempt}/{self.REPLY_RETRIES})')
+        return None
+
+    def run(self):
+        try:
+            while not EXIT_FLAG:
+                self.collect()
+                reply = self.exchange(idle_nodes=self.worker_group.num_idle,
+                                      shared_cores=self.worker_group.num_shared_cores)
+                if reply is None:
+                    logger.error(f'{self.name}: supervisor is not responding; terminating local runs')
+                    self.supervisor_lost = True
+                    break
+                self.kill(reply['kill'])
+                if reply['exit']:
+                    break
+                self.assign(reply['jobs'])
+                time.sleep(self.CYCLE_SECONDS)
+        finally:
+            self.reaper.stop()
+            self.reaper.sweep()
+            self.collect()
+            running = list(self.runs.values())
+            terminate_runs(running)
+            for run in running:
+                run.outfile.close()
+            self.report['timeout'].extend(self.runs.keys())
+            self.runs = {}
+            if not self.supervisor_lost:
+                self.exchange(final=True)
+            self.dispatch_pool.shutdown()
+            self.socket.close(linger=0)
+            self.context.term()
+            logger.info(f'{self.name}: all MPI runs terminated')
+
+
+def partition_slices(num_nodes, num_agents, offset=0):
+    '''(offset, limit) of each agent's contiguous share of num_nodes workers'''
+    base, extra = divmod(num_nodes, num_agents)
+    slices = []
+    for i in range(num_agents):
+        limit = base + (1 if i < extra else 0)
+        slices.append((offset, limit))
+        offset += limit
+    return slices
+
+
+def run_supervisor(args, wf_filter, timelimit_min, persistent):
+    '''Start one agent per partition and supervise them until exit'''
+    num_agents = args.partitions
+    group = worker.WorkerGroup(limit=args.limit_nodes, offset=args.offset_nodes)
+    slices = partition_slices(len(group), num_agents, args.offset_nodes or 0)
+    address = f'tcp://127.0.0.1:{args.supervisor_port}'
+    supervisor = Supervisor(wf_filter, timelimit_min, num_agents, address,
+                            persistent=persistent,
+                            time_margin_minutes=args.time_margin_minutes)
+    signal.signal(signal.SIGINT, sig_handler)
+    signal.signal(signal.SIGTERM, sig_handler)
+    agent_cmd = module_command('balsam.launcher.partitions')
+    for i, (offset, limit) in enumerate(slices):
+        name = f'agent{i}'
+        cmd = agent_cmd + ['--name', name, '--address', address,
+                           '--offset-nodes', str(offset), '--limit-nodes', str(limit)]
+        supervisor.agent_procs[name] = subprocess.Popen(cmd)
+    try:
+        supervisor.run()
+    finally:
+        for proc in supervisor.agent_procs.values():
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Balsam partition agent")
+    parser.add_argument('--name', required=True)
+    parser.add_argument('--address', required=True)
+    parser.add_argument('--offset-nodes', type=int, default=None)
+    parser.add_argument('--limit-nodes', type=int, default=None)
+    args = parser.parse_args()
+    config_logging(f'launcher-{args.name}')
+    signal.signal(signal.SIGINT, sig_handler)
+    signal.signal(signal.SIGTERM, sig_handler)
+    agent = PartitionAgent(args.name, args.address, args.limit_nodes, args.offset_nodes)
+    agent.run()
+    if agent.supervisor_lost:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    setup()
+    main()
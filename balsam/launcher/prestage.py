@@ -0,0 +1,78 @@
+'''Pack Balsam and its pure-Python dependencies into a zipapp (``balsam prestage``)
+
+Importing Django and Balsam from a parallel filesystem costs thousands of
+metadata operations per process.  A zipapp holds the same modules, already
+byte-compiled, in one file that can be copied to node-local storage (e.g.
+/tmp) at the top of the job script and run from there:
+
+    cp ~/.balsam/balsam.pyz /tmp/balsam.pyz
+    python /tmp/balsam.pyz launcher --consume-all ...
+
+Compiled extension modules (numpy, psycopg2, zmq, mpi4py, ...) cannot be
+imported from a zip; they are left out and still resolve from site-packages.
+Child processes (serial ensembles, partition agents) inherit the zipapp
+through PYTHONPATH.
+'''
+from importlib.util import find_spec
+import logging
+import os
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PACKAGES = [
+    'balsam', 'django', 'jinja2', 'markupsafe', 'dateutil', 'sqlparse',
+    'asgiref', 'multiprocessing_logging', 'six',
+]
+DATA_SUFFIXES = ('.json', '.ini', '.tmpl', '.html', '.txt')
+
+MAIN = \
+'''import os
+import sys
+app = os.path.dirname(os.path.abspath(__file__))
+os.environ['PYTHONPATH'] = os.pathsep.join(
+    p for p in [app, os.environ.get('PYTHONPATH')] if p)
+from balsam.scripts.cli import main
+main()
+'''
+
+
+def add_package(archive, name):
+    '''Add byte-compiled sources (and data files) of a top-level package or
+    module; returns False if it is not installed
+    as plain files'''
+    spec = find_spec(name)
+    if spec is None or spec.origin is None or not os.path.isfile(spec.origin):
+        return False
+    if spec.submodule_search_locations:
+        top = list(spec.submodule_search_locations)[0]
+        archive.writepy(top)
+        base = os.path.dirname(top)
+        for root, dirs, files in os.walk(top):
+            dirs[:] = [d for d in dirs if d != '__pycache__']
+            for fname in files:
+                if fname.endswith(DATA_SUFFIXES):
+                    path = os.path.join(root, fname)
+                    archive.write(path, os.path.relpath(path, base))
+    elif spec.origin.endswith('.py'):
+        archive.writepy(spec.origin)
+    else:
+        return False
+    return True
+
+
+def build_zipapp(output, packages=DEFAULT_PACKAGES):
+    '''Write the zipapp to output; returns the packages that were included'''
+    output = os.path.abspath(os.path.expanduser(output))
+    tmp_path = f'{output}.{os.getpid()}'
+    included = []
+    with zipfile.PyZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED,
+                           optimize=-1) as archive:
+        for name in packages:
+            if add_package(archive, name):
+                included.append(name)
+            else:
+                logger.info(f'Skipping {name}: not installed as pure Python')
+        archive.writestr('__main__.py', MAIN)
+    os.replace(tmp_path, output)
+    return included
@@ -267,10 +267,15 @@ class BalsamJobSource(JobSource):
 
 class Master:
     def __init__(self, args):
-        self.MAX_IDLE_TIME = 120.0
+        self.MAX_IDLE_TIME = args.max_idle_seconds
         self.DELAY_PERIOD = 0.2
         self.idle_time = 0.0
+        self.last_request = time.time()
         self.EXIT_FLAG = False
+        self.num_workers = args.num_workers
+        self.worker_prefetch = args.worker_prefetch_count
+        self.busy_workers = {}
+        self.exited_workers = set()
 
         self.remaining_timer = remaining_time_minutes(args.time_limit_min)
         next(self.remaining_timer)
@@ -305,14 +310,33 @@ class Master:
             logger.debug(f"Worker {src} requested {max_jobs} jobs")
 
 
+        # Once idle for MAX_IDLE_TIME, stop handing out jobs and send each
+        # worker an exit as soon as it has nothing left to run
+        draining = self.MAX_IDLE_TIME and (
+            self.exited_workers or self.idle_time > self.MAX_IDLE_TIME)
         with SectionTimer("master_dequeue_jobs"):
-            new_job_specs = self.job_source.get_jobs(max_jobs)
+            new_job_specs = [] if draining else self.job_source.get_jobs(max_jobs)
+        reply = {'new_jobs': new_job_specs}
+        if self.MAX_IDLE_TIME:
+            self.update_idle_time(src, msg, new_job_specs)
+            if draining and not self.busy_workers[src]:
+                reply['exit'] = True
+                self.exited_workers.add(src)
         with SectionTimer("master_send"):
-            self.socket.send_json({'new_jobs': new_job_specs})
+            self.socket.send_json(reply)
         if new_job_specs:
             with SectionTimer("master_log_new_jobs"):
                 logger.debug(f"Sent {len(new_job_specs)} new jobs to {src}")
 
+    def update_idle_time(self, src, msg, new_job_specs):
+        '''Accumulate time during which no worker has running or cached jobs'''
+        self.busy_workers[src] = msg['active'] or msg['request_num_jobs'] < self.worker_prefetch
+        now = time.time()
+        idle = (not new_job_specs and not any(self.busy_workers.values())
+                and self.job_source.queue.qsize() == 0)
+        self.idle_time = self.idle_time + (now - self.last_request) if idle else 0.0
+        self.last_request = now
+
     def main(self):
         logger.debug("In master main")
         for remaining_minutes in self.remaining_timer:
@@ -322,7 +346,7 @@ class Master:
             if self.EXIT_FLAG:
                 logger.info("EXIT_FLAG on; master breaking main loop")
                 break
-            if self.idle_time > self.MAX_IDLE_TIME:
+            if self.MAX_IDLE_TIME and len(self.exited_workers) >= self.num_workers:
                 logger.info(f"Nothing to do for {self.MAX_IDLE_TIME} seconds: quitting")
                 break
 
@@ -586,6 +610,10 @@ class Worker:
                 response_msg = self.socket.recv_json()
                 logger.debug(f"Worker response received")
 
+            if response_msg.get('exit'):
+                logger.info(f"Worker {self.hostname} told to exit by master")
+                break
+
             with SectionTimer(f'{self.hostname}_update_cache'):
                 if response_msg.get('new_jobs'):
                     self.runnable_cache.update({
@@ -619,6 +647,8 @@ def parse_args():
     parser.add_argument('--db-prefetch-count', type=int, default=0)
     parser.add_argument('--worker-prefetch-count', type=int, default=64)
     parser.add_argument('--persistent', action='store_true')
+    parser.add_argument('--max-idle-seconds', type=float, default=0,
+                        help="Exit after this long without serial work (0: never)")
     args = parser.parse_args()
     args.master_host = args.master_address.split(':')[0]
     args.master_port = int(args.master_address.split(':')[1])
@@ -42,6 +42,37 @@ def parse_real_time(stdout):
     return float(time_str)
 
 
+def process_start_time():
+    '''Wall-clock time at which this process started (Linux), else None'''
+    try:
+        with open('/proc/self/stat') as fp:
+            start_ticks = int(fp.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as fp:
+            uptime = float(fp.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    age = uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    return time.time() - age
+
+
+class StartupTimer:
+    '''Wall-clock duration of each startup phase, measured from process start'''
+    def __init__(self):
+        self.last = process_start_time() or time.time()
+        self.phases = []
+
+    def mark(self, phase, now=None):
+        '''End the current phase (at now, default: the present)'''
+        now = time.time() if now is None else now
+        self.phases.append((phase, max(now - self.last, 0.0)))
+        self.last = now
+
+    def report(self):
+        total = sum(seconds for _, seconds in self.phases)
+        phases = ', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in self.phases)
+        return f'{phases} (total {total:.2f}s)'
+
+
 def get_tail(fname, nlines=16, indent='    '):
     '''grab last nlines of fname and format nicely'''
 
@@ -1,3 +1,4 @@
+from bisect import bisect_left, bisect_right, insort
 from django.conf import settings
 from balsam.service.schedulers import JobEnv
 from balsam.launcher import mpi_commands
@@ -14,7 +15,43 @@ class Worker:
         self.corner = corner
         self.num_nodes = num_nodes
         self.host_type = host_type
-        self.idle = True
+        self.allocator = None
+        self._idle = True
+        self.cpus = []
+        self.free_cpus = []
+
+    @property
+    def idle(self):
+        return self._idle
+
+    @idle.setter
+    def idle(self, value):
+        if value == self._idle:
+            return
+        self._idle = value
+        if self.allocator is not None:
+            if value:
+                self.allocator.release(self)
+            else:
+                self.allocator.take(self)
+
+    def take_cpus(self, num):
+        '''Reserve ``num`` free CPU ids for a job sharing this node'''
+        if len(self.free_cpus) < num:
+            return []
+        self.idle = False
+        taken, self.free_cpus = self.free_cpus[:num], self.free_cpus[num:]
+        return taken
+
+    def release_cpus(self, cpus):
+        '''Return CPU ids; the node becomes idle again once all are free'''
+        self.free_cpus = sorted(self.free_cpus + list(cpus))
+        if len(self.free_cpus) == len(self.cpus):
+            self.idle = True
+
+    @property
+    def is_shared(self):
+        return not self.idle and len(self.free_cpus) < len(self.cpus)
 
     @property
     def hostname(self):
@@ -26,6 +63,126 @@ class Worker:
         return f"worker{self.id}"
 
 
+class NodeAllocator:
+    '''Tracks idle Workers as maximal runs of consecutive node keys
+
+    Node keys are the integer node IDs where available (e.g. Theta nids, so
+    that a run is a physically contiguous block), otherwise the Worker's
+    position in the group.  Sizes are counted in nodes, summing
+    ``Worker.num_nodes``, so multi-node workers (e.g. BG/Q sub-blocks) are
+    weighted correctly.  ``_starts`` is the sorted list of run starts,
+    ``_runs`` maps start -> end (inclusive) and ``_ends`` the reverse, and
+    ``_by_size`` is a sorted list of (nodes, start) for best-fit lookup.
+    Lookups are bisections; inserting into or deleting from the sorted lists
+    is linear in the number of free runs, which stays small next to the
+    number of workers.'''
+    def __init__(self, workers):
+        if all(isinstance(w.id, int) for w in workers):
+            keys = [w.id for w in workers]
+        else:
+            keys = list(range(len(workers)))
+        self._workers = dict(zip(keys, workers))
+        self._keys = {id(w): key for key, w in self._workers.items()}
+        self._nodes = {key: w.num_nodes or 1 for key, w in self._workers.items()}
+        # cumulative node count through each key, so a run's size is a difference
+        self._cumulative = {}
+        total = 0
+        for key in sorted(self._workers):
+            total += self._nodes[key]
+            self._cumulative[key] = total
+        self._starts = []
+        self._runs = {}
+        self._ends = {}
+        self._by_size = []
+        self.num_free = 0
+        for key in sorted(self._workers):
+            if self._workers[key].idle:
+                self._free_key(key)
+        for w in workers:
+            w.allocator = self
+
+    def _size(self, start, end):
+        return self._cumulative[end] - self._cumulative[start] + self._nodes[start]
+
+    def _add_run(self, start, end):
+        insort(self._starts, start)
+        self._runs[start] = end
+        self._ends[end] = start
+        insort(self._by_size, (self._size(start, end), start))
+
+    def _remove_run(self, start):
+        end = self._runs.pop(start)
+        del self._ends[end]
+        del self._starts[bisect_left(self._starts, start)]
+        del self._by_size[bisect_left(self._by_size, (self._size(start, end), start))]
+        return end
+
+    def _take_key(self, key):
+        idx = bisect_right(self._starts, key) - 1
+        start = self._starts[idx]
+        end = self._remove_run(start)
+        assert start <= key <= end, f"node {key} is not free"
+        if start < key:
+            self._add_run(start, key-1)
+        if key < end:
+            self._add_run(key+1, end)
+        self.num_free -= self._nodes[key]
+
+    def _free_key(self, key):
+        start, end = key, key
+        if key-1 in self._ends:
+            start = self._ends[key-1]
+            self._remove_run(start)
+        if key+1 in self._runs:
+            end = self._remove_run(key+1)
+        self._add_run(start, end)
+        self.num_free += self._nodes[key]
+
+    def take(self, worker):
+        self._take_key(self._keys[id(worker)])
+
+    def release(self, worker):
+        self._free_key(self._keys[id(worker)])
+
+    def _take_block(self, start, num):
+        '''Allocate workers from the front of the run beginning at start until
+        they hold at least ``num`` nodes'''
+        end = self._remove_run(start)
+        workers, nodes, key = [], 0, start
+        while nodes < num:
+            workers.append(self._workers[key])
+            nodes += self._nodes[key]
+            key += 1
+        if key <= end:
+            self._add_run(key, end)
+        self.num_free -= nodes
+        for w in workers:
+            w._idle = False
+        return workers
+
+    def allocate(self, num):
+        '''Best fit: the smallest free run that holds ``num`` nodes.  If the
+        free nodes are too fragmented, fill from the largest runs down.'''
+        if num > self.num_free or num < 1:
+            return []
+        idx = bisect_left(self._by_size, (num, float('-inf')))
+        if idx < len(self._by_size):
+            _, start = self._by_size[idx]
+            return self._take_block(start, num)
+
+        assigned = []
+        nodes = 0
+        while nodes < num:
+            size, start = self._by_size[-1]
+            block = self._take_block(start, min(size, num-nodes))
+            assigned.extend(block)
+            nodes += sum(self._nodes[self._keys[id(w)]] for w in block)
+        return assigned
+
+    def free_runs(self):
+        return [(start, self._runs[start]) for start in self._starts]
+
+
 class WorkerGroup:
     '''Collection of Workers, constructed by passing in a specific host_type
 
@@ -71,9 +228,15 @@ class WorkerGroup:
                 self.workers = self.workers[offset:]
 
         logger.info(f"Built {len(self.workers)} {self.host_type} workers")
+        self.cores_per_node = settings.SERIAL_CORES_PER_NODE
+        cpus = [i*settings.SERIAL_HYPERTHREAD_STRIDE for i in range(self.cores_per_node)]
         for worker in self.workers:
             worker.mpi_cmd = self.mpi_cmd
+            worker.cpus = cpus
+            worker.free_cpus = list(cpus)
             logger.debug(f"ID {worker.id} NODES {worker.num_nodes}")
+        self.allocator = NodeAllocator(self.workers)
+        self.shared = []
 
     def __iter__(self):
         return iter(self.workers)
@@ -84,22 +247,39 @@ class WorkerGroup:
     def idle_workers(self):
         return [w for w in self.workers if w.idle]
 
+    @property
+    def num_idle(self):
+        return self.allocator.num_free
+
     def request(self, num_nodes):
-        idle_workers = self.idle_workers()
-        assigned = []
-        nodes_assigned = 0
-        while nodes_assigned < num_nodes:
-            if not idle_workers:
-                break
-            worker = idle_workers.pop()
-            assigned.append(worker)
-            nodes_assigned += worker.num_nodes
-        if nodes_assigned < num_nodes:
-            return []
+        '''Assign idle workers holding at least num_nodes nodes in total,
+        preferring a contiguous block; returns [] if too few are idle'''
+        return self.allocator.allocate(num_nodes)
+
+    def release(self, workers):
+        for worker in workers:
+            worker.idle = True
+
+    @property
+    def num_shared_cores(self):
+        '''Free cores on nodes that are partially packed with sub-node jobs'''
+        self.shared = [w for w in self.shared if w.is_shared]
+        return sum(len(w.free_cpus) for w in self.shared)
+
+    def request_cores(self, num_cores):
+        '''Pack a sub-node job: returns (worker, cpu ids) on the fullest
+        partially used node with room, else on a fresh idle node; None if neither'''
+        self.shared = [w for w in self.shared if w.is_shared]
+        fits = [w for w in self.shared if len(w.free_cpus) >= num_cores]
+        if fits:
+            worker = min(fits, key=lambda w: len(w.free_cpus))
         else:
-            for worker in assigned:
-                worker.idle = False
-            return assigned
+            workers = self.allocator.allocate(1)
+            if not workers:
+                return None
+            worker = workers[0]
+            self.shared.append(worker)
+        return worker, worker.take_cpus(num_cores)
 
     def __getitem__(self, i):
         return self.workers[i]
@@ -132,6 +312,15 @@ class WorkerGroup:
                 Worker(id, host_type='SLURM', num_nodes=1)
             )
 
+    def setup_LOCAL(self):
+        # virtual nodes assigned by the LocalScheduler pool
+        if not self.workers_str:
+            return self.setup_DEFAULT()
+        for id in self.workers_str.split():
+            self.workers.append(
+                Worker(id, host_type='LOCAL', num_nodes=1)
+            )
+
     def setup_BGQ(self):
         # Boot blocks
         # Get (block, corner, shape) args for each sub-block
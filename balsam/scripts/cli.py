@@ -1,11 +1,12 @@
 # These must come before any other imports
 # --------------
 import argparse
+import signal
 import sys
 from balsam.scripts.cli_commands import newapp, newjob, newdep, ls, modify, rm
 from balsam.scripts.cli_commands import (
     kill, mkchild, launcher, service, make_dummies)
-from balsam.scripts.cli_commands import init, which, server, submitlaunch, log
+from balsam.scripts.cli_commands import init, which, server, submitlaunch, log, prestage
 from balsam import __version__
 
 
@@ -21,6 +22,19 @@ def main():
     args.func(args)
 
 
+def signal_number(name):
+    '''argparse type: a signal name (USR1, SIGUSR1) or number'''
+    if name.isdigit():
+        return int(name)
+    name = name.upper()
+    if not name.startswith('SIG'):
+        name = 'SIG' + name
+    try:
+        return getattr(signal, name)
+    except AttributeError:
+        raise argparse.ArgumentTypeError(f"unknown signal {name}")
+
+
 def config_launcher_subparser(subparser=None):
     if subparser is None:
         parser = argparse.ArgumentParser(description="Start Balsam Job Launcher.")
@@ -30,8 +44,10 @@ def config_launcher_subparser(subparser=None):
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('--consume-all', action='store_true', help="Continuously run all jobs from DB")
     group.add_argument('--wf-filter', help="Continuously run jobs of specified workflow")
-    parser.add_argument('--job-mode', choices=['mpi', 'serial'],
-                        required=True, default='mpi')
+    parser.add_argument('--job-mode', choices=['mpi', 'serial', 'hybrid'],
+                        required=True, default='mpi',
+                        help="hybrid: run multi-rank jobs as in mpi mode and single-rank "
+                        "jobs in serial ensembles, sharing nodes by backlog")
     parser.add_argument('--time-limit-minutes', type=float, default=0,
                         help="Provide a walltime limit if not already imposed")
     parser.add_argument('--num-transition-threads', type=int, default=None)
@@ -40,17 +56,68 @@ def config_launcher_subparser(subparser=None):
     parser.add_argument('--gpus-per-node', type=int, default=None)
     parser.add_argument('--limit-nodes', type=int, default=None)
     parser.add_argument('--offset-nodes', type=int, default=None)
+    parser.add_argument('--backfill', action='store_true',
+                        help="(mpi mode) Reserve nodes for the largest blocked job and "
+                        "only start smaller jobs whose wall_time_minutes end before the "
+                        "reservation, or that use nodes it does not need.")
+    parser.add_argument('--time-margin-minutes', type=float, default=1.0,
+                        help="(mpi mode) Only start jobs whose wall_time_minutes fit in "
+                        "the remaining allocation time minus this margin.")
+    parser.add_argument('--drain-minutes', type=float, default=0.0,
+                        help="(mpi mode) In the final minutes of the allocation, only "
+                        "start short jobs (see --drain-job-minutes).")
+    parser.add_argument('--drain-job-minutes', type=float, default=5.0,
+                        help="(mpi mode) Longest wall_time_minutes started during the "
+                        "drain phase.")
+    parser.add_argument('--checkpoint-minutes', type=float, default=0.0,
+                        help="(mpi mode) This many minutes before the time limit, stop "
+                        "starting jobs and notify running jobs to checkpoint. Jobs that "
+                        "then exit with a nonzero code are marked RUN_TIMEOUT (and can "
+                        "resume on restart); exit code 0 marks them RUN_DONE.")
+    parser.add_argument('--checkpoint-signal', type=signal_number, default=None,
+                        help="(mpi mode) Signal sent as the checkpoint notice, e.g. "
+                        "SIGUSR1 (default: SIGTERM, unless --checkpoint-file is given)")
+    parser.add_argument('--checkpoint-file', default=None,
+                        help="(mpi mode) File touched in each job's working directory "
+                        "as the checkpoint notice")
+    parser.add_argument('--partitions', type=int, default=1,
+                        help="(mpi mode) Split the nodes among this many launch agents "
+                        "coordinated by one supervisor process, which alone talks to "
+                        "the database. Cannot be combined with --backfill, "
+                        "--drain-minutes or the --checkpoint-* options.")
+    parser.add_argument('--supervisor-port', type=int, default=19900,
+                        help="(mpi mode) Local port the supervisor listens on for "
+                        "--partitions agents.")
     parser.add_argument('--persistent', action='store_true',
                         help="Do not shutdown until killed or walltime limit is elapsed "
                         "(even if there are no runable, running, or transitionable jobs).")
     return parser
 
 
+def check_launcher_args(parser, args):
+    '''Reject launcher options that the --partitions supervisor does not implement'''
+    if args.partitions <= 1:
+        return
+    unsupported = [flag for flag, value in [
+        ('--backfill', args.backfill),
+        ('--drain-minutes', args.drain_minutes > 0),
+        ('--checkpoint-minutes', args.checkpoint_minutes > 0),
+        ('--checkpoint-signal', args.checkpoint_signal is not None),
+        ('--checkpoint-file', args.checkpoint_file is not None),
+    ] if value]
+    if unsupported:
+        parser.error(f"{', '.join(unsupported)} cannot be combined with --partitions")
+
+
 def service_subparser(subparser=None):
     if subparser is None:
         parser = argparse.ArgumentParser(description="Start Balsam Job Launcher.")
     else:
         parser = subparser
+    parser.add_argument('--autoscale', action='store_true',
+                        help="Size and count launches from the pending DAG "
+                        "backlog net of queued capacity, instead of packing one "
+                        "launch per cycle")
     return parser
 
 
@@ -70,9 +137,11 @@ def make_parser():
     parser_app.add_argument('--executable', help='full path to executable',
                             required=True)
     parser_app.add_argument('--preprocess', default='',
-                            help='preprocessing script with full path')
+                            help='preprocessing script with full path, or a '
+                            'Python callable given as module:function')
     parser_app.add_argument('--postprocess', default='',
-                            help='postprocessing script with full path')
+                            help='postprocessing script with full path, or a '
+                            'Python callable given as module:function')
     parser_app.add_argument('--description', nargs='+')
     # -------------------------------------------------------------------
 
@@ -300,7 +369,7 @@ def make_parser():
     parser_submitlaunch.add_argument('-t', '--time-minutes', type=int, required=True)
     parser_submitlaunch.add_argument('-q', '--queue', type=str, required=True)
     parser_submitlaunch.add_argument('-A', '--project', type=str, required=True)
-    parser_submitlaunch.add_argument('--job-mode', type=str, choices=['serial', 'mpi'], required=True)
+    parser_submitlaunch.add_argument('--job-mode', type=str, choices=['serial', 'mpi', 'hybrid'], required=True)
     parser_submitlaunch.add_argument('--wf-filter', type=str, default='')
     # TODO(KGF): check the safety/security of the arg of this flag when passed and parsed:
     parser_submitlaunch.add_argument('--sched-flags', type=str, default='', required=False,
@@ -314,9 +383,25 @@ def make_parser():
     parser_init.set_defaults(func=init)
     # -----------------
 
+    # PRESTAGE
+    # --------
+    parser_prestage = subparsers.add_parser('prestage',
+                                            help="Pack Balsam into a zipapp for fast launcher startup",
+                                            description="Pack Balsam and its pure-Python "
+                                            "dependencies into a byte-compiled zipapp that job "
+                                            "scripts can copy to node-local storage and run "
+                                            "with `python balsam.pyz launcher ...`")
+    parser_prestage.add_argument('--output', default='~/.balsam/balsam.pyz',
+                                 help="Path of the zipapp to write")
+    parser_prestage.add_argument('--package', action='append',
+                                 help="Additional pure-Python package to include (repeatable)")
+    parser_prestage.set_defaults(func=prestage)
+    # -----------------
+
     # SERVICE
     # -------
     parser_service = subparsers.add_parser('service', help="Start Balsam auto-scheduling service")
+    service_subparser(parser_service)
     parser_service.set_defaults(func=service)
     # -------------------------
 
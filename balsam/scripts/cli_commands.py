@@ -276,15 +276,22 @@ def mkchild(args):
 
 
 def launcher(args):
-    fname = find_spec("balsam.launcher.launcher").origin
+    from balsam import module_command
     original_args = sys.argv[2:]
     cmd = sys.executable
-    args = [cmd, fname] + original_args
+    args = module_command("balsam.launcher.launcher") + original_args
     pid = os.getpid()
     print(f"Starting Balsam launcher [{pid}]")
     os.execvp(cmd, args)
 
 
+def prestage(args):
+    from balsam.launcher.prestage import DEFAULT_PACKAGES, build_zipapp
+    packages = DEFAULT_PACKAGES + (args.package or [])
+    included = build_zipapp(args.output, packages)
+    print(f"Wrote {args.output} with: {' '.join(included)}")
+
+
 def submitlaunch(args):
     from balsam import setup
     setup()
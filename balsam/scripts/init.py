@@ -60,7 +60,8 @@ def run_migrations():
     call_command('migrate', interactive=True, verbosity=2)
     refresh_db_index()
     try:
-        from balsam.core.models import BalsamJob
+        from balsam.core.models import BalsamJob, install_triggers
+        install_triggers()
         j = BalsamJob()
         j.save()
         j.delete()
@@ -0,0 +1,286 @@
+'''Backlog-driven launch sizing for the Balsam service (``balsam service --autoscale``)
+
+Each service cycle the autoscaler estimates the node-minutes of work on the
+DAG frontier (jobs that are runnable, or whose parents are all runnable,
+running or done), subtracts the node-minutes still to be delivered by
+launches that are already queued or running, and sizes new launches for the
+remaining deficit: for every open queue rule it picks a node count no wider
+than the backlog can use, the number of concurrent launches allowed by
+max_queued, and the shortest wall time that covers both the deficit and the
+longest job, then submits the option with the earliest expected completion
+(queue wait + wall time).
+
+``MockScheduler`` and ``simulate`` run the same policy offline:
+
+    python -m balsam.service.autoscale --jobs 2000 --job-nodes 2 --job-minutes 30
+'''
+import argparse
+from collections import namedtuple
+import json
+from math import ceil
+import logging
+
+from django.db.models import Count
+from balsam import setup
+from balsam.core import models
+from balsam.service.jobpacker import JOB_PAD_MINUTES, node_ranges
+
+logger = logging.getLogger('balsam.service.autoscale')
+BalsamJob = models.BalsamJob
+QueuedLaunch = models.QueuedLaunch
+
+SOON_RUNNABLE_STATES = ['CREATED', 'AWAITING_PARENTS', 'READY', 'STAGED_IN', 'RUN_TIMEOUT']
+PROGRESSING_STATES = (models.RUNNABLE_STATES + models.ACTIVE_STATES +
+                      ['RUN_DONE', 'POSTPROCESSED', 'JOB_FINISHED'])
+
+Backlog = namedtuple('Backlog', ['num_jobs', 'node_minutes', 'max_width',
+                                 'max_minutes', 'parallel_nodes'])
+Launch = namedtuple('Launch', ['queue', 'nodes', 'wall_minutes', 'count', 'completion_minutes'])
+
+
+def job_nodes(num_nodes, node_packing_count):
+    '''Nodes occupied by one job: single-node jobs share nodes node_packing_count ways'''
+    if num_nodes == 1 and node_packing_count > 1:
+        return 1.0 / node_packing_count
+    return float(num_nodes)
+
+
+def summarize(jobs):
+    '''Backlog from (num_nodes, wall_time_minutes, node_packing_count) tuples'''
+    num_jobs, node_minutes, max_width, max_minutes, parallel = 0, 0.0, 0, 0, 0.0
+    for num_nodes, minutes, packing in jobs:
+        nodes = job_nodes(num_nodes, packing)
+        minutes = max(minutes, 1)
+        num_jobs += 1
+        node_minutes += nodes * minutes
+        max_width = max(max_width, num_nodes)
+        max_minutes = max(max_minutes, minutes)
+        parallel += nodes
+    return Backlog(num_jobs, node_minutes, max_width, max_minutes, ceil(parallel))
+
+
+def frontier_jobs():
+    '''(num_nodes, wall_time_minutes, node_packing_count) of runnable jobs and
+    of jobs whose parents are all runnable, running or done'''
+    fields = ('state', 'parents', 'num_nodes', 'wall_time_minutes', 'node_packing_count')
+    rows = list(BalsamJob.objects
+                .filter(state__in=models.RUNNABLE_STATES + SOON_RUNNABLE_STATES)
+                .values_list(*fields))
+    parent_ids = set()
+    pending = []
+    for state, parents, *dims in rows:
+        parents = json.loads(parents) if state not in models.RUNNABLE_STATES else []
+        parent_ids.update(parents)
+        pending.append((parents, dims))
+    parent_states = {str(pk): state for pk, state in
+                     BalsamJob.objects.filter(pk__in=parent_ids).values_list('pk', 'state')}
+    return [tuple(dims) for parents, dims in pending
+            if all(parent_states.get(p) in PROGRESSING_STATES for p in parents)]
+
+
+def fitting_ranges(policy, backlog, pad_minutes=0):
+    '''node_ranges of the queue rules wide enough for the backlog's widest job
+    and long enough for its longest job plus pad_minutes'''
+    longest = backlog.max_minutes + pad_minutes
+    return [(qname, node_range, time_range)
+            for qname, node_range, time_range in node_ranges(policy)
+            if node_range[1] >= backlog.max_width and time_range[1] >= longest]
+
+
+def queued_capacity(launches, status):
+    '''Node-minutes still to be delivered by queued or running launches; uses
+    the scheduler's remaining time where known, else the full wall time'''
+    total = 0.0
+    for launch in launches:
+        stat = status.get(launch.scheduler_id, {})
+        if 'time_remaining_sec' in stat:
+            remaining = stat['time_remaining_sec'] / 60
+        else:
+            remaining = stat.get('time_remaining_min', launch.wall_minutes)
+        total += launch.nodes * remaining
+    return total
+
+
+class Autoscaler:
+    '''Choose the launches that finish the backlog deficit soonest
+
+    policy: {qname: queue_policy} as in balsam.service.queues.queues
+    wait_minutes: callable (qname, nodes) -> expected queue wait; 0 if omitted
+    '''
+    def __init__(self, policy, wait_minutes=None, pad_minutes=JOB_PAD_MINUTES):
+        self.policy = policy
+        self.wait_minutes = wait_minutes or (lambda qname, nodes: 0.0)
+        self.pad_minutes = pad_minutes
+
+    def option(self, qname, node_range, time_range, deficit, backlog, slots):
+        low, high = node_range
+        min_time, max_time = time_range
+        nodes = min(max(backlog.parallel_nodes, 1), high)
+        count = min(slots, ceil(deficit / (nodes * max_time)))
+        nodes = max(ceil(backlog.parallel_nodes / count), min(backlog.max_width, high))
+        nodes = min(max(nodes, low), high)
+        wall = max(ceil(deficit / (count * nodes)), backlog.max_minutes) + self.pad_minutes
+        wall = int(min(max(wall, min_time), max_time))
+        completion = self.wait_minutes(qname, nodes) + wall
+        return Launch(qname, nodes, wall, count, completion)
+
+    def plan(self, backlog, capacity, slots):
+        '''Launches to submit now, given the pending Backlog, the node-minutes
+        already queued or running, and {qname: free max_queued slots}'''
+        deficit = backlog.node_minutes - capacity
+        if backlog.num_jobs == 0 or deficit <= 0:
+            return []
+        open_queues = {q: p for q, p in self.policy.items() if slots.get(q, 0) > 0}
+        best, best_key = None, None
+        for qname, node_range, time_range in fitting_ranges(open_queues, backlog, self.pad_minutes):
+            launch = self.option(qname, node_range, time_range, deficit,
+                                 backlog, slots[qname])
+            waste = launch.count * launch.nodes * launch.wall_minutes - deficit
+            key = (launch.completion_minutes, waste)
+            if best_key is None or key < best_key:
+                best, best_key = launch, key
+        if best is None:
+            logger.warning(f'No open queue fits the widest ({backlog.max_width} nodes) '
+                           f'and longest ({backlog.max_minutes} min) backlog jobs')
+        else:
+            logger.info(f'Backlog {backlog.node_minutes:.0f} node-min, capacity '
+                        f'{capacity:.0f} node-min: {best.count} x {best.nodes} '
+                        f'nodes x {best.wall_minutes} min in {best.queue} '
+                        f'(expected completion {best.completion_minutes:.0f} min)')
+        return [best] if best else []
+
+
+def free_slots(policy):
+    query = QueuedLaunch.objects.values('queue').annotate(num_queued=Count('queue'))
+    num_queued = {d['queue']: d['num_queued'] for d in query}
+    return {qname: queue['max_queued'] - num_queued.get(qname, 0)
+            for qname, queue in policy.items()}
+
+
+def create_qlaunches(policy, autoscaler=None):
+    '''Create (unsubmitted) QueuedLaunches for the current backlog deficit'''
+    from balsam.service.schedulers import scheduler
+    autoscaler = autoscaler or Autoscaler(policy)
+    backlog = summarize(frontier_jobs())
+    launches = QueuedLaunch.objects.filter(from_balsam=True)
+    capacity = queued_capacity(launches, scheduler.status_dict(balsam_only=True))
+    qlaunches = []
+    for launch in autoscaler.plan(backlog, capacity, free_slots(policy)):
+        for i in range(launch.count):
+            qlaunch = QueuedLaunch(queue=launch.queue,
+                                   nodes=launch.nodes,
+                                   job_mode='mpi',
+                                   prescheduled_only=False,
+                                   wall_minutes=launch.wall_minutes)
+            qlaunch.save()
+            qlaunches.append(qlaunch)
+    return qlaunches
+
+
+MockLaunch = namedtuple('MockLaunch', ['scheduler_id', 'queue', 'nodes',
+                                       'wall_minutes', 'submit_time'])
+
+
+class MockScheduler:
+    '''Offline stand-in for the batch scheduler: a launch starts after a fixed
+    queue wait and then delivers nodes x elapsed node-minutes until its wall
+    time runs out or the simulated backlog is done'''
+    def __init__(self, wait_minutes=None):
+        self.wait_minutes = wait_minutes or (lambda qname, nodes: 0.0)
+        self.now = 0.0
+        self.launches = {}
+        self.start_times = {}
+        self.allocated_node_minutes = 0.0  # node-minutes of launches while running
+        self.next_id = 1
+
+    def submit(self, queue, nodes, wall_minutes):
+        launch = MockLaunch(self.next_id, queue, nodes, wall_minutes, self.now)
+        self.launches[launch.scheduler_id] = launch
+        self.start_times[launch.scheduler_id] = self.now + self.wait_minutes(queue, nodes)
+        self.next_id += 1
+        return launch.scheduler_id
+
+    def status_dict(self):
+        status = {}
+        for id, launch in self.launches.items():
+            start = self.start_times[id]
+            running = self.now >= start
+            elapsed = self.now - start if running else 0.0
+            status[id] = {
+                'id': id, 'queue': launch.queue, 'nodes': launch.nodes,
+                'state': 'running' if running else 'queued',
+                'wall_time_min': launch.wall_minutes,
+                'time_remaining_min': launch.wall_minutes - elapsed,
+            }
+        return status
+
+    def advance(self, minutes, work_left):
+        '''Step the clock; return node-minutes of work done (at most work_left).
+        Running launches are charged for the whole step'''
+        end = self.now + minutes
+        delivered = 0.0
+        for id, launch in list(self.launches.items()):
+            start = self.start_times[id]
+            stop = min(end, start + launch.wall_minutes)
+            if stop > max(self.now, start):
+                delivered += launch.nodes * (stop - max(self.now, start))
+            if start + launch.wall_minutes <= end:
+                del self.launches[id]
+        self.allocated_node_minutes += delivered
+        self.now = end
+        return min(delivered, work_left)
+
+
+SimResult = namedtuple('SimResult', ['completion_minutes', 'num_launches',
+                                     'allocated_node_minutes', 'efficiency'])
+
+
+def simulate(autoscaler, jobs, mock_scheduler, step_minutes=1.0, max_minutes=100000):
+    '''Run the autoscaling policy against a MockScheduler until the backlog of
+    (num_nodes, wall_time_minutes, node_packing_count) jobs is worked off'''
+    backlog = summarize(jobs)
+    work_left = backlog.node_minutes
+    num_launches = 0
+    while work_left > 0 and mock_scheduler.now < max_minutes:
+        status = mock_scheduler.status_dict()
+        capacity = queued_capacity(mock_scheduler.launches.values(), status)
+        num_queued = {}
+        for launch in mock_scheduler.launches.values():
+            num_queued[launch.queue] = num_queued.get(launch.queue, 0) + 1
+        slots = {q: p['max_queued'] - num_queued.get(q, 0)
+                 for q, p in autoscaler.policy.items()}
+        remaining = backlog._replace(node_minutes=work_left)
+        for launch in autoscaler.plan(remaining, capacity, slots):
+            for i in range(launch.count):
+                mock_scheduler.submit(launch.queue, launch.nodes, launch.wall_minutes)
+                num_launches += 1
+        work_left -= mock_scheduler.advance(step_minutes, work_left)
+    allocated = mock_scheduler.allocated_node_minutes
+    efficiency = backlog.node_minutes / allocated if allocated else 0.0
+    return SimResult(mock_scheduler.now, num_launches, allocated, efficiency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the Balsam autoscaler "
+                                     "on a synthetic backlog with a mock scheduler")
+    parser.add_argument('--jobs', type=int, default=1000)
+    parser.add_argument('--job-nodes', type=int, default=1)
+    parser.add_argument('--job-minutes', type=float, default=30)
+    parser.add_argument('--node-packing-count', type=int, default=1)
+    parser.add_argument('--wait-minutes', type=float, default=30,
+                        help='queue wait of every mock launch')
+    args = parser.parse_args()
+
+    from balsam.service import queues
+    wait = lambda qname, nodes: args.wait_minutes
+    jobs = [(args.job_nodes, args.job_minutes, args.node_packing_count)] * args.jobs
+    result = simulate(Autoscaler(queues.queues, wait), jobs, MockScheduler(wait))
+    print(f'Finished {args.jobs} jobs in {result.completion_minutes:.0f} minutes '
+          f'using {result.num_launches} launches '
+          f'({result.efficiency:.1%} of {result.allocated_node_minutes:.0f} '
+          f'allocated node-minutes used)')
+
+
+if __name__ == "__main__":
+    setup()
+    main()
@@ -1,8 +1,12 @@
+from collections import namedtuple
+from math import ceil, floor
 from balsam.core import models
+from balsam.service.pack.boxpack import BinPacker, Rect
 import logging
 logger = logging.getLogger(__name__)
 
 JOB_PAD_MINUTES = 5
+MAX_PACK_JOBS = 100000
 BalsamJob = models.BalsamJob
 QueuedLaunch = models.QueuedLaunch
 
@@ -20,9 +24,6 @@ def create_qlaunch(queues):
     else:
         return None
 
-    jobs = jobs.all()
-    return qlaunch, jobs
-
 
 def ready_query():
     return BalsamJob.objects.filter(
@@ -37,7 +38,7 @@ def dummy_pack(jobs, queues):
     jobs); Return: a qlaunch object (from which launcher qsub can be generated),
     and list/queryset of jobs scheduled for that launch'''
     if not queues:
-        return None
+        return None, None
     # qname = list(queues.keys())[0]
     qlaunch = QueuedLaunch(queue='default',
                            nodes=256,
@@ -47,4 +48,97 @@ def dummy_pack(jobs, queues):
     return qlaunch, jobs.all()
 
 
-_pack_jobs = dummy_pack
+PackedLaunch = namedtuple('PackedLaunch', ['queue', 'nodes', 'wall_minutes',
+                                           'job_ids', 'efficiency'])
+
+
+def node_ranges(open_queues):
+    '''Yield (qname, (min_nodes, max_nodes), (min_time, max_time)) for every
+    policy rule of the open queues (same table used by queues.find_queue)'''
+    for qname, queue in open_queues.items():
+        for node_range, time_range in queue.items():
+            if node_range == 'max_queued':
+                continue
+            yield qname, node_range, time_range
+
+
+def pack_box(jobs, nodes, max_minutes):
+    '''Pack (pk, num_nodes, wall_minutes) tuples into a nodes x max_minutes box.
+    Returns the packer; placed rects carry the job pk as id'''
+    packer = BinPacker(nodes, max_minutes)
+    for pk, num_nodes, minutes in jobs:
+        if num_nodes > nodes or minutes > max_minutes:
+            continue
+        packer.try_place(Rect(num_nodes, minutes, id=pk))
+    return packer
+
+
+def plan_launch(jobs, open_queues):
+    '''Choose one batch allocation for the ready backlog
+
+    jobs: list of (pk, num_nodes, wall_minutes) tuples
+    open_queues: {qname: queue_policy} as returned by get_open_queues()
+
+    For each queue rule, the box width is the smallest node count inside the
+    rule's range that fits the widest job and could hold the whole backlog's
+    node-minutes within the rule's max time. Jobs are packed widest/longest
+    first, the box height is shrunk to the packed jobs, and the plan covering
+    the most node-minutes (ties: best efficiency) wins. Returns a
+    PackedLaunch or None if no job fits any open queue.'''
+    jobs = [(pk, max(int(n), 1), max(float(t), 1.0)) for pk, n, t in jobs]
+    if not jobs or not open_queues:
+        return None
+    jobs.sort(key=lambda job: (job[1], job[2]), reverse=True)
+
+    best, best_key = None, None
+    for qname, (low, high), (min_time, max_time) in node_ranges(open_queues):
+        fits = [job for job in jobs if job[1] <= high and job[2] <= max_time]
+        if not fits:
+            continue
+        demand = sum(n*t for _, n, t in fits)
+        widest = max(n for _, n, _ in fits)
+        nodes = max(widest, ceil(demand / max_time), low)
+        nodes = min(nodes, high)
+
+        packer = pack_box(fits, nodes, max_time)
+        if not packer.placed_rects:
+            continue
+        packed_ids = [rect.id for _, rect in packer.placed_rects]
+        packed_area = sum(rect.xdim*rect.ydim for _, rect in packer.placed_rects)
+        top = max(ul[1] + rect.ydim for ul, rect in packer.placed_rects)
+        wall_minutes = min(max(ceil(top), ceil(min_time)), floor(max_time))
+        efficiency = packed_area / (nodes * wall_minutes)
+
+        key = (packed_area, efficiency)
+        if best_key is None or key > best_key:
+            best_key = key
+            best = PackedLaunch(qname, nodes, wall_minutes, packed_ids, efficiency)
+    return best
+
+
+def box_pack(jobs, queues):
+    '''Size a QueuedLaunch from the ready backlog: jobs are packed as
+    (num_nodes x wall_time_minutes) rectangles into a node-by-walltime box
+    allowed by one of the open queues' policy rules. Only the jobs that fit
+    in the box are assigned to the launch'''
+    if not queues:
+        return None, None
+    dims = list(jobs.values_list('pk', 'num_nodes', 'wall_time_minutes')
+                .order_by('-num_nodes', '-wall_time_minutes')[:MAX_PACK_JOBS])
+    plan = plan_launch(dims, queues)
+    if plan is None:
+        logger.info(f'No ready jobs fit the open queues ({len(dims)} ready)')
+        return None, None
+
+    logger.info(f'Packed {len(plan.job_ids)} of {len(dims)} ready jobs into '
+                f'{plan.nodes} nodes x {plan.wall_minutes} min in queue '
+                f'{plan.queue}: allocation efficiency {plan.efficiency:.1%}')
+    qlaunch = QueuedLaunch(queue=plan.queue,
+                           nodes=plan.nodes,
+                           job_mode='mpi',
+                           prescheduled_only=True,
+                           wall_minutes=plan.wall_minutes)
+    return qlaunch, jobs.filter(pk__in=plan.job_ids)
+
+
+_pack_jobs = box_pack
@@ -29,12 +29,150 @@ class Rect:
         return rect
 
 class BinPacker:
+    '''Skyline packer: rects are placed bottom-left on a staircase of
+    (x, height) segments spanning [0, max_x). Each placement evaluates every
+    segment start at once with a sparse-table range max, so the cost per rect
+    grows with the number of skyline segments rather than with the number of
+    rects already placed.'''
+
+    def __init__(self, max_x, max_y):
+        self.max_x = max_x
+        self.max_y = max_y
+        self.seg_x = np.zeros(1)
+        self.seg_y = np.zeros(1)
+        self.placed_rects = []
+        self._failed = np.empty((0, 2))
+
+    def _window_max(self, starts, ends):
+        '''Max skyline height over segments starts[i]..ends[i] (inclusive)'''
+        heights = self.seg_y
+        num = len(heights)
+        level = np.log2(ends - starts + 1).astype(int)
+        levels = level.max() + 1
+        table = np.empty((levels, num))
+        table[0] = heights
+        span = 1
+        for k in range(1, levels):
+            table[k, :num-span] = np.maximum(table[k-1, :num-span], table[k-1, span:])
+            span *= 2
+        return np.maximum(table[level, starts], table[level, ends - (1 << level) + 1])
+
+    def _dominated(self, w, h):
+        failed = self._failed
+        return bool(np.any((failed[:, 0] <= w) & (failed[:, 1] <= h)))
+
+    def _record_failure(self, w, h):
+        failed = self._failed
+        keep = ~((failed[:, 0] >= w) & (failed[:, 1] >= h))
+        self._failed = np.vstack([failed[keep], [w, h]])
+
+    def find_position(self, rect, first_col=False):
+        w, h = rect.xdim, rect.ydim
+        if w > self.max_x or h > self.max_y:
+            return None
+        if self.seg_y.min() + h > self.max_y or self._dominated(w, h):
+            return None
+        xs = self.seg_x
+        num = np.searchsorted(xs, self.max_x - w, side='right')
+        if not num:
+            return None
+        starts = np.arange(num)
+        ends = np.searchsorted(xs, xs[:num] + w, side='left') - 1
+        tops = self._window_max(starts, ends)
+        ok = tops + h <= self.max_y
+        if first_col:
+            ok &= tops == 0
+        if not ok.any():
+            return None
+        candidates = np.flatnonzero(ok)
+        best = candidates[np.argmin(tops[candidates])]
+        return starts[best], tops[best]
+
+    def place(self, rect, i, y):
+        '''Raise the skyline over [x, x+xdim) to y+ydim, merging neighbours
+        of equal height'''
+        xs, ys = self.seg_x, self.seg_y
+        x = xs[i]
+        top = y + rect.ydim
+        end = x + rect.xdim
+        j = np.searchsorted(xs, end, side='right') - 1
+        if i > 0 and ys[i-1] == top:
+            new_x, new_y = [xs[:i]], [ys[:i]]
+        else:
+            new_x, new_y = [xs[:i], [x]], [ys[:i], [top]]
+        if end < self.max_x:
+            if xs[j] < end:
+                if ys[j] != top:
+                    new_x.append([end])
+                    new_y.append([ys[j]])
+                j += 1
+            elif ys[j] == top:
+                j += 1
+            new_x.append(xs[j:])
+            new_y.append(ys[j:])
+        self.seg_x, self.seg_y = np.concatenate(new_x), np.concatenate(new_y)
+        ul = x.item(), y.item()
+        self.placed_rects.append((ul, rect))
+
+    def try_place(self, rect, first_col=False):
+        pos = self.find_position(rect, first_col)
+        if pos is None:
+            if not first_col:
+                self._record_failure(rect.xdim, rect.ydim)
+            return False
+        self.place(rect, *pos)
+        return True
+
+    def shrink_x_to_fit(self):
+        used = np.flatnonzero(self.seg_y > 0)
+        if not len(used):
+            return
+        last = used[-1]
+        if last + 1 < len(self.seg_x):
+            self.max_x = self.seg_x[last+1].item()
+            self.seg_x, self.seg_y = self.seg_x[:last+1], self.seg_y[:last+1]
+
+    def shrink_y_to_fit(self):
+        self.max_y = self.seg_y.max().item()
+
+    def report(self, draw=False):
+        for ul, rect in self.placed_rects:
+            print(rect, 'at', ul)
+        if draw:
+            self.draw()
+
+    def draw(self):
+        from matplotlib import pyplot as plt
+        import matplotlib.patches as patches
+        import matplotlib.cm as cm
+        fig, ax = plt.subplots(1)
+
+        colors = cm.rainbow(np.linspace(0,1, len(self.placed_rects)))
+        title = f'Fit {len(self.placed_rects)} rects in bbox {self.max_x}x{self.max_y}'
+        for c, (ul, rect) in zip(colors, self.placed_rects):
+            ll = ul[0] + rect.xdim, ul[1]
+            x, y = ll[1], self.max_x - ll[0]
+            width, height = rect.ydim, rect.xdim
+            r = patches.Rectangle((x,y), width, height, lw=1,
+                                  edgecolor='k',alpha=0.5, facecolor=c)
+            ax.add_patch(r)
+            #ax.text(x+width/2, y+height/2, f'{rect.id}', fontsize=6)
+        r = patches.Rectangle((0,0), self.max_y, self.max_x, lw=2, edgecolor='r', facecolor='none')
+        ax.add_patch(r)
+        ax.set_ylim(0, self.max_x)
+        ax.set_xlim(0, self.max_y)
+        ax.set_title(title)
+        plt.show()
+
+class GridBinPacker(BinPacker):
+    '''Original occupancy-grid packer; kept as the benchmark baseline'''
+
     def __init__(self, max_x, max_y):
         self.splits_x = [0, max_x]
         self.splits_y = [0, max_y]
         self.max_x = max_x
         self.max_y = max_y
-        self.grid = np.zeros((1,1), dtype=np.bool)
+        self.grid = np.zeros((1,1), dtype=bool)
         self.placed_rects = []
 
     def empty_iter(self): 
@@ -71,9 +209,10 @@ class BinPacker:
             self.add_rect(ix, iy, split_x, split_y, br_ix, br_iy)
             ul = self.splits_x[ix], self.splits_y[iy]
             self.placed_rects.append((ul, rect))
+            return True
         else:
             #print(rect, 'did not fit')
-            return
+            return False
 
     def shrink_x_to_fit(self): 
         occ_x, occ_y = np.where(self.grid)
@@ -87,35 +226,6 @@ class BinPacker:
         self.max_y = y_bound
         self.splits_y[-1] = self.max_y
 
-    def report(self, draw=False):
-        for ul, rect in self.placed_rects:
-            print(rect, 'at', ul)
-        if draw:
-            self.draw()
-
-    def draw(self):
-        from matplotlib import pyplot as plt
-        import matplotlib.patches as patches
-        import matplotlib.cm as cm
-        fig, ax = plt.subplots(1)
-
-        colors = cm.rainbow(np.linspace(0,1, len(self.placed_rects)))
-        title = f'Fit {len(self.placed_rects)} rects in bbox {self.max_x}x{self.max_y}'
-        for c, (ul, rect) in zip(colors, self.placed_rects):
-            ll = ul[0] + rect.xdim, ul[1]
-            x, y = ll[1], self.max_x - ll[0]
-            width, height = rect.ydim, rect.xdim
-            r = patches.Rectangle((x,y), width, height, lw=1,
-                                  edgecolor='k',alpha=0.5, facecolor=c)
-            ax.add_patch(r)
-            #ax.text(x+width/2, y+height/2, f'{rect.id}', fontsize=6)
-        r = patches.Rectangle((0,0), self.max_y, self.max_x, lw=2, edgecolor='r', facecolor='none')
-        ax.add_patch(r)
-        ax.set_ylim(0, self.max_x)
-        ax.set_xlim(0, self.max_y)
-        ax.set_title(title)
-        plt.show()
-
 def main_draw():
     NUM_RECT = 5000
     XMAX, YMAX = 2048, 1440
@@ -157,5 +267,6 @@ def pack():
     packer.shrink_y_to_fit()
     packer.report(draw=True)
 
-cProfile.run('main_prof()', sort='cumtime')
-#main_draw()
+if __name__ == "__main__":
+    cProfile.run('main_prof()', sort='cumtime')
+    #main_draw()
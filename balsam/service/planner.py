@@ -0,0 +1,196 @@
+'''Queue-wait prediction and multi-queue launch planning
+
+``QueueWaitHistory`` records the submit-to-start latency of every launch the
+service submits, per queue and power-of-two node bucket, in
+``~/.balsam/queue_history.json``.  Predicted waits come from the median of
+recent samples in the same bucket, falling back to the queue's median and
+then to DEFAULT_WAIT_MINUTES.  Each prediction is logged again next to the
+observed wait when the launch starts, so the estimator can be tuned from the
+service log.
+
+``SplitPlanner`` extends the autoscaler: instead of one queue rule per cycle
+it searches for the earliest completion time T at which the open queues can
+jointly deliver the backlog deficit.  Rules are filled in order of predicted
+wait, so short debug-queue launches pick up what they can finish by T and
+the bulk goes to the larger queues.
+'''
+import json
+import os
+import time
+from math import ceil
+from statistics import median
+import logging
+
+from django.conf import settings
+from balsam.service.autoscale import Autoscaler, Launch, fitting_ranges
+
+logger = logging.getLogger('balsam.service.planner')
+
+STARTED_STATES = ['running', 'starting', 'exiting', 'completing', 'r', 'cg']
+
+
+def node_bucket(nodes):
+    '''Power-of-two bucket: 1, 2-3, 4-7, ...'''
+    return max(int(nodes), 1).bit_length()
+
+
+class QueueWaitHistory:
+    HISTORY_FILE = 'queue_history.json'
+    MAX_SAMPLES = 50
+    DEFAULT_WAIT_MINUTES = 30.0
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(settings.BALSAM_HOME, self.HISTORY_FILE)
+        self.pending = {}
+        self.samples = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+            self.pending = data['pending']
+            self.samples = data['samples']
+        except (OSError, ValueError, KeyError):
+            self.pending, self.samples = {}, {}
+
+    def save(self):
+        tmp_path = f'{self.path}.{os.getpid()}'
+        try:
+            with open(tmp_path, 'w') as fp:
+                json.dump({'pending': self.pending, 'samples': self.samples}, fp)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f'Could not save queue wait history: {e}')
+
+    @staticmethod
+    def key(queue, nodes):
+        return f'{queue}:{node_bucket(nodes)}'
+
+    def predict(self, queue, nodes):
+        '''Expected queue wait in minutes for a launch of this size'''
+        samples = self.samples.get(self.key(queue, nodes))
+        if not samples:
+            samples = [w for k, waits in self.samples.items()
+                       if k.split(':')[0] == queue for w in waits]
+        if not samples:
+            return self.DEFAULT_WAIT_MINUTES
+        return median(samples)
+
+    def record_submit(self, scheduler_id, queue, nodes, submit_time=None):
+        self.load()
+        predicted = self.predict(queue, nodes)
+        self.pending[str(scheduler_id)] = {
+            'queue': queue, 'nodes': nodes, 'predicted': predicted,
+            'submit_time': time.time() if submit_time is None else submit_time,
+        }
+        self.save()
+        return predicted
+
+    def observe(self, states, now=None):
+        '''Update from {scheduler_id: scheduler state} of queued launches.
+        Launches that started yield a wait sample; launches that are gone
+        without being seen to start are dropped'''
+        now = time.time() if now is None else now
+        self.load()
+        changed = False
+        for id, entry in list(self.pending.items()):
+            state = states.get(int(id))
+            if state is None:
+                del self.pending[id]
+                changed = True
+            elif state.lower() in STARTED_STATES:
+                wait = (now - entry['submit_time']) / 60.0
+                key = self.key(entry['queue'], entry['nodes'])
+                waits = self.samples.setdefault(key, [])
+                waits.append(wait)
+                del waits[:-self.MAX_SAMPLES]
+                del self.pending[id]
+                changed = True
+                logger.info(f'Queue wait {entry["queue"]} ({entry["nodes"]} nodes, '
+                            f'job {id}): predicted {entry["predicted"]:.1f} min, '
+                            f'observed {wait:.1f} min')
+        if changed:
+            self.save()
+
+
+class SplitPlanner(Autoscaler):
+    '''Autoscaler that splits the deficit across several queues'''
+    SEARCH_STEPS = 30
+
+    def __init__(self, policy, history=None, pad_minutes=None):
+        kwargs = {} if pad_minutes is None else {'pad_minutes': pad_minutes}
+        wait = history.predict if history else None
+        super().__init__(policy, wait_minutes=wait, **kwargs)
+
+    def rule_wait(self, qname, node_range, backlog):
+        '''Predicted wait for a rule, at the node count allocate starts from'''
+        low, high = node_range
+        return self.wait_minutes(qname, min(max(backlog.parallel_nodes, low), high))
+
+    def allocate(self, target, deficit, backlog, slots):
+        '''Launches that deliver as much of the deficit as possible by time
+        target, filling rules in order of predicted wait; returns (launches,
+        undelivered node-minutes).  Rules too narrow or short for the
+        backlog's largest job are skipped'''
+        rules = []
+        for qname, node_range, time_range in fitting_ranges(self.policy, backlog, self.pad_minutes):
+            rules.append((self.rule_wait(qname, node_range, backlog), qname, node_range, time_range))
+        rules.sort(key=lambda rule: rule[0])
+
+        slots = dict(slots)
+        left = deficit
+        width_left = backlog.parallel_nodes
+        launches = []
+        for wait, qname, (low, high), (min_time, max_time) in rules:
+            if left <= 0 or width_left <= 0:
+                break
+            if slots.get(qname, 0) <= 0:
+                continue
+            shortest = min(max(min_time, backlog.max_minutes + self.pad_minutes), max_time)
+            wall = min(target - wait, max_time)
+            if wall < shortest or (width_left < low and launches):
+                continue
+            nodes = min(max(width_left, low), high)
+            work_minutes = wall - self.pad_minutes
+            count = min(slots[qname], ceil(left / (nodes * work_minutes)),
+                        max(width_left // nodes, 1))
+            needed = ceil(left / (count * nodes)) + self.pad_minutes
+            wall = int(min(wall, max(needed, shortest)))
+            delivered = count * nodes * (wall - self.pad_minutes)
+            launches.append(Launch(qname, nodes, wall, count, wait + wall))
+            slots[qname] -= count
+            left -= delivered
+            width_left -= count * nodes
+        return launches, left
+
+    def plan(self, backlog, capacity, slots):
+        deficit = backlog.node_minutes - capacity
+        if backlog.num_jobs == 0 or deficit <= 0:
+            return []
+        policy = {q: p for q, p in self.policy.items() if slots.get(q, 0) > 0}
+        ranges = fitting_ranges(policy, backlog, self.pad_minutes)
+        if not ranges:
+            logger.warning(f'No open queue fits the widest ({backlog.max_width} nodes) '
+                           f'and longest ({backlog.max_minutes} min) backlog jobs')
+            return []
+        horizon = max(self.rule_wait(qname, node_range, backlog) + max_time
+                      for qname, node_range, (min_time, max_time) in ranges)
+        launches, left = self.allocate(horizon, deficit, backlog, slots)
+        if left > 0:
+            # even the longest launches cannot cover the deficit: submit them
+            best = launches
+        else:
+            low, high, best = 0.0, horizon, launches
+            for i in range(self.SEARCH_STEPS):
+                target = (low + high) / 2
+                launches, left = self.allocate(target, deficit, backlog, slots)
+                if left > 0:
+                    low = target
+                else:
+                    high, best = target, launches
+        for launch in best:
+            logger.info(f'Planned {launch.count} x {launch.nodes} nodes x '
+                        f'{launch.wall_minutes} min in {launch.queue}: predicted '
+                        f'completion {launch.completion_minutes:.0f} min')
+        return best
@@ -1,6 +1,5 @@
 import os
 from getpass import getuser
-from datetime import datetime
 from django.conf import settings
 from balsam.service.schedulers import Scheduler
 
@@ -18,6 +17,7 @@ class CobaltScheduler(Scheduler.Scheduler):
         'num_workers'  : 'COBALT_PARTSIZE',
         'workers_str'  : 'COBALT_PARTNAME',
         'workers_file' : 'COBALT_NODEFILE',
+        'end_time'     : 'COBALT_ENDTIME',
     }
     JOBSTATUS_VARIABLES = {
         'id' : 'JobID',
@@ -46,38 +46,9 @@ class CobaltScheduler(Scheduler.Scheduler):
         return scheduler_id
 
     def _make_status_cmd(self):
+        # qstat pads columns with whitespace; Command is last, so its spaces
+        # survive the split in _split_job_line
         fields = self.JOBSTATUS_VARIABLES.values()
         cmd = "QSTAT_HEADER=" + ':'.join(fields)
         cmd += f" {self.QSTAT_EXE} -u {getuser()}"
         return cmd
-
-    def _parse_status_output(self, raw_output):
-        status_dict = {}
-        job_lines = raw_output.split('\n')[2:]
-        for line in job_lines:
-            job_stat = self._parse_job_line(line)
-            if job_stat:
-                id = int(job_stat['id'])
-                status_dict[id] = job_stat
-        return status_dict
-
-    def _parse_job_line(self, line):
-        fields = line.split()
-        num_expected = len(self.JOBSTATUS_VARIABLES)
-        if len(fields) != num_expected:
-            return {}
-        stat = {}
-        for i, field_name in enumerate(self.JOBSTATUS_VARIABLES.keys()):
-            stat[field_name] = fields[i]
-            if 'time' in field_name:
-                try:
-                    t = datetime.strptime(fields[i], '%H:%M:%S')
-                except:
-                    pass
-                else:
-                    tsec = t.hour*3600 + t.minute*60 + t.second
-                    stat[field_name+"_sec"] = tsec
-                    tmin = t.hour*60 + t.minute
-                    stat[field_name+"_min"] = tmin
-        logger.debug(str(stat))
-        return stat
@@ -1,6 +1,7 @@
 import os
 import time
 from socket import gethostname
+from django.conf import settings
 from balsam.service.schedulers.exceptions import (
     NoQStatInformation)
 
@@ -18,7 +19,12 @@ class JobEnvironment:
         'SLURM': 'bebop blues lcrc'.split(),
     }
 
+    DEADLINE_VARIABLE = 'BALSAM_JOB_DEADLINE'
+    DEADLINE_DIR = 'job_deadlines'
+    DEADLINE_FILE = '{host}.{scheduler}.{id}'
+
     def __init__(self, scheduler):
+        self.scheduler = scheduler
         self.scheduler_vars = scheduler.SCHEDULER_VARIABLES
         self.pid = os.getpid()
         self.hostname = gethostname()
@@ -26,14 +32,9 @@ class JobEnvironment:
         self.num_workers = 1
         self.workers_str = None
         self.workers_file = None
-        self.remaining_seconds = float("inf")
+        self.end_time = None
+        self._deadline = None
         self.get_env()
-        try:
-            info = scheduler.get_status(self.current_scheduler_id)
-            self.remaining_seconds = info['time_remaining_sec']
-        except (NoQStatInformation, TypeError, KeyError):
-            pass
-        self._last_check_seconds = time.time()
 
     def get_env(self):
         '''Check for environment variables (e.g. COBALT_JOBID) indicating
@@ -48,10 +49,63 @@ class JobEnvironment:
             self.current_scheduler_id = int(self.current_scheduler_id)
             logger.debug(f"Detected scheduler ID {self.current_scheduler_id}")
 
+    def deadline_path(self):
+        # BALSAM_HOME may be shared between machines whose scheduler ids collide
+        fname = self.DEADLINE_FILE.format(
+            host=self.hostname, scheduler=self.scheduler.__class__.__name__,
+            id=self.current_scheduler_id)
+        return os.path.join(settings.BALSAM_HOME, self.DEADLINE_DIR, fname)
+
+    def deadline(self):
+        '''Epoch time at which the current allocation ends, or infinity
+        outside of a scheduled job. Resolved on first use from (in order) the
+        BALSAM_JOB_DEADLINE or scheduler end-time variables, the deadline file
+        of this allocation, and finally a single scheduler status query'''
+        if self._deadline is None:
+            self._deadline = self._resolve_deadline()
+        return self._deadline
+
+    def _resolve_deadline(self):
+        if not self.current_scheduler_id:
+            return float("inf")
+        for value in (os.environ.get(self.DEADLINE_VARIABLE), self.end_time):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                pass
+        try:
+            with open(self.deadline_path()) as fp:
+                return float(fp.read())
+        except (OSError, ValueError):
+            pass
+        try:
+            info = self.scheduler.get_status(self.current_scheduler_id)
+            deadline = time.time() + info['time_remaining_sec']
+        except (NoQStatInformation, TypeError, KeyError):
+            return float("inf")
+        logger.debug(f"Scheduler job {self.current_scheduler_id} ends at {deadline:.0f}")
+        self._write_deadline(deadline)
+        return deadline
+
+    def _write_deadline(self, deadline):
+        path = self.deadline_path()
+        tmp_path = f'{path}.{self.pid}'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w') as fp:
+                fp.write(repr(deadline))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.debug(f'Could not write deadline file {path}: {e}')
+
+    def export_deadline(self):
+        '''Resolve the deadline once and pass it to child processes through
+        BALSAM_JOB_DEADLINE'''
+        deadline = self.deadline()
+        if deadline != float("inf"):
+            os.environ[self.DEADLINE_VARIABLE] = repr(deadline)
+        return deadline
+
     def remaining_time_seconds(self):
-        '''Either counts down from RemainingTime obtained from scheduler, or infinity'''
-        now = time.time()
-        elapsed_time = now - self._last_check_seconds
-        self.remaining_seconds -= elapsed_time
-        self._last_check_seconds = now
-        return self.remaining_seconds
+        '''Seconds left in the current allocation, or infinity'''
+        return self.deadline() - time.time()
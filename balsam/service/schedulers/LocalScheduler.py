@@ -0,0 +1,221 @@
+'''Fork-based stand-in for a batch scheduler on a single machine
+
+Rendered job scripts are run as detached background processes on a pool of
+virtual nodes (``LOCAL_SCHEDULER_NODES`` in settings.json, default 1).
+Resource requests are read from ``#BALSAM-LOCAL key=value`` directives in
+the script (see job-templates/local.localscheduler.tmpl).  There is no
+daemon: every submit or status poll first reaps finished jobs, kills jobs
+past their wall time and starts queued jobs that fit in the free nodes.
+Jobs are tracked in a small JSON state file next to settings.json.
+'''
+import fcntl
+import json
+import os
+import signal
+import subprocess
+import time
+from contextlib import contextmanager
+from getpass import getuser
+from django.conf import settings
+from balsam.service.schedulers import Scheduler
+from balsam.service.schedulers.exceptions import JobSubmitFailed
+import logging
+logger = logging.getLogger(__name__)
+
+
+def new_scheduler():
+    return LocalScheduler()
+
+
+class LocalScheduler(Scheduler.Scheduler):
+    SCHEDULER_VARIABLES = {
+        'current_scheduler_id': 'BALSAM_LOCAL_JOBID',
+        'num_workers': 'BALSAM_LOCAL_NUM_NODES',
+        'workers_str': 'BALSAM_LOCAL_NODELIST',
+        'end_time': 'BALSAM_LOCAL_ENDTIME',
+    }
+    JOBSTATUS_VARIABLES = {
+        'id': 'id',
+        'time_remaining': 'time_remaining',
+        'wall_time': 'wall_time',
+        'state': 'state',
+        'queue': 'queue',
+        'nodes': 'nodes',
+        'project': 'project',
+        'command': 'command',
+    }
+    DIRECTIVE = '#BALSAM-LOCAL'
+    STATE_FILE = 'local_scheduler.json'
+    KILL_GRACE_SECONDS = 30
+
+    def __init__(self):
+        super().__init__()
+        self.state_path = os.path.join(settings.BALSAM_HOME, self.STATE_FILE)
+        self.pool_size = int(getattr(settings, 'LOCAL_SCHEDULER_NODES', 1))
+        self.node_names = [f'local{i}' for i in range(self.pool_size)]
+
+    @contextmanager
+    def _locked_state(self):
+        with open(self.state_path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.state_path) as fp:
+                    state = json.load(fp)
+            except (OSError, ValueError):
+                state = {'next_id': 1, 'jobs': {}}
+            yield state
+            tmp_path = f'{self.state_path}.{os.getpid()}'
+            with open(tmp_path, 'w') as fp:
+                json.dump(state, fp, indent=1)
+            os.replace(tmp_path, self.state_path)
+
+    def _parse_directives(self, script_path):
+        request = {'nodes': 1, 'time': 60, 'queue': 'local', 'project': getuser()}
+        with open(script_path) as fp:
+            for line in fp:
+                if not line.startswith(self.DIRECTIVE):
+                    continue
+                for item in line[len(self.DIRECTIVE):].split():
+                    key, _, value = item.partition('=')
+                    request[key] = value
+        try:
+            request['nodes'] = int(request['nodes'])
+            request['time'] = float(request['time'])
+        except ValueError as e:
+            raise JobSubmitFailed(f'Invalid {self.DIRECTIVE} directive in {script_path}: {e}')
+        if not 0 < request['nodes'] <= self.pool_size:
+            raise JobSubmitFailed(f'{script_path} requests {request["nodes"]} nodes; '
+                                  f'the local pool has {self.pool_size}')
+        return request
+
+    def submit(self, script_path):
+        return self.submit_array(script_path, 1)[0]
+
+    def submit_array(self, script_path, count):
+        request = self._parse_directives(script_path)
+        ids = []
+        with self._locked_state() as state:
+            for i in range(count):
+                scheduler_id = state['next_id']
+                state['next_id'] += 1
+                state['jobs'][str(scheduler_id)] = {
+                    'script': os.path.abspath(script_path),
+                    'nodes': request['nodes'],
+                    'wall_minutes': request['time'],
+                    'queue': request['queue'],
+                    'project': request['project'],
+                    'state': 'queued',
+                    'submit_time': time.time(),
+                }
+                ids.append(scheduler_id)
+            self._schedule(state)
+        self.invalidate_status()
+        logger.info(f'Local jobs {ids} submitted: {script_path}')
+        return ids
+
+    def _status(self, max_age=None, balsam_only=False):
+        with self._locked_state() as state:
+            self._schedule(state)
+            jobs = dict(state['jobs'])
+        now = time.time()
+        return {int(id): self._job_status(int(id), job, now) for id, job in jobs.items()
+                if not balsam_only or self.is_balsam_command(job['script'])}
+
+    def _job_status(self, id, job, now):
+        wall_sec = int(job['wall_minutes'] * 60)
+        if job['state'] == 'running':
+            remaining_sec = max(int(job['start_time'] + wall_sec - now), 0)
+        else:
+            remaining_sec = wall_sec
+        return {
+            'id': id,
+            'time_remaining': self._hms(remaining_sec),
+            'time_remaining_sec': remaining_sec,
+            'time_remaining_min': remaining_sec // 60,
+            'wall_time': self._hms(wall_sec),
+            'wall_time_sec': wall_sec,
+            'wall_time_min': wall_sec // 60,
+            'state': job['state'],
+            'queue': job['queue'],
+            'nodes': job['nodes'],
+            'project': job['project'],
+            'command': job['script'],
+        }
+
+    @staticmethod
+    def _hms(seconds):
+        return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        try:
+            with open(f'/proc/{pid}/stat') as fp:
+                # an exited job not yet reaped by init is a zombie ("Z")
+                return fp.read().rsplit(')', 1)[1].split()[0] != 'Z'
+        except (OSError, IndexError):
+            return True
+
+    def _schedule(self, state):
+        '''Reap finished jobs, enforce wall times, start queued jobs (FIFO)'''
+        now = time.time()
+        jobs = state['jobs']
+        for id, job in list(jobs.items()):
+            if job['state'] != 'running':
+                continue
+            if not self._alive(job['pid']):
+                logger.info(f'Local job {id} finished')
+                del jobs[id]
+                continue
+            overtime = now - job['start_time'] - job['wall_minutes']*60
+            if overtime > self.KILL_GRACE_SECONDS:
+                self._signal(job['pid'], signal.SIGKILL)
+            elif overtime > 0:
+                self._signal(job['pid'], signal.SIGTERM)
+
+        busy = {node for job in jobs.values() if job['state'] == 'running'
+                for node in job['node_list']}
+        free = [node for node in self.node_names if node not in busy]
+        queued = sorted((job['submit_time'], int(id)) for id, job in jobs.items()
+                        if job['state'] == 'queued')
+        for _, id in queued:
+            job = jobs[str(id)]
+            if job['nodes'] > len(free):
+                break
+            node_list, free = free[:job['nodes']], free[job['nodes']:]
+            self._start(id, job, node_list)
+
+    @staticmethod
+    def _signal(pid, signum):
+        try:
+            os.killpg(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _start(self, id, job, node_list):
+        script = job['script']
+        basename = os.path.splitext(os.path.basename(script))[0]
+        cwd = settings.SERVICE_PATH
+        start_time = time.time()
+        env = dict(os.environ)
+        env.update({
+            self.SCHEDULER_VARIABLES['current_scheduler_id']: str(id),
+            self.SCHEDULER_VARIABLES['num_workers']: str(len(node_list)),
+            self.SCHEDULER_VARIABLES['workers_str']: ' '.join(node_list),
+            self.SCHEDULER_VARIABLES['end_time']: str(start_time + job['wall_minutes']*60),
+        })
+        # The intermediate shell exits right away, so the job is reparented
+        # to init and never lingers as a zombie of the submitting process
+        launch = f'setsid bash {script} > {basename}.out 2>&1 < /dev/null & echo $!'
+        p = subprocess.run(launch, shell=True, cwd=cwd, env=env,
+                           stdout=subprocess.PIPE, encoding='utf-8')
+        job['pid'] = int(p.stdout.split()[-1])
+        job['state'] = 'running'
+        job['start_time'] = start_time
+        job['node_list'] = node_list
+        logger.info(f'Local job {id} started on {node_list} (pid {job["pid"]})')
@@ -1,4 +1,9 @@
+import json
+import os
+import socket
 import subprocess
+import time
+from django.conf import settings
 from balsam.service.schedulers.exceptions import (
     SubmitNonZeroReturnCode, StatusNonZeroReturnCode,
     NoQStatInformation)
@@ -6,35 +11,181 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def parse_duration(text):
+    '''Seconds in a "[days-][hours:]minutes:seconds" string; None if the
+    string is not a duration (e.g. "UNLIMITED" or "N/A")'''
+    days, _, hms = text.rpartition('-')
+    seconds = 0
+    try:
+        for part in hms.split(':'):
+            seconds = seconds*60 + int(part)
+        if days:
+            seconds += int(days) * 86400
+    except ValueError:
+        return None
+    return seconds
+
+
+def format_duration(seconds):
+    '''Inverse of parse_duration: "[days-]hours:minutes:seconds"'''
+    days, seconds = divmod(int(seconds), 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    hms = f'{hours:02d}:{minutes:02d}:{seconds:02d}'
+    return f'{days}-{hms}' if days else hms
+
+
 class Scheduler:
     SCHEDULER_VARIABLES = {}
-    JOBSTATUS_VARIABLES = {}
+    JOBSTATUS_VARIABLES = {}  # 'command' comes last: it may contain spaces
+    TIME_FIELDS = ('time_remaining', 'wall_time')
+    COUNTDOWN_FIELDS = ('time_remaining',)  # TIME_FIELDS that shrink as jobs run
+    STATUS_TTL_SECONDS = 10.0
+    STATUS_CACHE_FILE = 'scheduler_status.{host}.{scheduler}.json'
 
     def __init__(self):
         logger.debug(f"Using scheduler class {self.__class__}")
+        # BALSAM_HOME may be shared between machines with different schedulers
+        cache_file = self.STATUS_CACHE_FILE.format(
+            host=socket.gethostname(), scheduler=self.__class__.__name__)
+        self.status_cache_path = os.path.join(settings.BALSAM_HOME, cache_file)
 
     def submit(self, script_path):
         submit_cmd = self._make_submit_cmd(script_path)
+        return self._run_submit(submit_cmd)
+
+    def submit_array(self, script_path, count):
+        '''Submit count identical copies of script_path; returns one scheduler
+        id per copy. Backends with job arrays submit all copies at once, and
+        copies still pending in the array may share the array's id'''
+        return [self.submit(script_path) for i in range(count)]
+
+    def _run_submit(self, submit_cmd):
         p = subprocess.run(submit_cmd, stdout=subprocess.PIPE,shell=True,
                              stderr=subprocess.STDOUT, encoding='utf-8')
+        self.invalidate_status()
         if p.returncode != 0:
             raise SubmitNonZeroReturnCode(p.stdout)
         scheduler_id = self._parse_submit_output(p.stdout)
         return scheduler_id
 
-    def _status(self):
+    def _status(self, max_age=None, balsam_only=False):
+        '''Scheduler status of this user's jobs (only those submitted by the
+        Balsam service if balsam_only). A poll younger than max_age seconds
+        (default STATUS_TTL_SECONDS), made by this or any other Balsam
+        process, is reused instead of running the status command again'''
+        if max_age is None:
+            max_age = self.STATUS_TTL_SECONDS
+        cached = self._cached_status(max_age, balsam_only)
+        if cached is not None:
+            return cached
         stat_cmd = self._make_status_cmd()
         p = subprocess.run(stat_cmd, stdout=subprocess.PIPE, shell=True,
                            stderr=subprocess.STDOUT, encoding='utf-8')
         if p.returncode != 0:
             raise StatusNonZeroReturnCode(p.stdout)
-        statinfo = self._parse_status_output(p.stdout)
+        statinfo = self._parse_status_output(p.stdout, balsam_only)
+        self._store_status(statinfo, balsam_only)
+        return statinfo
+
+    def _cached_status(self, max_age, balsam_only=False):
+        if max_age <= 0:
+            return None
+        cached = self._read_status_file()
+        if cached is None:
+            return None
+        polled, statinfo, filtered = cached
+        age = time.time() - polled
+        if age > max_age or (filtered and not balsam_only):
+            return None
+        if balsam_only and not filtered:
+            statinfo = {id: stat for id, stat in statinfo.items()
+                        if self.is_balsam_command(stat.get('command', ''))}
+        for stat in statinfo.values():
+            self._age_stat(stat, age)
         return statinfo
 
-    def get_status(self, scheduler_id):
+    def _age_stat(self, stat, age):
+        '''Count the COUNTDOWN_FIELDS of a cached job status down by age seconds,
+        keeping the raw string, _sec and _min forms consistent'''
+        for name in self.COUNTDOWN_FIELDS:
+            if name+'_sec' not in stat:
+                continue
+            seconds = max(int(stat[name+'_sec'] - age), 0)
+            stat[name] = format_duration(seconds)
+            stat[name+'_sec'] = seconds
+            stat[name+'_min'] = seconds // 60
+
+    def _read_status_file(self):
+        try:
+            with open(self.status_cache_path) as fp:
+                data = json.load(fp)
+            statinfo = {int(id): stat for id, stat in data['status'].items()}
+            return data['time'], statinfo, data.get('balsam_only', False)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _store_status(self, statinfo, balsam_only=False):
+        polled = time.time()
+        tmp_path = f'{self.status_cache_path}.{os.getpid()}'
+        try:
+            with open(tmp_path, 'w') as fp:
+                json.dump({'time': polled, 'status': statinfo,
+                           'balsam_only': balsam_only}, fp)
+            os.replace(tmp_path, self.status_cache_path)
+        except OSError as e:
+            logger.debug(f'Could not write scheduler status cache: {e}')
+
+    def invalidate_status(self):
+        try:
+            os.remove(self.status_cache_path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def is_balsam_command(command):
+        '''Whether a job command is a launch script rendered by the service'''
+        return command.startswith(settings.SERVICE_PATH)
+
+    def _split_job_line(self, line, num_fields):
+        return line.split(None, num_fields - 1)
+
+    def _parse_status_output(self, raw_output, balsam_only=False):
+        '''Single pass over the status output; header and malformed lines
+        are skipped, as are foreign jobs if balsam_only'''
+        num_fields = len(self.JOBSTATUS_VARIABLES)
+        status_dict = {}
+        for line in raw_output.splitlines():
+            fields = self._split_job_line(line, num_fields)
+            if len(fields) != num_fields:
+                continue
+            if balsam_only and not self.is_balsam_command(fields[-1]):
+                continue
+            stat = self._parse_job_fields(fields)
+            if stat:
+                status_dict[stat['id']] = stat
+        logger.debug(f'Parsed scheduler status of {len(status_dict)} jobs')
+        return status_dict
+
+    def _parse_job_fields(self, fields):
+        '''Status dict from the JOBSTATUS_VARIABLES fields of one job line'''
+        try:
+            id = int(fields[0])
+        except ValueError:
+            return None
+        stat = dict(zip(self.JOBSTATUS_VARIABLES, fields))
+        stat['id'] = id
+        for name in self.TIME_FIELDS:
+            seconds = parse_duration(stat[name])
+            if seconds is not None:
+                stat[name+"_sec"] = seconds
+                stat[name+"_min"] = seconds // 60
+        return stat
+
+    def get_status(self, scheduler_id, max_age=None):
         scheduler_id = int(scheduler_id)
         try:
-            statuses = self._status()
+            statuses = self._status(max_age)
         except StatusNonZeroReturnCode as e:
             raise NoQStatInformation("QStat failed: {}".format(e))
         try:
@@ -45,5 +196,5 @@ class Scheduler:
         else:
             return stat
 
-    def status_dict(self):
-        return self._status()
+    def status_dict(self, max_age=None, balsam_only=False):
+        return self._status(max_age, balsam_only)
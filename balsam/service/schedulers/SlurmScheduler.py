@@ -1,12 +1,24 @@
 import os
 from getpass import getuser
-from dateutil.parser import parse as parse_time
 from django.conf import settings
 from balsam.service.schedulers import Scheduler
 import logging
 logger = logging.getLogger(__name__)
 
 
+def count_array_tasks(tasks):
+    '''Number of array elements in a task expression like "0-7:2,9%4"'''
+    count = 0
+    for part in tasks.split('%')[0].split(','):
+        bounds, _, step = part.partition(':')
+        first, _, last = bounds.partition('-')
+        try:
+            count += (int(last or first) - int(first)) // int(step or 1) + 1
+        except ValueError:
+            count += 1
+    return count
+
+
 def new_scheduler():
     return SlurmScheduler()
 
@@ -17,16 +29,20 @@ class SlurmScheduler(Scheduler.Scheduler):
         'num_workers': 'SLURM_JOB_NUM_NODES',
         'workers_str': 'SLURM_HOSTS',
     }
+    # squeue -o codes; %A is unique per array element, %F the array's job id
     JOBSTATUS_VARIABLES = {
-        'id': 'jobid',
-        'time_remaining': 'timeleft',
-        'wall_time': 'timelimit',
-        'state': 'state',
-        'queue': 'partition',
-        'nodes': 'numnodes',
-        'project': 'account',
-        'command': 'command',
+        'id': '%A',
+        'time_remaining': '%L',
+        'wall_time': '%l',
+        'state': '%T',
+        'queue': '%P',
+        'nodes': '%D',
+        'project': '%a',
+        'array_id': '%F',
+        'array_tasks': '%K',
+        'command': '%o',
     }
+    STATUS_DELIMITER = '|'
 
     def _make_submit_cmd(self, script_path):
         cwd = settings.SERVICE_PATH
@@ -34,6 +50,18 @@ class SlurmScheduler(Scheduler.Scheduler):
         basename = os.path.splitext(basename)[0]
         return f"sbatch --chdir {cwd} --job-name {basename} -o {basename}.out {script_path}"
 
+    def submit_array(self, script_path, count):
+        '''One sbatch --array call; every element starts out under the
+        array's job id and gets its own id from Slurm when it starts'''
+        if count == 1:
+            return [self.submit(script_path)]
+        cwd = settings.SERVICE_PATH
+        basename = os.path.basename(script_path)
+        basename = os.path.splitext(basename)[0]
+        submit_cmd = (f"sbatch --array=0-{count-1} --chdir {cwd} --job-name {basename} "
+                      f"-o {basename}_%a.out {script_path}")
+        return [self._run_submit(submit_cmd)] * count
+
     def _parse_submit_output(self, submit_output):
         try:
             scheduler_id = int(submit_output)
@@ -42,38 +70,21 @@ class SlurmScheduler(Scheduler.Scheduler):
         return scheduler_id
 
     def _make_status_cmd(self):
-        fields = self.JOBSTATUS_VARIABLES.values()
-        fmt = ' '.join(fields)
-        cmd = f'squeue -u {getuser()} -O "{fmt}"'
-        return cmd
+        fmt = self.STATUS_DELIMITER.join(self.JOBSTATUS_VARIABLES.values())
+        return f'squeue --noheader -u {getuser()} -o "{fmt}"'
 
-    def _parse_status_output(self, raw_output):
-        status_dict = {}
-        job_lines = raw_output.split('\n')[1:]
-        for line in job_lines:
-            job_stat = self._parse_job_line(line)
-            if job_stat:
-                id = int(job_stat['id'])
-                status_dict[id] = job_stat
-        return status_dict
+    def _split_job_line(self, line, num_fields):
+        return line.split(self.STATUS_DELIMITER, num_fields - 1)
 
-    def _parse_job_line(self, line):
-        fields = line.split()
-        num_expected = len(self.JOBSTATUS_VARIABLES)
-        if len(fields) != num_expected:
-            return {}
-        stat = {}
-        for i, field_name in enumerate(self.JOBSTATUS_VARIABLES.keys()):
-            stat[field_name] = fields[i]
-            if 'time' in field_name:
-                try:
-                    t = parse_time(fields[i])
-                except:
-                    pass
-                else:
-                    tsec = t.hour*3600 + t.minute*60 + t.second
-                    stat[field_name+"_sec"] = tsec
-                    tmin = t.hour*60 + t.minute
-                    stat[field_name+"_min"] = tmin
-        logger.debug(str(stat))
+    def _parse_job_fields(self, fields):
+        stat = super()._parse_job_fields(fields)
+        if stat is None:
+            return None
+        array_tasks = stat.pop('array_tasks')
+        if array_tasks == 'N/A':
+            del stat['array_id']
+        else:
+            # squeue shows the still-pending elements of an array as one line
+            stat['array_id'] = int(stat['array_id'])
+            stat['array_count'] = count_array_tasks(array_tasks)
         return stat
@@ -9,7 +9,7 @@ from socket import gethostname
 from django.db.models import Count
 from balsam import config_logging, settings, setup
 from balsam.core import models
-from balsam.service import queues, jobpacker
+from balsam.service import autoscale, planner, queues, jobpacker
 from balsam.service.schedulers import script_template, scheduler
 from balsam.scripts.cli import service_subparser
 from balsam.core import transitions
@@ -18,36 +18,69 @@ logger = logging.getLogger('balsam.service.service')
 QueuedLaunch = models.QueuedLaunch
 BalsamJob = models.BalsamJob
 source = BalsamJob.source
+queue_history = planner.QueueWaitHistory()
 EXIT_FLAG = False
 
 
+ARRAY_FIELDS = ('project', 'queue', 'nodes', 'wall_minutes', 'job_mode',
+                'wf_filter', 'sched_flags')
+
+
 def submit_qlaunch(qlaunch, verbose=False):
+    submit_qlaunch_array([qlaunch], verbose)
+
+
+def submit_qlaunch_array(qlaunches, verbose=False):
+    '''Submit identical QueuedLaunches with one scheduler call (a job array
+    where the scheduler has them); each keeps its own QueuedLaunch row'''
     top = settings.SERVICE_PATH
-    pk = qlaunch.pk
+    pk = qlaunches[0].pk
     script_path = os.path.join(top, f'qlaunch{pk}.sh')
     if os.path.exists(script_path):
         raise ValueError("Job script already rendered for {qlaunch}")
-    script = script_template.render(qlaunch)
+    script = script_template.render(qlaunches[0])
 
     with open(script_path, 'w') as fp:
         fp.write(script)
     st = os.stat(script_path)
     os.chmod(script_path, st.st_mode | stat.S_IEXEC)
     try:
-        sched_id = scheduler.submit(script_path)
+        sched_ids = scheduler.submit_array(script_path, len(qlaunches))
     except Exception as e:
-        logger.error(f'Failed to submit job for {qlaunch}:\n{e}')
-        qlaunch.delete()
+        logger.error(f'Failed to submit job for {qlaunches[0]} (x{len(qlaunches)}):\n{e}')
+        for qlaunch in qlaunches:
+            qlaunch.delete()
         raise
-    else:
+    for qlaunch, sched_id in zip(qlaunches, sched_ids):
         qlaunch.scheduler_id = sched_id
         qlaunch.state = "submitted"
         qlaunch.command = script_path
         qlaunch.save(update_fields=['scheduler_id','state','command'])
-        msg = f'Submit OK: {qlaunch}'
-        logger.info(msg)
-        if verbose:
-            print(msg)
+    for sched_id in sorted(set(sched_ids)):
+        predicted = queue_history.record_submit(sched_id, qlaunches[0].queue,
+                                                qlaunches[0].nodes)
+    if len(qlaunches) > 1:
+        msg = (f'Submit OK: array of {len(qlaunches)} launches {sorted(set(sched_ids))} '
+               f'(predicted queue wait {predicted:.0f} min): {qlaunches[0]}')
+    else:
+        msg = f'Submit OK (predicted queue wait {predicted:.0f} min): {qlaunches[0]}'
+    logger.info(msg)
+    if verbose:
+        print(msg)
+
+
+def submit_qlaunches(qlaunches, verbose=False):
+    '''Submit QueuedLaunches, batching identical ones into job arrays.
+    Prescheduled launches own specific BalsamJobs and go out one by one'''
+    arrays = {}
+    for qlaunch in qlaunches:
+        if qlaunch.prescheduled_only:
+            submit_qlaunch(qlaunch, verbose)
+        else:
+            key = tuple(getattr(qlaunch, field) for field in ARRAY_FIELDS)
+            arrays.setdefault(key, []).append(qlaunch)
+    for group in arrays.values():
+        submit_qlaunch_array(group, verbose)
 
 
 def sig_handler(signum, stack):
@@ -74,12 +107,17 @@ def main(args):
 
     while not EXIT_FLAG:
         QueuedLaunch.refresh_from_scheduler()
+        queue_history.observe(dict(QueuedLaunch.objects.values_list('scheduler_id', 'state')))
         open_queues = get_open_queues()
         if open_queues:
             logger.info(f"Open queues: {list(open_queues.keys())}")
-            qlaunch = jobpacker.create_qlaunch(open_queues)
-            if qlaunch:
-                submit_qlaunch(qlaunch)
+            if args.autoscale:
+                scaler = planner.SplitPlanner(queues.queues, queue_history)
+                submit_qlaunches(autoscale.create_qlaunches(queues.queues, scaler))
+            else:
+                qlaunch = jobpacker.create_qlaunch(open_queues)
+                if qlaunch:
+                    submit_qlaunch(qlaunch)
         if not QueuedLaunch.acquire_advisory():
             logger.error('Failed to refresh advisory lock; aborting')
             break
@@ -2,9 +2,8 @@ import os
 import unittest
 
 from django.core.management import call_command
-from django.conf import settings
 
-from balsam.service.models import BalsamJob, ApplicationDefinition
+from balsam.core.models import BalsamJob, ApplicationDefinition
 
 
 class BalsamTestCase(unittest.TestCase):
@@ -28,7 +27,7 @@ class BalsamTestCase(unittest.TestCase):
         call_command('flush', interactive=False, verbosity=0)
 
 
-def create_job(*, name='', app='', direct_command='', site=settings.BALSAM_SITE, num_nodes=1,
+def create_job(*, name='', app='', direct_command='', site='', num_nodes=1,
                ranks_per_node=1, threads_per_rank=1, threads_per_core=1, args='', workflow='',
                envs={}, state='CREATED', url_in='', input_files='', url_out='', stage_out_files='',
                post_error_handler=False, post_timeout_handler=False,
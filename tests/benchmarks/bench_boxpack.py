@@ -0,0 +1,44 @@
+import random
+import time
+import unittest
+
+from balsam.service.pack.boxpack import BinPacker, GridBinPacker, Rect
+from tests import util
+
+
+def time_packing(packer_cls, num_rects, box=(2048, 1440),
+                 xrange=(2, 128), yrange=(30, 180), seed=0):
+    '''Pack random rects widest-first; return (num placed, fill fraction, seconds)'''
+    random.seed(seed)
+    rects = [Rect.rand_rect(xrange, yrange) for i in range(num_rects)]
+    rects.sort(key=lambda r: r.xdim, reverse=True)
+    packer = packer_cls(*box)
+    start = time.perf_counter()
+    for rect in rects:
+        packer.try_place(rect)
+    elapsed = time.perf_counter() - start
+    area = sum(r.xdim*r.ydim for _, r in packer.placed_rects)
+    return len(packer.placed_rects), area / (box[0]*box[1]), elapsed
+
+
+class TestBoxPack(unittest.TestCase):
+
+    GRID_SIZES = [100, 200, 400, 600]
+    SKYLINE_SIZES = [100, 200, 400, 600, 10000, 100000]
+
+    def test_grid_vs_skyline(self):
+        '''Time the occupancy-grid packer against the skyline packer on the
+        same random backlogs (node x minute rects in a 2048 x 1440 box)'''
+        lines = ['# packer num_rects num_placed fill seconds']
+        for packer_cls, sizes in [(GridBinPacker, self.GRID_SIZES),
+                                  (BinPacker, self.SKYLINE_SIZES)]:
+            for num_rects in sizes:
+                placed, fill, elapsed = time_packing(packer_cls, num_rects)
+                lines.append(f'{packer_cls.__name__} {num_rects} {placed} '
+                             f'{fill:.3f} {elapsed:.3f}')
+                print(lines[-1])
+        self.assertLess(elapsed, 30.0)
+
+        resultpath = util.benchmark_outfile_path('boxpack.dat')
+        with open(resultpath, 'w') as fp:
+            fp.write('\n'.join(lines) + '\n')
@@ -0,0 +1,66 @@
+import unittest
+
+from balsam.service.autoscale import (
+    Autoscaler, MockScheduler, queued_capacity, simulate, summarize
+)
+
+
+class AutoscalerTests(unittest.TestCase):
+    policy = {
+        'debug': {'max_queued': 1, (1, 8): (5, 60)},
+        'default': {'max_queued': 5, (128, 4096): (30, 720)},
+    }
+
+    def test_summarize_packs_single_node_jobs(self):
+        backlog = summarize([(1, 30, 4)] * 8 + [(16, 10, 1)])
+        self.assertEqual(backlog.num_jobs, 9)
+        self.assertAlmostEqual(backlog.node_minutes, 8*30/4 + 160)
+        self.assertEqual((backlog.max_width, backlog.parallel_nodes), (16, 18))
+
+    def test_no_launch_when_capacity_covers_backlog(self):
+        backlog = summarize([(2, 30, 1)] * 4)
+        scaler = Autoscaler(self.policy)
+        self.assertEqual(scaler.plan(backlog, 240, {'debug': 1, 'default': 5}), [])
+
+    def test_prefers_queue_with_earliest_completion(self):
+        backlog = summarize([(2, 30, 1)] * 4)
+        slots = {'debug': 1, 'default': 5}
+        [launch] = Autoscaler(self.policy).plan(backlog, 0, slots)
+        self.assertEqual((launch.queue, launch.nodes, launch.count), ('debug', 8, 1))
+
+        wait = lambda qname, nodes: 600 if qname == 'debug' else 0
+        [launch] = Autoscaler(self.policy, wait).plan(backlog, 0, slots)
+        self.assertEqual(launch.queue, 'default')
+        self.assertEqual(launch.wall_minutes, 35)
+
+    def test_skips_queues_too_small_for_widest_job(self):
+        '''A 16-node job cannot run in debug (max 8 nodes), however soon it starts'''
+        backlog = summarize([(16, 30, 1)] + [(1, 30, 1)] * 4)
+        [launch] = Autoscaler(self.policy).plan(backlog, 0, {'debug': 1, 'default': 5})
+        self.assertEqual(launch.queue, 'default')
+        self.assertGreaterEqual(launch.nodes, 16)
+        self.assertEqual(Autoscaler(self.policy).plan(backlog, 0, {'debug': 1}), [])
+
+    def test_skips_queues_too_short_for_longest_job(self):
+        backlog = summarize([(2, 120, 1)] * 2)
+        self.assertEqual(Autoscaler(self.policy).plan(backlog, 0, {'debug': 1}), [])
+
+    def test_capacity_prefers_remaining_seconds(self):
+        sched = MockScheduler()
+        sched.submit('debug', 4, 60)
+        status = {1: {'time_remaining_sec': 1530, 'time_remaining_min': 60}}
+        self.assertEqual(queued_capacity(sched.launches.values(), status), 4*25.5)
+
+    def test_capacity_uses_remaining_time(self):
+        sched = MockScheduler()
+        sched.submit('debug', 4, 60)
+        sched.advance(20, work_left=1e9)
+        status = sched.status_dict()
+        self.assertEqual(queued_capacity(sched.launches.values(), status), 4*40)
+
+    def test_simulation_finishes_backlog(self):
+        wait = lambda qname, nodes: 30
+        jobs = [(2, 30, 1)] * 200
+        result = simulate(Autoscaler(self.policy, wait), jobs, MockScheduler(wait))
+        self.assertLess(result.completion_minutes, 200)
+        self.assertGreater(result.efficiency, 0.5)
@@ -0,0 +1,66 @@
+import random
+import unittest
+
+from balsam.service.jobpacker import plan_launch
+from balsam.service.pack.boxpack import BinPacker, Rect
+
+
+class PlanLaunchTests(unittest.TestCase):
+    policy = {
+        'debug': {'max_queued': 1, (1, 8): (5, 60)},
+        'default': {'max_queued': 5, (128, 4096): (30, 720)},
+    }
+
+    def test_small_backlog_sized_to_demand(self):
+        jobs = [(i, 2, 30) for i in range(8)]
+        plan = plan_launch(jobs, {'debug': self.policy['debug']})
+        self.assertEqual(plan.queue, 'debug')
+        self.assertEqual(plan.nodes, 8)
+        self.assertEqual(plan.wall_minutes, 60)
+        self.assertEqual(sorted(plan.job_ids), list(range(8)))
+        self.assertAlmostEqual(plan.efficiency, 1.0)
+
+    def test_respects_queue_ranges(self):
+        jobs = [(0, 16, 20), (1, 1, 10)]
+        plan = plan_launch(jobs, self.policy)
+        self.assertEqual(plan.queue, 'default')
+        self.assertEqual(plan.nodes, 128)
+        self.assertEqual(plan.wall_minutes, 30)
+        self.assertEqual(sorted(plan.job_ids), [0, 1])
+        self.assertLess(plan.efficiency, 1.0)
+
+    def test_nothing_fits(self):
+        self.assertIsNone(plan_launch([(0, 16, 20)], {'debug': self.policy['debug']}))
+        self.assertIsNone(plan_launch([], self.policy))
+
+
+class SkylinePackerTests(unittest.TestCase):
+    def assertNoOverlap(self, packer):
+        placed = packer.placed_rects
+        for n, ((x, y), rect) in enumerate(placed):
+            self.assertLessEqual(x + rect.xdim, packer.max_x)
+            self.assertLessEqual(y + rect.ydim, packer.max_y)
+            for (x2, y2), other in placed[n+1:]:
+                overlap_x = x < x2 + other.xdim and x2 < x + rect.xdim
+                overlap_y = y < y2 + other.ydim and y2 < y + rect.ydim
+                self.assertFalse(overlap_x and overlap_y, f'{rect} overlaps {other}')
+
+    def test_random_rects_do_not_overlap(self):
+        random.seed(7)
+        rects = [Rect.rand_rect((1, 16), (5, 60)) for _ in range(300)]
+        packer = BinPacker(64, 240)
+        for rect in sorted(rects, key=lambda r: r.xdim, reverse=True):
+            packer.try_place(rect)
+        self.assertGreater(len(packer.placed_rects), 10)
+        self.assertNoOverlap(packer)
+
+    def test_bottom_left_and_shrink(self):
+        packer = BinPacker(10, 100)
+        self.assertTrue(packer.try_place(Rect(4, 30, id=0)))
+        self.assertTrue(packer.try_place(Rect(4, 20, id=1)))
+        self.assertTrue(packer.try_place(Rect(4, 10, id=2)))
+        self.assertEqual([ul for ul, _ in packer.placed_rects], [(0, 0), (4, 0), (4, 20)])
+        self.assertFalse(packer.try_place(Rect(11, 1, id=3)))
+        packer.shrink_y_to_fit()
+        packer.shrink_x_to_fit()
+        self.assertEqual((packer.max_x, packer.max_y), (8, 30))
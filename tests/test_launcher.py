@@ -0,0 +1,211 @@
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from balsam.launcher.launcher import (
+    DispatchThrottle, MPILauncher, MPIRun, RunReaper, easy_backfill, serial_partition_size,
+    terminate_runs
+)
+
+
+class FakeRun:
+    def __init__(self, started_ago):
+        self.start_time = time.time() - started_ago
+        self.startup_observed = False
+
+
+class DispatchThrottleTests(unittest.TestCase):
+    def test_early_error_backs_off_once_per_window(self):
+        throttle = DispatchThrottle(maximum=64)
+        throttle.observe(FakeRun(0.1), retcode=1)
+        self.assertEqual(throttle.limit, 32)
+        throttle.observe(FakeRun(0.1), retcode=1)
+        self.assertEqual(throttle.limit, 32)
+
+    def test_recovers_after_startup_window(self):
+        throttle = DispatchThrottle(maximum=64)
+        throttle.limit = 10
+        run = FakeRun(DispatchThrottle.STARTUP_WINDOW + 1)
+        throttle.observe(run, retcode=None)
+        throttle.observe(run, retcode=None)
+        self.assertEqual(throttle.limit, 11)
+
+    def test_late_error_is_not_a_startup_failure(self):
+        throttle = DispatchThrottle(maximum=64)
+        throttle.observe(FakeRun(DispatchThrottle.STARTUP_WINDOW + 1), retcode=1)
+        self.assertEqual(throttle.limit, 64)
+
+
+class Job:
+    def __init__(self, num_nodes, wall_time_minutes):
+        self.num_nodes = num_nodes
+        self.wall_time_minutes = wall_time_minutes
+
+
+class EasyBackfillTests(unittest.TestCase):
+    def test_all_fit(self):
+        jobs = [Job(4, 10), Job(2, 10)]
+        selected, reservation = easy_backfill(jobs, 8, [], now=0)
+        self.assertEqual(selected, jobs)
+        self.assertIsNone(reservation)
+
+    def test_short_jobs_backfill_before_reservation(self):
+        '''The big job reserves the nodes freed at t=600; only jobs ending
+        by then may use the idle nodes'''
+        big, short, long = Job(8, 60), Job(2, 5), Job(2, 30)
+        running = [(600, 6)]
+        selected, reservation = easy_backfill([big, short, long], 2, running, now=0)
+        self.assertEqual(selected, [short])
+        self.assertEqual(reservation, (big, 600))
+
+    def test_extra_nodes_backfill(self):
+        '''Nodes the reserved job will not need can run long jobs'''
+        big, long1, long2 = Job(6, 60), Job(2, 30), Job(2, 30)
+        running = [(600, 6)]
+        selected, reservation = easy_backfill([big, long1, long2], 4, running, now=0)
+        # 10 nodes free at t=600; big needs 6, so 4 spare nodes
+        self.assertEqual(selected, [long1, long2])
+        self.assertEqual(reservation[1], 600)
+
+
+class RunnableTimeLimitTests(unittest.TestCase):
+    def make_launcher(self, minutes_left):
+        launcher = MPILauncher.__new__(MPILauncher)
+        launcher.minutes_left = minutes_left
+        launcher.time_margin_minutes = 1.0
+        launcher.drain_minutes = 10.0
+        launcher.drain_job_minutes = 3.0
+        launcher.draining = False
+        return launcher
+
+    def test_unlimited(self):
+        self.assertIsNone(self.make_launcher(float('inf')).runnable_time_limit())
+
+    def test_margin(self):
+        self.assertEqual(self.make_launcher(30.0).runnable_time_limit(), 29.0)
+
+    def test_drain_phase_only_short_jobs(self):
+        launcher = self.make_launcher(8.0)
+        self.assertEqual(launcher.runnable_time_limit(), 3.0)
+        self.assertTrue(launcher.draining)
+        launcher.minutes_left = 0.5
+        self.assertEqual(launcher.runnable_time_limit(), 0)
+
+
+class ProcessRun:
+    def __init__(self, args):
+        self.process = subprocess.Popen(args)
+
+
+class RunReaperTests(unittest.TestCase):
+    def test_queues_exited_runs(self):
+        reaper = RunReaper()
+        ok, bad = ProcessRun(['true']), ProcessRun(['false'])
+        ok.process.wait()
+        bad.process.wait()
+        reaper.add([ok, bad])
+        reaper.sweep()
+        finished = dict(reaper.collect())
+        self.assertEqual(finished, {ok: 0, bad: 1})
+        self.assertEqual(reaper.collect(), [])
+        self.assertFalse(reaper.runs)
+
+    def test_thread_reaps_in_background(self):
+        reaper = RunReaper()
+        reaper.INTERVAL = 0.01
+        reaper.start()
+        try:
+            run = ProcessRun(['true'])
+            reaper.add([run])
+            run.process.wait()
+            deadline = time.time() + 5
+            finished = []
+            while not finished and time.time() < deadline:
+                finished = reaper.collect()
+                time.sleep(0.01)
+            self.assertEqual(finished, [(run, 0)])
+        finally:
+            reaper.stop()
+
+
+class SerialPartitionTests(unittest.TestCase):
+    def test_no_serial_work(self):
+        self.assertEqual(serial_partition_size(64, 0, 10, minimum=2), 0)
+
+    def test_only_serial_work(self):
+        self.assertEqual(serial_partition_size(64, 10, 0, minimum=2), 10)
+        self.assertEqual(serial_partition_size(64, 100, 0, minimum=2), 64)
+
+    def test_proportional_share(self):
+        self.assertEqual(serial_partition_size(64, 100, 300, minimum=2), 16)
+
+    def test_minimum_partition(self):
+        self.assertEqual(serial_partition_size(64, 1, 1000, minimum=2), 2)
+
+
+class CheckpointNoticeTests(unittest.TestCase):
+    def test_touch_file_and_signal(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            run = MPIRun.__new__(MPIRun)
+            run.job = type('Job', (), {'working_directory': workdir, 'cute_id': 'job'})()
+            run.process = subprocess.Popen(['sleep', '30'])
+            run.notify_checkpoint(signal.SIGUSR1, 'CHECKPOINT')
+            self.assertTrue(run.notified)
+            self.assertTrue(os.path.exists(os.path.join(workdir, 'CHECKPOINT')))
+            self.assertEqual(run.process.wait(timeout=5), -signal.SIGUSR1)
+
+    def test_unstarted_run_is_skipped(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            run = MPIRun.__new__(MPIRun)
+            run.job = type('Job', (), {'working_directory': workdir, 'cute_id': 'job'})()
+            run.process = None
+            run.notify_checkpoint(signal.SIGUSR1, 'CHECKPOINT')
+            self.assertTrue(os.path.exists(os.path.join(workdir, 'CHECKPOINT')))
+
+
+class TerminateRunsTests(unittest.TestCase):
+    def test_skips_runs_that_never_started(self):
+        freed = []
+        class Run(ProcessRun):
+            def free_workers(self):
+                freed.append(self)
+        unstarted = Run.__new__(Run)
+        unstarted.process = None
+        running = Run(['sleep', '30'])
+        terminate_runs([unstarted, running], timeout=5)
+        self.assertEqual(running.process.wait(timeout=5), -signal.SIGTERM)
+        self.assertEqual(freed, [running])
+
+
+class DispatchTests(unittest.TestCase):
+    def test_failed_starts_free_workers_on_main_thread(self):
+        '''A missing mpirun fails every start at once; only the main thread
+        may hand the workers back to the allocator'''
+        freed = []
+        class Run(MPIRun):
+            def free_workers(self):
+                freed.append((self, threading.current_thread()))
+        with tempfile.TemporaryDirectory() as workdir:
+            runs = []
+            for i in range(8):
+                run = Run.__new__(Run)
+                run.job = type('Job', (), {'working_directory': workdir, 'cute_id': f'job{i}'})()
+                run.args, run.shell, run.envs = ['/nonexistent/mpirun'], False, {}
+                run.workers = []
+                run.outfile = open(os.path.join(workdir, f'job{i}.out'), 'w+b')
+                runs.append(run)
+            launcher = MPILauncher.__new__(MPILauncher)
+            launcher.dispatch_pool = ThreadPoolExecutor(max_workers=4)
+            launcher.throttle = mock.Mock()
+            launcher.dispatch(runs)
+            launcher.dispatch_pool.shutdown()
+        self.assertEqual([run for run, _ in freed], runs)
+        self.assertEqual({thread for _, thread in freed}, {threading.main_thread()})
+        self.assertEqual(launcher.throttle.failure.call_count, 8)
+        self.assertTrue(all(run.current_state == 'RUN_ERROR' for run in runs))
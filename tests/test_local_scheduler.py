@@ -0,0 +1,63 @@
+import os
+import signal
+import tempfile
+import time
+import unittest
+
+from django.conf import settings
+
+from balsam.service.schedulers.LocalScheduler import LocalScheduler
+from balsam.service.schedulers.exceptions import JobSubmitFailed
+
+
+class LocalSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        top = self.tmpdir.name
+        self.sched = LocalScheduler()
+        self.sched.state_path = os.path.join(top, 'state.json')
+        self.sched.status_cache_path = os.path.join(top, 'status.json')
+        self.sched.pool_size = 2
+        self.sched.node_names = ['local0', 'local1']
+        self._service_path = settings.SERVICE_PATH
+        settings.SERVICE_PATH = top
+
+    def tearDown(self):
+        with self.sched._locked_state() as state:
+            pids = [job['pid'] for job in state['jobs'].values() if 'pid' in job]
+        for pid in pids:
+            self.sched._signal(pid, signal.SIGKILL)
+        settings.SERVICE_PATH = self._service_path
+        self.tmpdir.cleanup()
+
+    def script(self, name, nodes, seconds):
+        path = os.path.join(self.tmpdir.name, f'{name}.sh')
+        with open(path, 'w') as fp:
+            fp.write(f'#!/bin/bash\n#BALSAM-LOCAL nodes={nodes} time=5\n'
+                     f'echo $BALSAM_LOCAL_NODELIST\nsleep {seconds}\n')
+        return path
+
+    def test_queue_until_nodes_free(self):
+        first = self.sched.submit(self.script('first', 2, 0.5))
+        second = self.sched.submit(self.script('second', 1, 0))
+        status = self.sched.status_dict()
+        self.assertEqual(status[first]['state'], 'running')
+        self.assertEqual(status[first]['wall_time_min'], 5)
+        self.assertEqual(status[second]['state'], 'queued')
+
+        deadline = time.time() + 10
+        while self.sched.status_dict() and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(self.sched.status_dict(), {})
+        with open(os.path.join(self.tmpdir.name, 'first.out')) as fp:
+            self.assertEqual(fp.read().split(), ['local0', 'local1'])
+
+    def test_oversized_request_rejected(self):
+        with self.assertRaises(JobSubmitFailed):
+            self.sched.submit(self.script('big', 3, 0))
+
+    def test_array_elements_scheduled_separately(self):
+        ids = self.sched.submit_array(self.script('array', 1, 0.5), 3)
+        self.assertEqual(len(set(ids)), 3)
+        states = [self.sched.status_dict()[id]['state'] for id in ids]
+        self.assertEqual(states, ['running', 'running', 'queued'])
@@ -0,0 +1,134 @@
+import random
+import threading
+
+from django.db import connection, transaction
+
+from tests.BalsamTestCase import BalsamTestCase
+from balsam.core import transitions
+from balsam.core.models import BalsamJob, install_triggers
+
+
+class BatchStateMessageTests(BalsamTestCase):
+    def setUp(self):
+        jobs = [BalsamJob(name=f'job{i}', workflow='batch', state='RUN_ERROR')
+                for i in range(7)]
+        BalsamJob.objects.bulk_create(jobs)
+        self.jobs = list(BalsamJob.objects.filter(workflow='batch').order_by('name'))
+        self.jobs[-1].update_state('USER_KILLED')
+
+    def test_chunked_messages_are_quoted_and_appended(self):
+        '''Each job gets its own history line across chunks; quotes, newlines
+        and SQL in messages are stored verbatim; USER_KILLED is untouched'''
+        messages = [(job.pk, f"it's \"job{i}\"\nTraceback: x'); DROP TABLE t; --")
+                    for i, job in enumerate(self.jobs)]
+        old_history = {job.pk: job.state_history for job in self.jobs}
+
+        num_updated = BalsamJob.batch_update_state_messages(messages, 'FAILED', chunk_size=3)
+        self.assertEqual(num_updated, len(self.jobs) - 1)
+
+        for job, (pk, message) in zip(self.jobs[:-1], messages):
+            job.refresh_from_db()
+            self.assertEqual(job.state, 'FAILED')
+            self.assertTrue(job.state_history.startswith(old_history[pk]))
+            self.assertTrue(job.state_history.endswith(message))
+            self.assertIn('FAILED]', job.state_history[len(old_history[pk]):])
+        killed = self.jobs[-1]
+        killed.refresh_from_db()
+        self.assertEqual(killed.state, 'USER_KILLED')
+        self.assertEqual(killed.state_history, old_history[killed.pk])
+
+    def test_unknown_state_rejected(self):
+        with self.assertRaises(Exception):
+            BalsamJob.batch_update_state_messages([(self.jobs[0].pk, '')], 'BOGUS')
+
+
+class StateCountTests(BalsamTestCase):
+    STATES = ['CREATED', 'READY', 'PREPROCESSED', 'RUNNING', 'RUN_DONE', 'JOB_FINISHED']
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        install_triggers()
+
+    def expected(self, workflow=None):
+        jobs = BalsamJob.objects.all()
+        if workflow:
+            jobs = jobs.filter(workflow__contains=workflow)
+        counts = {}
+        for state in jobs.values_list('state', flat=True):
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def test_concurrent_writers(self):
+        '''Threads hammering the same (workflow, state) counters with row,
+        bulk and delete statements neither deadlock nor skew the counts'''
+        num_threads, jobs_per_thread = 6, 20
+        errors = []
+
+        def writer(index):
+            rng = random.Random(index)
+            try:
+                jobs = BalsamJob.objects.bulk_create(
+                    BalsamJob(name=f'w{index}-{i}', workflow='hot', state='CREATED')
+                    for i in range(jobs_per_thread)
+                )
+                pks = [job.pk for job in jobs]
+                for _ in range(30):
+                    with transaction.atomic():
+                        for state in rng.sample(self.STATES, 3):
+                            chosen = rng.sample(pks, 5)
+                            BalsamJob.objects.filter(pk__in=chosen).update(state=state)
+                        job = BalsamJob.objects.get(pk=rng.choice(pks))
+                        job.state = rng.choice(self.STATES)
+                        job.save(update_fields=['state'])
+                BalsamJob.objects.filter(pk__in=pks[:5]).delete()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(num_threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+        source = BalsamJob.source
+        self.assertEqual(sum(self.expected().values()), num_threads * (jobs_per_thread-5))
+        self.assertEqual(source.state_counts(), self.expected())
+        source._compacted = None
+        self.assertEqual(source.state_counts(), self.expected())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM balsam_state_counts')
+            self.assertLessEqual(cursor.fetchone()[0], len(self.STATES))
+
+    def test_bulk_paths_and_truncate(self):
+        BalsamJob.objects.bulk_create(
+            BalsamJob(name=f'job{i}', workflow='bulk', state='CREATED') for i in range(10)
+        )
+        BalsamJob.objects.filter(workflow='bulk', name__in=['job1', 'job2']).update(state='READY')
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {BalsamJob._meta.db_table} SET workflow = 'other' "
+                           "WHERE name = 'job3'")
+        self.assertEqual(BalsamJob.source.state_counts(), self.expected())
+        self.assertEqual(BalsamJob.objects.filter(workflow='bulk').count(), 9)
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {BalsamJob._meta.db_table} CASCADE')
+        self.assertEqual(BalsamJob.source.state_counts(), {})
+
+
+class SelectRangeTests(BalsamTestCase):
+    def test_leftover_quota_goes_to_classes_with_jobs(self):
+        '''With only runnable-soon jobs waiting, a fetch still fills the limit'''
+        BalsamJob.objects.bulk_create(
+            BalsamJob(name=f'job{i}', state='READY') for i in range(30)
+        )
+        BalsamJob.objects.bulk_create(
+            BalsamJob(name=f'done{i}', state='RUN_DONE') for i in range(2)
+        )
+        selected = transitions.select_range(1, 0, limit=20)
+        self.assertEqual(len(selected), 20)
+        self.assertEqual(len(set(selected)), 20)
+        states = BalsamJob.objects.filter(pk__in=selected).values_list('state', flat=True)
+        self.assertEqual(list(states).count('RUN_DONE'), 2)
@@ -0,0 +1,108 @@
+import unittest
+
+from balsam.launcher.worker import NodeAllocator, Worker
+
+
+def make_workers(node_ids):
+    return [Worker(nid, host_type='THETA', num_nodes=1) for nid in node_ids]
+
+
+class NodeAllocatorTests(unittest.TestCase):
+    def setUp(self):
+        # Two contiguous nid ranges, like COBALT_PARTNAME=1001-1008,1020-1023
+        self.workers = make_workers(list(range(1001, 1009)) + list(range(1020, 1024)))
+        self.alloc = NodeAllocator(self.workers)
+
+    def test_initial_runs(self):
+        self.assertEqual(self.alloc.free_runs(), [(1001, 1008), (1020, 1023)])
+        self.assertEqual(self.alloc.num_free, 12)
+
+    def test_best_fit_prefers_smallest_block(self):
+        '''A 4-node job fills the 4-node range rather than splitting the 8'''
+        got = self.alloc.allocate(4)
+        self.assertEqual([w.id for w in got], [1020, 1021, 1022, 1023])
+        self.assertTrue(all(not w.idle for w in got))
+        self.assertEqual(self.alloc.free_runs(), [(1001, 1008)])
+
+    def test_release_merges_neighbors(self):
+        got = self.alloc.allocate(3)
+        self.assertEqual([w.id for w in got], [1020, 1021, 1022])
+        for w in got:
+            w.idle = True
+        self.assertEqual(self.alloc.free_runs(), [(1001, 1008), (1020, 1023)])
+        self.assertEqual(self.alloc.num_free, 12)
+
+    def test_fragmented_allocation(self):
+        '''Requests larger than any free block span the largest blocks'''
+        got = self.alloc.allocate(10)
+        self.assertEqual(len(got), 10)
+        self.assertEqual(self.alloc.num_free, 2)
+        self.assertEqual(self.alloc.allocate(3), [])
+
+    def test_single_worker_flags(self):
+        self.workers[3].idle = False
+        self.assertEqual(self.alloc.free_runs(), [(1001, 1003), (1005, 1008), (1020, 1023)])
+        self.workers[3].idle = True
+        self.assertEqual(self.alloc.free_runs(), [(1001, 1008), (1020, 1023)])
+
+    def test_hostnames_use_positions(self):
+        workers = [Worker(f'node{i}', host_type='SLURM', num_nodes=1) for i in range(4)]
+        alloc = NodeAllocator(workers)
+        self.assertEqual(alloc.free_runs(), [(0, 3)])
+        self.assertEqual([w.id for w in alloc.allocate(2)], ['node0', 'node1'])
+
+
+    def test_multi_node_workers_count_nodes(self):
+        '''BG/Q-style sub-blocks: sizes and the idle count are in nodes'''
+        workers = [Worker(i, host_type='BGQ', num_nodes=n)
+                   for i, n in enumerate([128, 128, 512, 64])]
+        alloc = NodeAllocator(workers)
+        self.assertEqual(alloc.num_free, 832)
+        got = alloc.allocate(256)
+        self.assertEqual([w.id for w in got], [0, 1])
+        self.assertEqual(alloc.num_free, 576)
+        self.assertEqual(alloc.allocate(600), [])
+        got = alloc.allocate(100)
+        self.assertEqual([w.id for w in got], [2])
+        self.assertEqual(alloc.num_free, 64)
+        workers[0].idle = True
+        self.assertEqual(alloc.num_free, 192)
+        self.assertEqual(len(alloc.allocate(192)), 2)
+        self.assertEqual(alloc.num_free, 0)
+
+
+class SubNodePackingTests(unittest.TestCase):
+    def setUp(self):
+        self.workers = make_workers([1, 2])
+        for w in self.workers:
+            w.cpus = list(range(8))
+            w.free_cpus = list(range(8))
+        self.alloc = NodeAllocator(self.workers)
+
+    def test_node_idle_again_once_all_cpus_released(self):
+        node = self.workers[0]
+        first = node.take_cpus(4)
+        second = node.take_cpus(4)
+        self.assertEqual((first, second), ([0, 1, 2, 3], [4, 5, 6, 7]))
+        self.assertEqual(node.take_cpus(1), [])
+        self.assertEqual(self.alloc.num_free, 1)
+        self.assertTrue(node.is_shared)
+        node.release_cpus(first)
+        self.assertFalse(node.idle)
+        node.release_cpus(second)
+        self.assertTrue(node.idle)
+        self.assertEqual(self.alloc.num_free, 2)
+
+    def test_cpu_binding_flags(self):
+        from balsam.launcher.mpi_commands import SlurmMPICommand, ThetaMPICommand
+        slurm = SlurmMPICommand().cpu_bind([4, 5, 6, 7], 2, 1, 1)
+        self.assertEqual(slurm, "--overlap --cpu-bind=mask_cpu:0x30,0xc0")
+        theta = ThetaMPICommand().cpu_bind([4, 5], 2, 1, 1)
+        self.assertEqual(theta.split(), ['-cc', '4,5', '-d', '1', '-j', '1'])
+
+    def test_more_ranks_than_cpus_cycle(self):
+        from balsam.launcher.mpi_commands import SlurmMPICommand, rank_cpu_groups
+        self.assertEqual(rank_cpu_groups([4, 5], 5), [[4], [5], [4], [5], [4]])
+        slurm = SlurmMPICommand().cpu_bind([4, 5], 3, 1, 1)
+        self.assertEqual(slurm, "--overlap --cpu-bind=mask_cpu:0x10,0x20,0x10")
+        self.assertNotIn('0x0', slurm)
@@ -0,0 +1,129 @@
+import threading
+import unittest
+import uuid
+from contextlib import redirect_stderr
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import zmq
+
+from balsam.launcher import partitions
+from balsam.launcher.partitions import JobSpec, PartitionAgent, partition_slices
+
+
+class PartitionSliceTests(unittest.TestCase):
+    def test_even_split(self):
+        self.assertEqual(partition_slices(8, 2), [(0, 4), (4, 4)])
+
+    def test_remainder_goes_to_first_agents(self):
+        self.assertEqual(partition_slices(10, 3, offset=5), [(5, 4), (9, 3), (12, 3)])
+
+
+class JobSpecTests(unittest.TestCase):
+    def test_attributes(self):
+        job = JobSpec({'pk': 'abc', 'num_nodes': 2, 'envs': {'A': '1'}})
+        self.assertEqual(job.num_nodes, 2)
+        self.assertEqual(job.get_envs(), {'A': '1'})
+
+
+class DeadSupervisorTests(unittest.TestCase):
+    def setUp(self):
+        self.context = zmq.Context()
+        self.supervisor = self.context.socket(zmq.REP)
+        port = self.supervisor.bind_to_random_port('tcp://127.0.0.1')
+
+        agent = PartitionAgent.__new__(PartitionAgent)
+        agent.name = 'agent0'
+        agent.REPLY_TIMEOUT_MS = 50
+        agent.REPLY_RETRIES = 2
+        agent.worker_group = mock.Mock(num_idle=1, num_shared_cores=0)
+        agent.reaper = mock.Mock(**{'collect.return_value': []})
+        agent.dispatch_pool = mock.Mock()
+        agent.report = agent.empty_report()
+        agent.context = zmq.Context()
+        agent.socket = agent.context.socket(zmq.REQ)
+        agent.socket.setsockopt(zmq.SNDTIMEO, agent.REPLY_TIMEOUT_MS)
+        agent.socket.connect(f'tcp://127.0.0.1:{port}')
+        agent.supervisor_lost = False
+        self.run = mock.Mock(outfile=mock.Mock())
+        agent.runs = {'pk1': self.run}
+        self.agent = agent
+
+    def tearDown(self):
+        self.supervisor.close(linger=0)
+        self.context.term()
+
+    def test_agent_terminates_runs_when_supervisor_is_silent(self):
+        '''A supervisor that never replies makes the agent kill its runs and
+        return instead of blocking in recv forever'''
+        with mock.patch.object(partitions, 'terminate_runs') as terminate:
+            self.agent.run()
+        self.assertTrue(self.agent.supervisor_lost)
+        terminate.assert_called_once_with([self.run])
+        self.run.outfile.close.assert_called_once_with()
+        self.assertEqual(self.agent.runs, {})
+        self.assertEqual(self.supervisor.recv_json()['agent'], 'agent0')
+        self.assertEqual(self.supervisor.poll(50), 0)
+
+
+class AgentAssignTests(unittest.TestCase):
+    def test_failed_starts_free_workers_on_main_thread(self):
+        freed = []
+        class FailingRun:
+            def __init__(self, job, workers, cpus=None):
+                self.job, self.process, self.err_msg = job, None, 'no mpirun'
+            def start(self):
+                return False
+            def free_workers(self):
+                freed.append(threading.current_thread())
+
+        agent = PartitionAgent.__new__(PartitionAgent)
+        agent.worker_group = mock.Mock(cores_per_node=64, **{'request.return_value': ['w']})
+        agent.dispatch_pool = ThreadPoolExecutor(max_workers=4)
+        agent.reaper = mock.Mock()
+        agent.runs = {}
+        agent.report = agent.empty_report()
+        specs = [{'pk': f'pk{i}', 'num_nodes': 1, 'node_packing_count': 1,
+                  'required_num_cores': 1} for i in range(6)]
+        with mock.patch.object(partitions, 'MPIRun', FailingRun):
+            agent.assign(specs)
+        agent.dispatch_pool.shutdown()
+        self.assertEqual(freed, [threading.main_thread()] * 6)
+        self.assertEqual([pk for pk, _ in agent.report['error']], [s['pk'] for s in specs])
+        self.assertEqual(agent.runs, {})
+
+
+class KilledJobTests(unittest.TestCase):
+    def test_killed_jobs_released_once_agent_confirms(self):
+        pk = uuid.uuid4()
+        supervisor = partitions.Supervisor.__new__(partitions.Supervisor)
+        supervisor.assigned = {pk.hex: 'agent0'}
+        supervisor.killed = {}
+        supervisor.kill_feed = mock.Mock(**{'poll.return_value': {str(pk)}})
+        supervisor.jobsource = mock.Mock()
+        supervisor.RUN_MESSAGE = ''
+        supervisor.poll_killed()
+        self.assertEqual(supervisor.killed, {'agent0': [pk.hex]})
+
+        agent = PartitionAgent.__new__(PartitionAgent)
+        agent.runs = {}
+        agent.report = agent.empty_report()
+        agent.kill(supervisor.killed.pop('agent0'))
+        with mock.patch.object(partitions, 'BalsamJob'):
+            supervisor.record_updates(dict(agent.report, agent='agent0'))
+        supervisor.jobsource.release.assert_called_once_with([pk])
+
+
+class PartitionArgsTests(unittest.TestCase):
+    base = ['--consume-all', '--job-mode', 'mpi', '--partitions', '2']
+
+    def test_unsupported_flags_rejected(self):
+        from balsam.launcher.launcher import get_args
+        for extra in (['--backfill'], ['--drain-minutes', '5'],
+                      ['--checkpoint-minutes', '5'], ['--checkpoint-file', 'CKPT']):
+            with self.assertRaises(SystemExit), redirect_stderr(StringIO()) as err:
+                get_args(self.base + extra)
+            self.assertIn(extra[0], err.getvalue())
+        self.assertEqual(get_args(self.base).partitions, 2)
+        self.assertTrue(get_args(self.base[:-1] + ['1', '--backfill']).backfill)
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+
+from balsam.service.autoscale import summarize
+from balsam.service.planner import QueueWaitHistory, SplitPlanner, node_bucket
+
+
+class QueueWaitHistoryTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'history.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_buckets(self):
+        self.assertEqual([node_bucket(n) for n in (1, 2, 3, 4, 128)], [1, 2, 2, 3, 8])
+
+    def test_samples_from_start_transitions(self):
+        history = QueueWaitHistory(self.path)
+        self.assertEqual(history.predict('debug', 4), history.DEFAULT_WAIT_MINUTES)
+        history.record_submit(1, 'debug', 4, submit_time=0)
+        history.record_submit(2, 'debug', 5, submit_time=0)
+        history.record_submit(3, 'debug', 5, submit_time=0)
+        history.observe({1: 'queued', 2: 'running', 3: 'queued'}, now=600)
+        history.observe({1: 'RUNNING'}, now=1200)
+
+        reloaded = QueueWaitHistory(self.path)
+        self.assertEqual(reloaded.predict('debug', 4), 15.0)
+        self.assertEqual(reloaded.predict('debug', 64), 15.0)
+        self.assertEqual(reloaded.predict('default', 4), history.DEFAULT_WAIT_MINUTES)
+        self.assertEqual(reloaded.pending, {})
+
+
+class SplitPlannerTests(unittest.TestCase):
+    policy = {
+        'debug': {'max_queued': 1, (1, 8): (5, 60)},
+        'default': {'max_queued': 5, (128, 4096): (30, 720)},
+    }
+
+    def planner(self, waits):
+        planner = SplitPlanner(self.policy, pad_minutes=0)
+        planner.wait_minutes = lambda qname, nodes: waits[qname]
+        return planner
+
+    def test_small_burst_stays_in_debug(self):
+        backlog = summarize([(1, 10, 1)] * 16)
+        [launch] = self.planner({'debug': 5, 'default': 120}).plan(
+            backlog, 0, {'debug': 1, 'default': 5})
+        self.assertEqual((launch.queue, launch.nodes, launch.wall_minutes), ('debug', 8, 20))
+
+    def test_bulk_split_across_queues(self):
+        backlog = summarize([(1, 30, 1)] * 1000)
+        launches = self.planner({'debug': 5, 'default': 60}).plan(
+            backlog, 0, {'debug': 1, 'default': 5})
+        self.assertEqual([l.queue for l in launches], ['debug', 'default'])
+        delivered = sum(l.count * l.nodes * l.wall_minutes for l in launches)
+        self.assertGreaterEqual(delivered, backlog.node_minutes)
+        self.assertLessEqual(max(l.completion_minutes for l in launches), 60 + 720)
+
+    def test_skips_queues_too_small_for_widest_job(self):
+        '''debug starts sooner but cannot hold the 16-node job'''
+        backlog = summarize([(16, 30, 1)] + [(1, 30, 1)] * 8)
+        planner = self.planner({'debug': 5, 'default': 60})
+        launches = planner.plan(backlog, 0, {'debug': 1, 'default': 5})
+        self.assertEqual([l.queue for l in launches], ['default'])
+        self.assertGreaterEqual(launches[0].nodes, 16)
+        self.assertEqual(planner.plan(backlog, 0, {'debug': 1}), [])
+
+    def test_skips_queues_too_short_for_longest_job(self):
+        backlog = summarize([(2, 120, 1)] * 4)
+        launches = self.planner({'debug': 5, 'default': 60}).plan(
+            backlog, 0, {'debug': 1, 'default': 5})
+        self.assertEqual([l.queue for l in launches], ['default'])
+
+    def test_rules_must_fit_longest_job_plus_pad(self):
+        '''A queue whose limit only covers the pad leaves no work time'''
+        policy = {'tiny': {'max_queued': 1, (1, 8): (1, 5)},
+                  'default': {'max_queued': 5, (1, 64): (5, 60)}}
+        backlog = summarize([(1, 5, 1)] * 4)
+        planner = SplitPlanner(policy, pad_minutes=5)
+        planner.wait_minutes = lambda qname, nodes: 0 if qname == 'tiny' else 30
+        launches = planner.plan(backlog, 0, {'tiny': 1, 'default': 5})
+        self.assertEqual([l.queue for l in launches], ['default'])
+        self.assertEqual(planner.plan(backlog, 0, {'tiny': 1}), [])
+
+    def test_horizon_uses_allocation_node_bucket(self):
+        '''Wide launches wait longer than the rule minimum: the horizon must
+        use the same wait as allocate or the search is skipped'''
+        backlog = summarize([(1, 600, 1)] * 256)
+        planner = SplitPlanner(self.policy, pad_minutes=0)
+        planner.wait_minutes = lambda qname, nodes: 10 + nodes
+        [launch] = planner.plan(backlog, 0, {'debug': 1, 'default': 5})
+        self.assertEqual((launch.queue, launch.nodes), ('default', 256))
+        self.assertGreaterEqual(launch.wall_minutes, 600)
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from balsam import django_config
+from balsam.launcher.prestage import build_zipapp
+
+
+class ZipappBootstrapTests(unittest.TestCase):
+    def test_first_run_copies_defaults_from_zipapp(self):
+        '''A fresh BALSAM_HOME is populated from the data files in the archive'''
+        with tempfile.TemporaryDirectory() as tmp:
+            pyz = os.path.join(tmp, 'balsam.pyz')
+            self.assertEqual(build_zipapp(pyz, ['balsam']), ['balsam'])
+            home = os.path.join(tmp, 'home')
+            os.makedirs(home)
+            env = dict(os.environ, HOME=home, PYTHONPATH=pyz,
+                       BALSAM_SPHINX_DOC_BUILD_ONLY='1')
+            code = 'import balsam.django_config.settings as s; print(s.__loader__.archive)'
+            proc = subprocess.run([sys.executable, '-c', code], env=env, cwd=tmp,
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                  encoding='utf-8')
+            self.assertEqual(proc.returncode, 0, proc.stdout)
+            self.assertIn(pyz, proc.stdout)
+            balsam_home = os.path.join(home, '.balsam')
+            self.assertTrue(os.path.isfile(os.path.join(balsam_home, 'settings.json')))
+            self.assertTrue(os.path.isfile(os.path.join(balsam_home, 'theta_policy.ini')))
+            templates = os.listdir(os.path.join(balsam_home, 'job-templates'))
+            defaults = os.path.join(os.path.dirname(django_config.__file__), 'job-templates')
+            self.assertEqual(sorted(templates), sorted(os.listdir(defaults)))
@@ -0,0 +1,214 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from django.conf import settings
+
+from balsam.service.schedulers.JobEnvironment import JobEnvironment
+from balsam.core.models import QueuedLaunch
+from balsam.service.schedulers.Scheduler import Scheduler
+from balsam.service.schedulers.CobaltScheduler import CobaltScheduler
+from balsam.service.schedulers.Scheduler import parse_duration
+from balsam.service.schedulers.SlurmScheduler import SlurmScheduler, count_array_tasks
+
+
+class CountingScheduler(Scheduler):
+    SCHEDULER_VARIABLES = {
+        'current_scheduler_id': 'TEST_JOBID',
+        'end_time': 'TEST_ENDTIME',
+    }
+
+    def __init__(self, cache_path):
+        super().__init__()
+        self.status_cache_path = cache_path
+        self.num_polls = 0
+
+    def _make_status_cmd(self):
+        self.num_polls += 1
+        return 'echo 123'
+
+    def _parse_status_output(self, raw_output, balsam_only=False):
+        id = int(raw_output)
+        return {id: {'id': id, 'state': 'running', 'time_remaining_sec': 600}}
+
+
+class StatusCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'status.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_processes_share_one_poll(self):
+        first, second = CountingScheduler(self.path), CountingScheduler(self.path)
+        self.assertEqual(first.status_dict()[123]['state'], 'running')
+        stat = second.get_status(123)
+        self.assertLessEqual(stat['time_remaining_sec'], 600)
+        self.assertEqual((first.num_polls, second.num_polls), (1, 0))
+
+    def test_expired_or_invalidated_cache_polls_again(self):
+        sched = CountingScheduler(self.path)
+        sched.status_dict()
+        sched.status_dict(max_age=0)
+        self.assertEqual(sched.num_polls, 2)
+        sched.invalidate_status()
+        sched.status_dict()
+        self.assertEqual(sched.num_polls, 3)
+
+    def test_cached_countdown_fields_age_together(self):
+        sched = CountingScheduler(self.path)
+        stat = {'id': 5, 'time_remaining': '01:00:00', 'time_remaining_sec': 3600,
+                'time_remaining_min': 60, 'wall_time': '02:00:00',
+                'wall_time_sec': 7200, 'wall_time_min': 120}
+        with mock.patch('time.time', return_value=1000.0):
+            sched._store_status({5: stat})
+        with mock.patch('time.time', return_value=1125.0):
+            aged = sched.status_dict(max_age=300)[5]
+        self.assertEqual((aged['time_remaining'], aged['time_remaining_sec'],
+                          aged['time_remaining_min']), ('00:57:55', 3475, 57))
+        self.assertEqual((aged['wall_time_sec'], aged['wall_time_min']), (7200, 120))
+        self.assertEqual(sched.num_polls, 0)
+
+    def test_cache_file_keyed_by_host_and_scheduler(self):
+        with mock.patch('socket.gethostname', return_value='login1'):
+            slurm, cobalt = SlurmScheduler(), CobaltScheduler()
+        self.assertNotEqual(slurm.status_cache_path, cobalt.status_cache_path)
+        self.assertEqual(os.path.basename(slurm.status_cache_path),
+                         'scheduler_status.login1.SlurmScheduler.json')
+
+
+class JobEnvironmentTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.sched = CountingScheduler(os.path.join(self.tmpdir.name, 'status.json'))
+        self.deadline_path = os.path.join(self.tmpdir.name, 'deadlines', '123')
+        environ = {k: v for k, v in os.environ.items()
+                   if k not in ('TEST_JOBID', 'TEST_ENDTIME', 'BALSAM_JOB_DEADLINE')}
+        self.env = mock.patch.dict(os.environ, environ, clear=True)
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmpdir.cleanup()
+
+    def job_env(self):
+        env = JobEnvironment(self.sched)
+        env.deadline_path = lambda: self.deadline_path
+        return env
+
+    def test_no_query_at_construction_or_outside_a_job(self):
+        env = self.job_env()
+        self.assertEqual(env.remaining_time_seconds(), float('inf'))
+        self.assertEqual(self.sched.num_polls, 0)
+
+    def test_end_time_variable_avoids_query(self):
+        os.environ.update(TEST_JOBID='123', TEST_ENDTIME=str(time.time() + 300))
+        remaining = self.job_env().remaining_time_seconds()
+        self.assertTrue(290 < remaining <= 300)
+        self.assertEqual(self.sched.num_polls, 0)
+
+    def test_one_query_per_allocation(self):
+        os.environ['TEST_JOBID'] = '123'
+        first = self.job_env()
+        self.assertTrue(590 < first.remaining_time_seconds() <= 600)
+        first.remaining_time_seconds()
+        self.sched.invalidate_status()
+        second = self.job_env()
+        self.assertTrue(590 < second.remaining_time_seconds() <= 600)
+        self.assertEqual(self.sched.num_polls, 1)
+
+    def test_deadline_variable_ignored_outside_a_job(self):
+        os.environ['BALSAM_JOB_DEADLINE'] = str(time.time() + 300)
+        self.assertEqual(self.job_env().deadline(), float('inf'))
+
+    def test_deadline_file_keyed_by_host_and_scheduler(self):
+        os.environ['TEST_JOBID'] = '123'
+        with mock.patch('balsam.service.schedulers.JobEnvironment.gethostname',
+                        return_value='login1'):
+            env = JobEnvironment(self.sched)
+        self.assertEqual(os.path.basename(env.deadline_path()),
+                         'login1.CountingScheduler.123')
+
+    def test_exported_deadline_is_inherited(self):
+        os.environ['TEST_JOBID'] = '123'
+        deadline = self.job_env().export_deadline()
+        os.remove(self.deadline_path)
+        self.sched.invalidate_status()
+        self.assertEqual(self.job_env().deadline(), deadline)
+        self.assertEqual(self.sched.num_polls, 1)
+
+
+class JobArrayTests(unittest.TestCase):
+    def test_count_array_tasks(self):
+        self.assertEqual(count_array_tasks('7'), 1)
+        self.assertEqual(count_array_tasks('0-3'), 4)
+        self.assertEqual(count_array_tasks('0-7:2,9%4'), 5)
+
+    def test_started_elements_take_over_array_rows(self):
+        rows = [QueuedLaunch(scheduler_id=50) for i in range(3)]
+        rows.append(QueuedLaunch(scheduler_id=10))
+        stats = {
+            50: {'state': 'PENDING', 'array_id': 50, 'array_count': 1},
+            51: {'state': 'RUNNING', 'array_id': 50, 'array_count': 1},
+            52: {'state': 'RUNNING', 'array_id': 50, 'array_count': 1},
+            60: {'state': 'PENDING'},
+        }
+        matched, new_jobs, leftover = QueuedLaunch.match_scheduler_rows(rows, stats)
+        self.assertEqual(sorted(job_id for row, job_id, job in matched), [50, 51, 52])
+        self.assertEqual(len({id(row) for row, job_id, job in matched}), 3)
+        self.assertEqual([job_id for job_id, job in new_jobs], [60])
+        self.assertEqual([row.scheduler_id for row in leftover], [10])
+
+    def test_pending_array_line_keeps_all_rows(self):
+        rows = [QueuedLaunch(scheduler_id=50) for i in range(4)]
+        stats = {50: {'state': 'PENDING', 'array_id': 50, 'array_count': 4}}
+        matched, new_jobs, leftover = QueuedLaunch.match_scheduler_rows(rows, stats)
+        self.assertEqual((len(matched), new_jobs, leftover), (4, [], []))
+
+
+class StatusParsingTests(unittest.TestCase):
+    def setUp(self):
+        self.service_path = settings.SERVICE_PATH
+        self.script = os.path.join(self.service_path, 'qlaunch7.sh')
+
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration('1-02:03:04'), 93784)
+        self.assertEqual(parse_duration('48:00:00'), 172800)
+        self.assertEqual(parse_duration('5:30'), 330)
+        self.assertIsNone(parse_duration('UNLIMITED'))
+        self.assertIsNone(parse_duration('N/A'))
+
+    def test_slurm_delimited_output(self):
+        output = '\n'.join([
+            f'101|1-00:00:00|1-00:00:00|PENDING|debug|4|proj|101|N/A|{self.script}',
+            '102|9:30|10:00|RUNNING|debug|1|proj|102|N/A|/home/me/my job.sh --flag',
+            f'200|30:00|30:00|PENDING|bdw|2|proj|200|1-3|{self.script}',
+            'garbage line',
+        ])
+        sched = SlurmScheduler()
+        status = sched._parse_status_output(output)
+        self.assertEqual(sorted(status), [101, 102, 200])
+        self.assertEqual(status[101]['wall_time_min'], 1440)
+        self.assertEqual(status[102]['time_remaining_sec'], 570)
+        self.assertEqual(status[102]['command'], '/home/me/my job.sh --flag')
+        self.assertNotIn('array_id', status[101])
+        self.assertEqual((status[200]['array_id'], status[200]['array_count']), (200, 3))
+        owned = sched._parse_status_output(output, balsam_only=True)
+        self.assertEqual(sorted(owned), [101, 200])
+
+    def test_cobalt_command_with_spaces(self):
+        output = '\n'.join([
+            'JobID  TimeRemaining  WallTime  State   Queue  Nodes  Project  Command',
+            '=======================================================================',
+            f'3001   00:50:00       01:00:00  running  default  128  proj  {self.script}',
+            '3002   N/A            48:00:00  queued   default  8    proj  /home/me/run a.sh',
+        ])
+        status = CobaltScheduler()._parse_status_output(output)
+        self.assertEqual(sorted(status), [3001, 3002])
+        self.assertEqual(status[3001]['time_remaining_min'], 50)
+        self.assertNotIn('time_remaining_sec', status[3002])
+        self.assertEqual(status[3002]['wall_time_sec'], 172800)
+        self.assertEqual(status[3002]['command'], '/home/me/run a.sh')
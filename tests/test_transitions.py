@@ -0,0 +1,262 @@
+import os
+import tempfile
+import sys
+import threading
+import unittest
+from unittest import mock
+import uuid
+
+from balsam.core import transfer, transitions
+
+
+class FakeParent:
+    def __init__(self, working_directory):
+        self.pk = uuid.uuid4()
+        self.working_directory = working_directory
+
+
+def touch(path):
+    with open(path, 'w') as fp:
+        fp.write('\n')
+
+
+class StageInTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.top = self.tmp.name
+        self.parents = []
+        for i in range(3):
+            workdir = os.path.join(self.top, f'parent{i}')
+            os.makedirs(workdir)
+            touch(os.path.join(workdir, 'out.dat'))
+            touch(os.path.join(workdir, f'log{i}.txt'))
+            touch(os.path.join(workdir, '.hidden'))
+            self.parents.append(FakeParent(workdir))
+        self.work_dir = os.path.join(self.top, 'child')
+        os.makedirs(self.work_dir)
+        transitions._listing_cache.clear()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_match_parent_files(self):
+        '''Patterns are matched against each parent listing, like glob'''
+        matches = transitions.match_parent_files(self.parents, ['*.dat', 'log*'])
+        self.assertEqual(len(matches), 6)
+        names = sorted(os.path.basename(path) for _, path in matches)
+        self.assertEqual(names, ['log0.txt', 'log1.txt', 'log2.txt'] + ['out.dat']*3)
+
+        hidden = transitions.match_parent_files(self.parents, ['*'])
+        self.assertNotIn('.hidden', [os.path.basename(p) for _, p in hidden])
+
+    def test_overlapping_patterns_match_once(self):
+        matches = transitions.match_parent_files(self.parents[:1], ['*', '*.dat'])
+        self.assertEqual(len(matches), 2)
+
+    def test_rerun_parent_listing_is_rescanned(self):
+        '''A cached listing is dropped once the parent directory changes'''
+        workdir = self.parents[0].working_directory
+        self.assertNotIn('new.dat', transitions.list_dir(workdir))
+        touch(os.path.join(workdir, 'new.dat'))
+        stat = os.stat(workdir)
+        os.utime(workdir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertIn('new.dat', transitions.list_dir(workdir))
+
+    def test_plan_symlinks_resolves_collisions(self):
+        '''Repeated basenames get a parent-id suffix'''
+        matches = transitions.match_parent_files(self.parents[:2], ['out.dat'])
+        links = transitions.plan_symlinks(matches, self.work_dir)
+        dst_names = [os.path.basename(dst) for _, dst in links]
+        self.assertEqual(dst_names[0], 'out.dat')
+        self.assertEqual(dst_names[1], f'out.dat_{str(self.parents[1].pk)[:8]}')
+
+        for src, dst in links:
+            transitions._symlink(src, dst)
+        self.assertEqual(len(os.listdir(self.work_dir)), 2)
+
+
+class StageOutTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = os.path.join(self.tmp.name, 'job')
+        self.dest = os.path.join(self.tmp.name, 'dest')
+        os.makedirs(self.work_dir)
+        os.makedirs(self.dest)
+        self.paths = []
+        for name in ['a.out', 'b.out']:
+            path = os.path.join(self.work_dir, name)
+            with open(path, 'w') as fp:
+                fp.write('x'*100)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_manifest_to_local_dest(self):
+        '''Matched paths are handed to the local handler without staging'''
+        num_bytes = transfer.stage_out_manifest(self.paths, self.dest + '/',
+                                                staging_top=self.work_dir)
+        self.assertEqual(num_bytes, 200)
+        self.assertEqual(sorted(os.listdir(self.dest)), ['a.out', 'b.out'])
+        self.assertEqual(sorted(os.listdir(self.work_dir)), ['a.out', 'b.out'])
+
+    def test_staged_duplicates_and_collisions_keep_sources(self):
+        '''A path matched twice is staged once; basename collisions fail
+        before anything is written'''
+        staged = []
+        class StagingHandler:
+            def pre_stage_hook(self):
+                pass
+            def stage_out(self, source_directory, destination_url):
+                staged.extend(sorted(os.listdir(source_directory)))
+        with mock.patch.object(transfer, 'get_handler', lambda url: StagingHandler()):
+            transfer.stage_out_manifest(self.paths + self.paths[:1], 'scp://host/dest',
+                                        staging_top=self.work_dir)
+            self.assertEqual(staged, ['a.out', 'b.out'])
+
+            other = os.path.join(self.work_dir, 'sub')
+            os.makedirs(other)
+            with open(os.path.join(other, 'a.out'), 'w') as fp:
+                fp.write('y')
+            with self.assertRaises(ValueError):
+                transfer.stage_out_manifest([self.paths[0], os.path.join(other, 'a.out')],
+                                            'scp://host/dest', staging_top=self.work_dir)
+        for path in self.paths:
+            self.assertEqual(open(path).read(), 'x'*100)
+
+    def test_link_or_copy_never_writes_existing_dst(self):
+        dst = os.path.join(self.dest, 'a.out')
+        os.link(self.paths[0], dst)
+        with self.assertRaises(FileExistsError):
+            transfer.link_or_copy(self.paths[1], dst)
+        self.assertEqual(open(self.paths[0]).read(), 'x'*100)
+
+    def test_link_or_copy_shares_data(self):
+        dst = os.path.join(self.dest, 'a.out')
+        transfer.link_or_copy(self.paths[0], dst)
+        self.assertEqual(open(dst).read(), 'x'*100)
+        self.assertEqual(os.stat(dst).st_ino, os.stat(self.paths[0]).st_ino)
+
+
+def hook_ok(job):
+    print('hook cwd', os.getcwd(), os.environ['BALSAM_JOB_ID'])
+
+
+def hook_fails(job):
+    raise RuntimeError('postprocess went wrong')
+
+
+def hook_exits(job):
+    sys.exit(int(os.environ['HOOK_EXIT']) if os.environ['HOOK_EXIT'] else None)
+
+
+class FakeJob:
+    cute_id = '[fake]'
+
+    def __init__(self, working_directory):
+        self.working_directory = working_directory
+
+
+class HookTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.job = FakeJob(self.tmp.name)
+        self.out = os.path.join(self.tmp.name, 'postprocess.log')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_is_python_hook(self):
+        self.assertTrue(transitions.is_python_hook('tests.test_transitions:hook_ok'))
+        self.assertFalse(transitions.is_python_hook('python /path/to/post.py'))
+        self.assertFalse(transitions.is_python_hook('/path/to/post.py'))
+
+    def test_hook_runs_in_workdir_with_envs(self):
+        '''Hook output is captured and environment is restored afterwards'''
+        envs = {'BALSAM_JOB_ID': 'abc123'}
+        ret = transitions.run_hook('tests.test_transitions:hook_ok', self.job,
+                                   self.out, envs, timeout=10)
+        self.assertEqual(ret, 0)
+        output = open(self.out).read()
+        self.assertIn(os.path.realpath(self.tmp.name), output)
+        self.assertIn('abc123', output)
+        self.assertNotEqual(os.environ.get('BALSAM_JOB_ID'), 'abc123')
+
+    def test_hooks_outside_transition_process_run_as_script(self):
+        '''In-process hooks need a transition process main thread'''
+        spec = 'tests.test_transitions:hook_ok'
+        run, app = transitions.select_runner(spec)
+        self.assertIs(run, transitions.run_script)
+        self.assertIn('dag', app)
+        self.assertEqual(app.split()[-1], spec)
+
+        with mock.patch.object(transitions, '_hooks_isolated', True):
+            self.assertIs(transitions.select_runner(spec)[0], transitions.run_hook)
+            selected = []
+            thread = threading.Thread(
+                target=lambda: selected.append(transitions.select_runner(spec)[0]))
+            thread.start()
+            thread.join()
+            self.assertEqual(selected, [transitions.run_script])
+
+    def test_hook_exception_is_nonzero(self):
+        ret = transitions.run_hook('tests.test_transitions:hook_fails', self.job,
+                                   self.out, {}, timeout=10)
+        self.assertEqual(ret, 1)
+        self.assertIn('postprocess went wrong', open(self.out).read())
+
+    def test_hook_sys_exit_becomes_retcode(self):
+        '''sys.exit in a hook must not escape into the transition process'''
+        for code, expected in [('3', 3), ('0', 0), ('', 1)]:
+            ret = transitions.run_hook('tests.test_transitions:hook_exits', self.job,
+                                       self.out, {'HOOK_EXIT': code}, timeout=10)
+            self.assertEqual(ret, expected)
+            self.assertIn(f'return code {expected}', open(self.out).read())
+
+
+class CachedJob:
+    def __init__(self, state):
+        self.pk = uuid.uuid4()
+        self.state = state
+
+
+class JobCacheTests(unittest.TestCase):
+    def test_priority_order(self):
+        '''Jobs about to become runnable are visited before postprocessing and
+        dependency checks'''
+        cache = transitions.JobCache()
+        states = ['AWAITING_PARENTS', 'RUN_DONE', 'STAGED_IN', 'CREATED', 'READY']
+        cache.add(CachedJob(state) for state in states)
+        ordered = [job.state for job in cache]
+        self.assertEqual(ordered, ['STAGED_IN', 'READY', 'RUN_DONE',
+                                   'AWAITING_PARENTS', 'CREATED'])
+
+    def test_remove_and_refill(self):
+        cache = transitions.JobCache(limit=100, min_refill=5)
+        self.assertEqual(cache.refill_size(), 100)
+        jobs = [CachedJob('READY') for i in range(10)]
+        cache.add(jobs)
+        cache.remove([job.pk for job in jobs[:4]])
+        self.assertEqual(len(cache), 6)
+        size = cache.refill_size()
+        self.assertGreaterEqual(size, 5)
+        self.assertLessEqual(size, 94)
+
+    def test_drain_rate_seeded_from_first_batch(self):
+        '''The idle time before the first fill does not drag the rate to zero'''
+        cache = transitions.JobCache(limit=1000, min_refill=16)
+        with mock.patch('time.time', return_value=0.0):
+            cache._last_refill = 0.0
+            self.assertEqual(cache.refill_size(), 1000)
+        jobs = [CachedJob('READY') for i in range(200)]
+        cache.add(jobs)
+        cache.remove([job.pk for job in jobs[:100]])
+        with mock.patch('time.time', return_value=10.0):
+            size = cache.refill_size()
+        self.assertEqual(cache.drain_rate, 10.0)
+        self.assertEqual(size, min(900, 2 * 10 * transitions.REFRESH_PERIOD))
+
+    def test_class_quotas(self):
+        quotas = transitions.class_quotas(101)
+        self.assertEqual(sum(quotas), 101)
+        self.assertEqual(quotas, [51, 30, 20])